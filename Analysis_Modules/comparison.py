@@ -0,0 +1,278 @@
+# Downloaded python packages
+import numpy as np
+import csv
+import re
+import traceback
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+# From the Modules folder
+from DicomModules.Processing_Modules.instrumentation import Stage, Count
+
+
+ComparisonCase = namedtuple('ComparisonCase', ['case_id', 'image_dir', 'reference_path', 'test_path'])
+
+REPORT_FIELDS = ['CaseID', 'ROIName', 'ReferenceROINumber', 'TestROINumber', 'ReferenceVolumeCC', 'TestVolumeCC',
+                 'Dice', 'HD95', 'MSD', 'MaxDistance', 'Error']
+
+
+def RoiNames(rt):
+    '''
+    Returns a dictionary from the ROI numbers of the
+    RtStruct rt to their names
+    '''
+
+    return {roi.ROINumber: str(roi.get('ROIName', '')) for roi in rt.get('StructureSetROISequence', [])}
+
+
+def MatchRoisByName(reference, test, names = None):
+    '''
+    Returns a list of tuples (name, reference ROI number, test
+    ROI number) for the ROIs of the RtStructs reference and
+    test with the same name. Names are compared without case,
+    spaces, dashes or underscores.
+
+    Optional Parameters:
+        names: Only ROIs with these names are matched
+    '''
+
+    wanted = None if names is None else {_normalize(name) for name in names}
+
+    test_numbers = {}
+
+    for number, name in RoiNames(test).items():
+        test_numbers.setdefault(_normalize(name), number)
+
+    matches = []
+
+    for number, name in RoiNames(reference).items():
+
+        key = _normalize(name)
+
+        if key in test_numbers and (wanted is None or key in wanted):
+            matches.append((name, number, test_numbers[key]))
+
+    return matches
+
+
+def CompareMasks(reference_mask, test_mask):
+    '''
+    Returns a dictionary with the keys ReferenceVolumeCC,
+    TestVolumeCC, Dice, HD95, MSD and MaxDistance comparing
+    two sITK masks on the same grid (values above 0 are
+    inside). Only the bounding box of both masks is used and
+    surface distances are found with KD-trees over the
+    physical positions of the surface voxels.
+    '''
+
+    import SimpleITK as sITK
+    from scipy import ndimage
+    from scipy.spatial import cKDTree
+    from DicomModules.Processing_Modules.contours import IndexToPhysicalMatrix
+    from DicomModules.Analysis_Modules.margins import SummarizeSurfaceDistances
+
+    a = sITK.GetArrayViewFromImage(reference_mask) > 0
+
+    b = sITK.GetArrayViewFromImage(test_mask) > 0
+
+    voxel_cc = float(np.prod(reference_mask.GetSpacing())) / 1000.0
+
+    volume_a = int(np.count_nonzero(a))
+
+    volume_b = int(np.count_nonzero(b))
+
+    result = {'ReferenceVolumeCC': volume_a * voxel_cc, 'TestVolumeCC': volume_b * voxel_cc, 'Dice': float('nan'),
+              'HD95': float('nan'), 'MSD': float('nan'), 'MaxDistance': float('nan')}
+
+    if volume_a == 0 and volume_b == 0:
+        return result
+
+    region, offset = _bounding_box(a | b)
+
+    a = a[region]
+
+    b = b[region]
+
+    result['Dice'] = 2.0 * np.count_nonzero(a & b) / (volume_a + volume_b)
+
+    if volume_a == 0 or volume_b == 0:
+        return result
+
+    matrix, origin = IndexToPhysicalMatrix(reference_mask)
+
+    surfaces = []
+
+    for foreground in (a, b):
+
+        surface = foreground & ~ndimage.binary_erosion(foreground, border_value=0)
+
+        # (z, y, x) array indices to (x, y, z) physical points
+        index = np.argwhere(surface)[:, ::-1] + offset[::-1]
+
+        surfaces.append(index @ matrix.T + origin)
+
+    a_to_b, _ = cKDTree(surfaces[1]).query(surfaces[0])
+
+    b_to_a, _ = cKDTree(surfaces[0]).query(surfaces[1])
+
+    summary = SummarizeSurfaceDistances(a_to_b, b_to_a)
+
+    result['HD95'], result['MSD'], result['MaxDistance'] = summary.hd95, summary.mean, summary.max
+
+    Count('surface_points', len(a_to_b) + len(b_to_a))
+
+    return result
+
+
+def CompareStructureSets(images, reference, test, names = None, max_workers = None, case_id = ''):
+    '''
+    Returns a list of report rows (dictionaries with the keys
+    of REPORT_FIELDS), one for every ROI of the RtStruct test
+    matched by name to an ROI of the RtStruct reference. Both
+    are rasterized on the DicomImageArray images and the ROIs
+    are compared in parallel. An ROI without contours in either
+    structure set gets a row with NaN metrics and its Error
+    column filled in.
+
+    Optional Parameters:
+        names: Only ROIs with these names are compared
+        max_workers: Number of threads comparing ROIs
+        case_id: Written to the CaseID column
+    '''
+
+    from DicomModules.rt_and_image import RtAndImage
+    from DicomModules.Analysis_Modules.margins import ParallelMap
+
+    matches = MatchRoisByName(reference, test, names)
+
+    # ROIs can be declared in the structure set without any contours
+    rows = {}
+
+    for name, ref_key, test_key in matches:
+
+        missing = [label for label, rt, key in (('reference', reference, ref_key), ('test', test, test_key))
+                   if not len(rt.ContourDataDict.get(key, ()))]
+
+        if missing:
+            rows[name, ref_key, test_key] = _empty_row(case_id, name, ref_key, test_key,
+                                                       f"No contours in the {' and '.join(missing)} structure set")
+
+    compared = [match for match in matches if match not in rows]
+
+    with Stage('Comparison.StructureSets', case=case_id, rois=len(compared)):
+
+        reference_masks = RtAndImage(images, reference).GetRtMaskDict(0, 1, roi_keys=[match[1] for match in compared])
+
+        test_masks = RtAndImage(images, test).GetRtMaskDict(0, 1, roi_keys=[match[2] for match in compared])
+
+        metrics = ParallelMap(CompareMasks, [(reference_masks[ref_key], test_masks[test_key])
+                                             for _, ref_key, test_key in compared], max_workers)
+
+    for (name, ref_key, test_key), values in zip(compared, metrics):
+
+        row = _empty_row(case_id, name, ref_key, test_key, '')
+
+        row.update(values)
+
+        rows[name, ref_key, test_key] = row
+
+    return [rows[match] for match in matches]
+
+
+def CompareCases(cases, names = None, max_workers = None, progress = None):
+    '''
+    Returns a list of the report rows of every case in cases,
+    compared in parallel worker processes. A case that fails
+    gives one row with its Error column filled in.
+
+    cases: Iterable of ComparisonCase (case_id, image_dir,
+            reference_path, test_path), where image_dir holds
+            the images and the paths are the two RTSTRUCT files
+
+    Optional Parameters:
+        names: Only ROIs with these names are compared
+        max_workers: Number of worker processes
+        progress: Function called with the rows of each
+                    case when it finishes
+    '''
+
+    cases = [ComparisonCase(*case) for case in cases]
+
+    rows = []
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+
+        futures = [executor.submit(_compare_case, case, names) for case in cases]
+
+        for future in futures:
+
+            case_rows = future.result()
+
+            if progress is not None:
+                progress(case_rows)
+
+            rows.extend(case_rows)
+
+    return rows
+
+
+def WriteComparisonReport(rows, path):
+    '''
+    Writes the report rows to the csv file path
+    '''
+
+    with open(path, 'w', newline='') as fopen:
+
+        writer = csv.DictWriter(fopen, fieldnames=REPORT_FIELDS, extrasaction='ignore')
+
+        writer.writeheader()
+
+        for row in rows:
+            writer.writerow(row)
+
+
+def _compare_case(case, names):
+
+    from DicomModules.DICOM_Arrays.dicom_image_array import DicomImageArray
+    from DicomModules.DICOM_Objects.rtstruct import RtStruct
+
+    try:
+        # The directory may also hold the RTSTRUCT files
+        images = DicomImageArray.ProvideDir(case.image_dir).FilterDicoms(lambda dcm: 'PixelData' in dcm)
+
+        # Each process works on one case, so the ROIs are compared one at a time
+        return CompareStructureSets(images, RtStruct(case.reference_path), RtStruct(case.test_path), names, 1,
+                                    case.case_id)
+
+    except Exception:
+        return [{'CaseID': case.case_id, 'Error': traceback.format_exc(limit=3)}]
+
+
+def _empty_row(case_id, name, ref_key, test_key, error):
+
+    nan = float('nan')
+
+    return {'CaseID': case_id, 'ROIName': name, 'ReferenceROINumber': ref_key, 'TestROINumber': test_key,
+            'ReferenceVolumeCC': nan, 'TestVolumeCC': nan, 'Dice': nan, 'HD95': nan, 'MSD': nan, 'MaxDistance': nan,
+            'Error': error}
+
+
+def _normalize(name):
+
+    return re.sub(r'[\s_\-]+', '', str(name)).lower()
+
+
+def _bounding_box(foreground):
+
+    found = np.argwhere(foreground)
+
+    low = found.min(axis=0)
+
+    high = found.max(axis=0) + 1
+
+    # One voxel of background around the ROIs so the surfaces are closed
+    low = np.maximum(low - 1, 0)
+
+    high = np.minimum(high + 1, foreground.shape)
+
+    return tuple(slice(int(lo), int(hi)) for lo, hi in zip(low, high)), low
@@ -0,0 +1,183 @@
+# Downloaded python packages
+import numpy as np
+import contextvars
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# From the Modules folder
+from DicomModules.Processing_Modules.instrumentation import Stage, Count
+
+
+SurfaceDistanceSummary = namedtuple('SurfaceDistanceSummary', ['mean', 'hd95', 'max', 'mean_a_to_b', 'mean_b_to_a'])
+
+
+def ExpandMask(mask, margin, background_value = 0, mask_value = None):
+    '''
+    Returns a new sITK mask with the foreground of the sITK
+    mask "mask" grown by margin mm, or shrunk when margin is
+    negative (e.g. PTV = ExpandMask(CTV, 5)). The voxel
+    spacing is taken into account and only the bounding box
+    of the ROI padded by the margin is processed.
+
+    margin: mm for the same margin in every direction, or
+            (x, y, z) mm for a different margin along each
+            image axis, all of the same sign
+
+    Optional Parameters:
+        background_value: Value of the voxels outside the ROI
+        mask_value: Value of the voxels inside the new mask,
+                        by default the largest value of mask
+    '''
+
+    import SimpleITK as sITK
+    from scipy import ndimage
+
+    array = sITK.GetArrayViewFromImage(mask)
+
+    foreground = array != background_value
+
+    if mask_value is None:
+        mask_value = array.max() if foreground.any() else 1
+
+    margins = np.broadcast_to(np.asarray(margin, dtype=np.float64), (3,))[::-1]
+
+    if np.any(margins > 0) and np.any(margins < 0):
+        raise ValueError("All the margins must be of the same sign")
+
+    spacing = np.array(mask.GetSpacing(), dtype=np.float64)[::-1]
+
+    result = np.full(array.shape, background_value, dtype=array.dtype)
+
+    if foreground.any() and np.any(margins != 0):
+
+        grow = bool(np.any(margins > 0))
+
+        # Distances are measured in units of the margin, so the margin is at 1. Axes
+        # without a margin get a sampling large enough that no distance reaches 1 along them
+        sampling = np.where(margins != 0, spacing / np.where(margins != 0, np.abs(margins), 1.0), 1e6)
+
+        pad = np.ceil(np.abs(margins) / spacing).astype(int) + 1
+
+        region = _padded_box(foreground, pad if grow else np.ones(3, dtype=int))
+
+        crop = foreground[region]
+
+        with Stage('Margins.Expand', margin=float(margins.max() if grow else margins.min())):
+
+            if grow:
+                inside = crop | (ndimage.distance_transform_edt(~crop, sampling=sampling) <= 1.0)
+
+            else:
+                inside = ndimage.distance_transform_edt(crop, sampling=sampling) > 1.0
+
+            Count('voxels', crop.size)
+
+        result[region] = np.where(inside, mask_value, background_value)
+
+    elif foreground.any():
+        result[foreground] = mask_value
+
+    expanded = sITK.GetImageFromArray(result)
+
+    expanded.CopyInformation(mask)
+
+    return expanded
+
+
+def SurfaceDistances(mask_a, mask_b, background_value = 0):
+    '''
+    Returns a tuple of arrays (a_to_b, b_to_a) holding the
+    distance in mm from every surface voxel of mask_a to the
+    surface of mask_b, and the other way around. Both sITK
+    masks must be on the same grid. Only the bounding box of
+    both ROIs is processed.
+    '''
+
+    import SimpleITK as sITK
+    from scipy import ndimage
+
+    a = sITK.GetArrayViewFromImage(mask_a) != background_value
+
+    b = sITK.GetArrayViewFromImage(mask_b) != background_value
+
+    if not a.any() or not b.any():
+        return np.zeros(0), np.zeros(0)
+
+    spacing = np.array(mask_a.GetSpacing(), dtype=np.float64)[::-1]
+
+    region = _padded_box(a | b, np.ones(3, dtype=int))
+
+    with Stage('Margins.SurfaceDistances'):
+
+        surface_a = _surface(a[region])
+
+        surface_b = _surface(b[region])
+
+        to_b = ndimage.distance_transform_edt(~surface_b, sampling=spacing)
+
+        to_a = ndimage.distance_transform_edt(~surface_a, sampling=spacing)
+
+        Count('voxels', surface_a.size)
+
+    return to_b[surface_a], to_a[surface_b]
+
+
+def SummarizeSurfaceDistances(a_to_b, b_to_a):
+    '''
+    Returns the SurfaceDistanceSummary (mean, hd95, max,
+    mean_a_to_b, mean_b_to_a) of the distances returned by
+    SurfaceDistances. mean is the mean surface distance over
+    both directions and hd95 the 95th percentile Hausdorff
+    distance, the larger of the two directed percentiles.
+    '''
+
+    if len(a_to_b) == 0 or len(b_to_a) == 0:
+        nan = float('nan')
+        return SurfaceDistanceSummary(nan, nan, nan, nan, nan)
+
+    both = np.concatenate((a_to_b, b_to_a))
+
+    hd95 = max(np.percentile(a_to_b, 95), np.percentile(b_to_a, 95))
+
+    return SurfaceDistanceSummary(float(both.mean()), float(hd95), float(both.max()), float(a_to_b.mean()),
+                                  float(b_to_a.mean()))
+
+
+def ParallelMap(func, items, max_workers = None):
+    '''
+    Returns a list of func(*item) for every tuple of
+    arguments in items, computed in a thread pool
+    '''
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        # Run in a copy of the callers context so stage records keep their parent
+        futures = [executor.submit(contextvars.copy_context().run, func, *item) for item in items]
+
+        return [future.result() for future in futures]
+
+
+def _padded_box(foreground, pad):
+    '''
+    Returns a tuple of slices covering the foreground
+    padded by pad voxels along each axis
+    '''
+
+    region = []
+
+    for axis, length in enumerate(foreground.shape):
+
+        others = tuple(ind for ind in range(foreground.ndim) if ind != axis)
+
+        filled = np.flatnonzero(foreground.any(axis=others))
+
+        region.append(slice(max(int(filled[0]) - int(pad[axis]), 0), min(int(filled[-1]) + int(pad[axis]) + 1, length)))
+
+    return tuple(region)
+
+
+def _surface(foreground):
+
+    from scipy import ndimage
+
+    return foreground & ~ndimage.binary_erosion(foreground, border_value=0)
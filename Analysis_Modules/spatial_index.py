@@ -0,0 +1,353 @@
+# Downloaded python packages
+import numpy as np
+from collections import namedtuple
+
+# From the Modules folder
+from DicomModules.Processing_Modules.contours import _segment_distances
+
+
+# Contours of one ROI grouped by plane, see ContourIndex
+RoiPlanes = namedtuple('RoiPlanes', ['positions', 'starts', 'ends', 'boxes', 'segment_starts', 'segment_ends',
+                                     'half_length', 'tree'])
+
+# Largest number of point and edge pairs tested at once
+_CHUNK = 2 ** 22
+
+
+class ContourIndex:
+    '''
+    Spatial index over the contours of a structure set that
+    answers point in ROI and distance to ROI surface queries
+    for many points at once, without making masks.
+
+    The contours of each ROI are grouped by plane and sorted
+    by their position along the plane normal, with a bounding
+    box per plane. Containment uses a vectorized even-odd test
+    against the contours of the nearest plane, so holes are
+    handled as in the masks of RtAndImage. Distances use a
+    KD-tree over the midpoints of the contour edges.
+
+    Usage:
+        index = ContourIndex(rt.ContourDataDict)
+
+        inside = index.Contains(points)          -> {roi: (N,) bool}
+
+        distance = index.SurfaceDistance(points) -> {roi: (N,) mm}
+    '''
+
+    def __init__(self, contour_dict : dict, plane_tolerance = None):
+        '''
+        Returns a ContourIndex over the contours of contour_dict
+        (see RtStruct.ContourDataDict)
+
+        Optional Parameters:
+            plane_tolerance: Largest distance in mm along the normal
+                                between a point and a contour plane
+                                for the point to be tested against
+                                it. By default half the distance
+                                between contour planes
+        '''
+
+        from scipy.spatial import cKDTree
+
+        contours = {key: [np.column_stack((coords.x_values, coords.y_values, coords.z_values)).astype(np.float64)
+                          for coords in roi if len(coords.x_values)]
+                    for key, roi in contour_dict.items()}
+
+        all_contours = [points for roi in contours.values() for points in roi]
+
+        self._frame = _plane_frame(max(all_contours, key=len) if all_contours else np.eye(3))
+
+        self.Rois = {}
+
+        gaps = []
+
+        for key, roi in contours.items():
+
+            self.Rois[key] = self._build_roi(roi, cKDTree)
+
+            gaps.extend(np.diff(self.Rois[key].positions))
+
+        if plane_tolerance is None:
+            plane_tolerance = 0.5 * float(np.median(gaps)) if gaps else 0.5
+
+        self.plane_tolerance = plane_tolerance
+
+
+    def Contains(self, points, roi_keys = None):
+        '''
+        Returns a dictionary with ROI keys for keys and (N,)
+        boolean arrays for values, True where the point is
+        inside the ROI. Points lying exactly on a contour
+        may be counted on either side.
+
+        points: (N, 3) array of physical (x, y, z) points in mm
+
+        Optional Parameters:
+            roi_keys: The ROIs to test, by default all
+        '''
+
+        local = self._to_local(points)
+
+        return {key: self._contains(self.Rois[key], local) for key in self._keys(roi_keys)}
+
+
+    def RoisAt(self, point):
+        '''
+        Returns a list of the keys of the ROIs that
+        contain the physical point (x, y, z)
+        '''
+
+        inside = self.Contains(np.reshape(point, (1, 3)))
+
+        return [key for key, value in inside.items() if value[0]]
+
+
+    def SurfaceDistance(self, points, roi_keys = None, signed = False, neighbours = 8):
+        '''
+        Returns a dictionary with ROI keys for keys and (N,)
+        arrays of the distance in mm from each point to the
+        nearest contour of the ROI for values
+
+        points: (N, 3) array of physical (x, y, z) points in mm
+
+        Optional Parameters:
+            roi_keys: The ROIs to measure, by default all
+            signed: If True distances of points inside the
+                        ROI are negative
+            neighbours: Number of nearest edge pieces used for
+                            the first estimate of each distance.
+                            Only affects the speed, every edge
+                            that could be closer is checked
+        '''
+
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 3)
+
+        keys = self._keys(roi_keys)
+
+        inside = self.Contains(points, keys) if signed else {}
+
+        distances = {}
+
+        for key in keys:
+
+            roi = self.Rois[key]
+
+            if roi.tree is None:
+                distances[key] = np.full(len(points), np.inf)
+                continue
+
+            distance = _edge_distances(roi, points, neighbours)
+
+            if signed:
+                distance = np.where(inside[key], -distance, distance)
+
+            distances[key] = distance
+
+        return distances
+
+
+    def _keys(self, roi_keys):
+
+        return list(self.Rois) if roi_keys is None else [key for key in self.Rois if key in roi_keys]
+
+
+    def _to_local(self, points):
+
+        # Columns are (u, v) in the contour plane and the position along the normal
+        return np.asarray(points, dtype=np.float64).reshape(-1, 3) @ self._frame.T
+
+
+    def _build_roi(self, roi, tree_type):
+
+        planes = {}
+
+        for points in roi:
+
+            local = self._to_local(points)
+
+            if len(local) >= 3:
+                planes.setdefault(round(float(local[:, 2].mean()), 3), []).append(local[:, :2])
+
+        positions = np.array(sorted(planes), dtype=np.float64)
+
+        starts = []
+
+        ends = []
+
+        boxes = np.zeros((len(positions), 4))
+
+        for ind, position in enumerate(positions):
+
+            polygons = planes[float(position)]
+
+            starts.append(np.concatenate(polygons))
+
+            ends.append(np.concatenate([np.roll(polygon, -1, axis=0) for polygon in polygons]))
+
+            stacked = starts[-1]
+
+            boxes[ind] = (*stacked.min(axis=0), *stacked.max(axis=0))
+
+        if not roi:
+            return RoiPlanes(positions, starts, ends, boxes, np.zeros((0, 3)), np.zeros((0, 3)), 0.0, None)
+
+        edge_starts = np.concatenate(roi)
+
+        edge_ends = np.concatenate([np.roll(points, -1, axis=0) for points in roi])
+
+        # Long edges are split into pieces no longer than the typical edge, so a piece near a point has its midpoint near it
+        lengths = np.linalg.norm(edge_ends - edge_starts, axis=1)
+
+        piece_length = max(float(np.median(lengths)), 1e-6)
+
+        pieces = np.maximum(np.ceil(lengths / piece_length), 1).astype(np.int64)
+
+        edge = np.repeat(np.arange(len(lengths)), pieces)
+
+        first = np.repeat(np.cumsum(pieces) - pieces, pieces)
+
+        step = (edge_ends - edge_starts)[edge] / pieces[edge, None]
+
+        piece = (np.arange(len(edge)) - first)[:, None]
+
+        piece_starts = edge_starts[edge] + piece * step
+
+        piece_ends = piece_starts + step
+
+        half_length = 0.5 * float(np.linalg.norm(step, axis=1).max())
+
+        return RoiPlanes(positions, starts, ends, boxes, piece_starts, piece_ends, half_length,
+                         tree_type(0.5 * (piece_starts + piece_ends)))
+
+
+    def _contains(self, roi, local):
+
+        inside = np.zeros(len(local), dtype=bool)
+
+        if len(roi.positions) == 0:
+            return inside
+
+        position = local[:, 2]
+
+        # Nearest contour plane of every point
+        upper = np.minimum(np.searchsorted(roi.positions, position), len(roi.positions) - 1)
+
+        lower = np.maximum(upper - 1, 0)
+
+        closer = np.abs(roi.positions[lower] - position) <= np.abs(roi.positions[upper] - position)
+
+        plane = np.where(closer, lower, upper)
+
+        near = np.abs(roi.positions[plane] - local[:, 2]) <= self.plane_tolerance
+
+        box = roi.boxes[plane]
+
+        in_box = np.all((local[:, :2] >= box[:, :2]) & (local[:, :2] <= box[:, 2:]), axis=1)
+
+        candidate = near & in_box
+
+        for ind in np.unique(plane[candidate]):
+
+            selected = np.flatnonzero(candidate & (plane == ind))
+
+            inside[selected] = _even_odd(local[selected, :2], roi.starts[ind], roi.ends[ind])
+
+        return inside
+
+
+def _even_odd(points, starts, ends):
+    '''
+    Returns a boolean array, True for each of points (N, 2)
+    that crosses the edges from starts to ends an odd number
+    of times going in the +u direction
+    '''
+
+    inside = np.zeros(len(points), dtype=bool)
+
+    step = max(1, _CHUNK // max(len(starts), 1))
+
+    edge_u = ends[:, 0] - starts[:, 0]
+
+    edge_v = ends[:, 1] - starts[:, 1]
+
+    for begin in range(0, len(points), step):
+
+        u = points[begin:begin + step, 0, None]
+
+        v = points[begin:begin + step, 1, None]
+
+        straddles = (starts[:, 1] > v) != (ends[:, 1] > v)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            crossing_u = starts[:, 0] + edge_u * (v - starts[:, 1]) / edge_v
+
+        inside[begin:begin + step] = np.count_nonzero(straddles & (u < crossing_u), axis=1) % 2 == 1
+
+    return inside
+
+
+def _edge_distances(roi, points, neighbours):
+    '''
+    Returns the exact distance from each of points (N, 3)
+    to the nearest edge of the RoiPlanes roi. The nearest
+    pieces by midpoint give an upper bound, then every
+    piece whose midpoint is within the bound plus half a
+    piece length is measured.
+    '''
+
+    count = min(neighbours, len(roi.segment_starts))
+
+    _, nearest = roi.tree.query(points, k=count)
+
+    nearest = nearest.reshape(len(points), count)
+
+    repeated = np.repeat(points, count, axis=0)
+
+    bound = _segment_distances(repeated, roi.segment_starts[nearest.ravel()],
+                               roi.segment_ends[nearest.ravel()]).reshape(len(points), count).min(axis=1)
+
+    distance = np.empty(len(points))
+
+    step = max(1, _CHUNK // max(len(roi.segment_starts), 1))
+
+    for begin in range(0, len(points), step):
+
+        chunk = points[begin:begin + step]
+
+        candidates = roi.tree.query_ball_point(chunk, bound[begin:begin + step] + roi.half_length + 1e-9)
+
+        counts = np.fromiter((len(found) for found in candidates), dtype=np.int64, count=len(chunk))
+
+        segment = np.fromiter((ind for found in candidates for ind in found), dtype=np.int64, count=int(counts.sum()))
+
+        measured = _segment_distances(np.repeat(chunk, counts, axis=0), roi.segment_starts[segment],
+                                      roi.segment_ends[segment])
+
+        # Every point has at least the pieces that gave its bound
+        distance[begin:begin + step] = np.minimum.reduceat(measured, np.cumsum(counts) - counts)
+
+    return distance
+
+
+def _plane_frame(points):
+    '''
+    Returns a 3 x 3 matrix whose rows are two in plane axes
+    and the normal of the plane that best fits points
+    '''
+
+    points = np.asarray(points, dtype=np.float64)
+
+    _, _, rows = np.linalg.svd(points - points.mean(axis=0))
+
+    normal = rows[2] if len(points) >= 3 else np.array([0.0, 0.0, 1.0])
+
+    # Keep the normal pointing along +z, +y or +x so axial contours use (x, y, z)
+    if normal[np.argmax(np.abs(normal))] < 0:
+        normal = -normal
+
+    u = np.cross([0.0, 1.0, 0.0], normal) if abs(normal[1]) < 0.9 else np.cross(normal, [0.0, 0.0, 1.0])
+
+    u /= np.linalg.norm(u)
+
+    return np.vstack((u, np.cross(normal, u), normal))
@@ -0,0 +1,121 @@
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+
+# Modules that should only be imported by the interactive or image functions that need them
+HEAVY_MODULES = ['tkinter', 'matplotlib', 'SimpleITK', 'skimage']
+
+DEFAULT_TARGETS = [
+    'DicomModules.DICOM_Objects.Base_Class.dicom_processing',
+    'DicomModules.DICOM_Objects.dicom_image',
+    'DicomModules.DICOM_Objects.rtstruct',
+    'DicomModules.DICOM_Arrays.dicom_array',
+    'DicomModules.DICOM_Arrays.dicom_image_array',
+    'DicomModules.rt_and_image',
+]
+
+_PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+'''
+
+
+def _package_parent():
+    '''
+    Returns the directory that contains the
+    DicomModules package so that the child
+    interpreters can import it
+    '''
+
+    return os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def ColdImport(module : str, repeats = 5):
+    '''
+    Returns a dictionary describing the cost of importing
+    "module" in a fresh interpreter. Every repeat starts a
+    new python process so nothing is cached in sys.modules.
+
+    The dictionary contains the median and minimum import
+    time in seconds, and the heavy modules (see HEAVY_MODULES)
+    that were loaded as a side effect of the import.
+    '''
+
+    env = dict(os.environ)
+
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [_package_parent(), env.get('PYTHONPATH')]))
+
+    # Mimic a headless worker, importing must not need a display
+    env.pop('DISPLAY', None)
+
+    times = []
+
+    heavy = []
+
+    for _ in range(repeats):
+
+        result = subprocess.run([sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                capture_output=True, text=True, env=env)
+
+        if result.returncode != 0:
+            return {'module': module, 'error': result.stderr.strip().splitlines()[-1]}
+
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+
+        times.append(probe['seconds'])
+
+        heavy = probe['heavy']
+
+    return {
+        'module': module,
+        'median_seconds': statistics.median(times),
+        'min_seconds': min(times),
+        'heavy_modules_loaded': heavy,
+    }
+
+
+def RunColdImportBenchmark(modules = None, repeats = 5):
+    '''
+    Returns a list with the result of ColdImport
+    for every module in "modules", by default the
+    public modules of the package
+    '''
+
+    if modules is None:
+        modules = DEFAULT_TARGETS
+
+    return [ColdImport(module, repeats) for module in modules]
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Time importing the package in fresh interpreters")
+
+    parser.add_argument('--repeats', type=int, default=5)
+
+    parser.add_argument('--out', default=None, help="Write the results to this json file")
+
+    args = parser.parse_args()
+
+    results = RunColdImportBenchmark(repeats=args.repeats)
+
+    for res in results:
+
+        if 'error' in res:
+            print(f"{res['module']:<55} FAILED {res['error']}")
+
+        else:
+            print(f"{res['module']:<55} {res['median_seconds'] * 1000:8.1f} ms  heavy: {', '.join(res['heavy_modules_loaded']) or '-'}")
+
+    if args.out:
+
+        with open(args.out, 'w') as fopen:
+            json.dump(results, fopen, indent=2)
@@ -0,0 +1,384 @@
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+from collections import namedtuple
+
+# From the Modules folder
+from DicomModules.Benchmarks.synthetic_data import WriteSyntheticCase
+from DicomModules.Benchmarks.cold_import import RunColdImportBenchmark, _package_parent
+from DicomModules.DICOM_Arrays.dicom_array import DicomArray
+from DicomModules.DICOM_Objects.rtstruct import RtStruct
+from DicomModules.rt_and_image import RtAndImage
+
+
+CaseSize = namedtuple("CaseSize", ["Name", "Slices", "Rows", "Rois", "PointsPerContour"])
+
+SIZES = {
+    'small': CaseSize('small', 32, 128, 4, 32),
+    'medium': CaseSize('medium', 96, 256, 16, 128),
+    'large': CaseSize('large', 200, 512, 60, 256),
+}
+
+
+_PROBE = '''
+import json
+from DicomModules.Benchmarks.run_benchmarks import _entry_point_memory
+print(json.dumps(_entry_point_memory(*{args!r})))
+'''
+
+
+def _memory_status():
+    '''
+    Returns (current, peak) resident set size of the
+    process in bytes. current is None where only the
+    peak is available, both are None where neither is
+    '''
+
+    try:
+        with open('/proc/self/status') as fopen:
+            fields = dict(line.split(':', 1) for line in fopen if ':' in line)
+
+        return int(fields['VmRSS'].split()[0]) * 1024, int(fields['VmHWM'].split()[0]) * 1024
+
+    except (OSError, KeyError, ValueError):
+        pass
+
+    try:
+        import resource
+
+    except ImportError:
+        return None, None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes, macOS reports bytes
+    return None, peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _reset_peak_memory():
+    '''
+    Returns True if the peak resident set size of
+    the process was reset to its current size, which
+    is only possible on Linux
+    '''
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as fopen:
+            fopen.write('5')
+
+        return True
+
+    except OSError:
+        return False
+
+
+def _entry_points(case_dir, rt_path, out_dir):
+    '''
+    Returns a list of (name, setup, func) for each of the
+    package entry points on the case written to case_dir
+    '''
+
+    built = {}
+
+    # Only built when an entry point needs them, so a process measuring one entry point does not hold the others
+    def dcm_array():
+
+        if 'array' not in built:
+            built['array'] = DicomArray.ProvideDir(case_dir)
+
+        return built['array']
+
+    def rt_and_image():
+
+        if 'rt_and_image' not in built:
+            built['rt_and_image'] = RtAndImage.GroupArray(dcm_array())[0]
+
+        return built['rt_and_image']
+
+    def save(obj):
+
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+        obj.SaveAsNii(out_dir)
+
+    return [
+        ('DicomArray.ProvideDir', lambda: case_dir, DicomArray.ProvideDir),
+        ('RtAndImage.GroupArray', dcm_array, RtAndImage.GroupArray),
+        ('RtStruct.ContourDataDict', lambda: RtStruct(rt_path), lambda rt: rt.ContourDataDict),
+        ('DicomImageArray.sITKImage', lambda: rt_and_image().Images, lambda images: images.sITKImage),
+        ('RtAndImage.GetRtMaskDict', rt_and_image, lambda obj: obj.GetRtMaskDict()),
+        ('RtAndImage.SaveAsNii', rt_and_image, save),
+    ]
+
+
+def _entry_point_memory(name, case_dir, rt_path, out_dir):
+    '''
+    Returns a dictionary with the growth of the resident
+    set size of this process during one call of the named
+    entry point, see MeasureEntryPoint
+    '''
+
+    import gc
+
+    # Loading the library is a one off cost of the process, not of the entry point
+    import SimpleITK  # noqa: F401
+
+    _, setup, func = next(entry for entry in _entry_points(case_dir, rt_path, out_dir) if entry[0] == name)
+
+    arg = setup()
+
+    gc.collect()
+
+    reset = _reset_peak_memory()
+
+    current, peak = _memory_status()
+
+    func(arg)
+
+    _, new_peak = _memory_status()
+
+    if new_peak is None:
+        return {'peak_rss_delta_bytes': None, 'exact': False}
+
+    # Without a reset only growth above the peak reached during the setup is seen
+    base = current if reset and current is not None else peak
+
+    return {'peak_rss_delta_bytes': max(new_peak - base, 0), 'exact': reset and current is not None}
+
+
+def MeasureEntryPoint(name, case_dir, rt_path, out_dir):
+    '''
+    Returns a dictionary with the growth in bytes of the
+    peak resident set size during one call of the named
+    entry point, measured in a fresh python process so
+    earlier entry points do not hide it. Unlike
+    tracemalloc this includes the SimpleITK and other C++
+    allocations.
+
+    The dictionary holds peak_rss_delta_bytes, None if it
+    could not be measured, and exact, False where the peak
+    can not be reset after the setup (outside Linux) and
+    only growth above the setup peak is seen.
+    '''
+
+    env = dict(os.environ)
+
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [_package_parent(), env.get('PYTHONPATH')]))
+
+    env.pop('DISPLAY', None)
+
+    result = subprocess.run([sys.executable, '-c', _PROBE.format(args=(name, case_dir, rt_path, out_dir))],
+                            capture_output=True, text=True, env=env)
+
+    if result.returncode != 0:
+        return {'peak_rss_delta_bytes': None, 'exact': False, 'error': result.stderr.strip().splitlines()[-1]}
+
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def TimeEntryPoint(name, setup, func, repeats):
+    '''
+    Returns a dictionary with the timings of calling
+    func(setup()) "repeats" times. The setup is not
+    timed. One additional call is traced with tracemalloc
+    to record the peak python and numpy memory of func.
+    '''
+
+    times = []
+
+    for _ in range(repeats):
+
+        arg = setup()
+
+        start = time.perf_counter()
+
+        func(arg)
+
+        times.append(time.perf_counter() - start)
+
+    arg = setup()
+
+    tracemalloc.start()
+
+    try:
+        func(arg)
+
+        _, peak = tracemalloc.get_traced_memory()
+
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'entry_point': name,
+        'seconds': times,
+        'median_seconds': statistics.median(times),
+        'min_seconds': min(times),
+        'peak_traced_bytes': peak,
+    }
+
+
+def BenchmarkCase(size : CaseSize, work_dir : str, repeats = 3):
+    '''
+    Writes a synthetic case of the given size to
+    work_dir and returns a list with the results of
+    TimeEntryPoint and MeasureEntryPoint for each of
+    the package entry points.
+    '''
+
+    case_dir = os.path.join(work_dir, size.Name, 'dicom')
+
+    out_dir = os.path.join(work_dir, size.Name, 'nii')
+
+    paths = WriteSyntheticCase(case_dir, slices=size.Slices, rows=size.Rows, rois=size.Rois,
+                               points_per_contour=size.PointsPerContour)
+
+    rt_path = paths[-1]
+
+    entry_points = _entry_points(case_dir, rt_path, out_dir)
+
+    results = []
+
+    for name, setup, func in entry_points:
+
+        res = TimeEntryPoint(name, setup, func, repeats)
+
+        res.update(MeasureEntryPoint(name, case_dir, rt_path, out_dir))
+
+        res['case'] = size._asdict()
+
+        results.append(res)
+
+    return results
+
+
+def RunBenchmarks(sizes = ('small', 'medium'), repeats = 3, work_dir = None, cold_import = True):
+    '''
+    Returns a dictionary holding the environment the
+    benchmarks ran in and the results of BenchmarkCase
+    for each of the named sizes (see SIZES).
+
+    Optional Parameters:
+        sizes: Names of the case sizes to run
+        repeats: Number of timed calls of each entry point
+        work_dir: Directory for the synthetic data, by default
+                    a temporary directory that is removed afterwards
+        cold_import: If True the cold import benchmark is included
+    '''
+
+    import numpy as np
+    import pydicom as pd
+    import SimpleITK as sITK
+
+    cleanup = work_dir is None
+
+    if cleanup:
+        work_dir = tempfile.mkdtemp(prefix='dicom_bench_')
+
+    try:
+        results = []
+
+        for size in sizes:
+            results.extend(BenchmarkCase(SIZES[size], work_dir, repeats))
+
+    finally:
+
+        if cleanup:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return {
+        'environment': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'numpy': np.__version__,
+            'pydicom': pd.__version__,
+            'SimpleITK': sITK.Version_VersionString(),
+        },
+        'results': results,
+        'cold_import': RunColdImportBenchmark() if cold_import else [],
+    }
+
+
+def CompareResults(baseline : dict, current : dict, threshold = 1.1):
+    '''
+    Returns a list of tuples (case, entry point, baseline
+    seconds, current seconds, ratio) for every entry point
+    present in both result dictionaries whose median time
+    grew by more than the factor threshold
+    '''
+
+    def key(res):
+        return res['case']['Name'], res['entry_point']
+
+    base = {key(res): res for res in baseline['results']}
+
+    regressions = []
+
+    for res in current['results']:
+
+        old = base.get(key(res))
+
+        if old is None or old['median_seconds'] == 0:
+            continue
+
+        ratio = res['median_seconds'] / old['median_seconds']
+
+        if ratio > threshold:
+            regressions.append(key(res) + (old['median_seconds'], res['median_seconds'], ratio))
+
+    return regressions
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark the package on synthetic CT and RTSTRUCT data")
+
+    parser.add_argument('--sizes', nargs='+', default=['small', 'medium'], choices=list(SIZES))
+
+    parser.add_argument('--repeats', type=int, default=3)
+
+    parser.add_argument('--out', default='benchmark_results.json', help="Json file the results are written to")
+
+    parser.add_argument('--work-dir', default=None, help="Keep the synthetic data in this directory")
+
+    parser.add_argument('--compare', default=None, help="Json file of an earlier run to compare against")
+
+    parser.add_argument('--threshold', type=float, default=1.1)
+
+    parser.add_argument('--no-cold-import', action='store_true')
+
+    args = parser.parse_args()
+
+    bench = RunBenchmarks(args.sizes, args.repeats, args.work_dir, not args.no_cold_import)
+
+    with open(args.out, 'w') as fopen:
+        json.dump(bench, fopen, indent=2)
+
+    for res in bench['results']:
+
+        rss = res['peak_rss_delta_bytes']
+
+        print(f"{res['case']['Name']:<8} {res['entry_point']:<28} {res['median_seconds'] * 1000:10.1f} ms"
+              f"  peak {res['peak_traced_bytes'] / 2 ** 20:8.1f} MiB"
+              f"  rss {'-' if rss is None else f'{rss / 2 ** 20:8.1f}':>8} MiB")
+
+    if args.compare:
+
+        with open(args.compare) as fopen:
+            regressions = CompareResults(json.load(fopen), bench, args.threshold)
+
+        for name, entry, old, new, ratio in regressions:
+            print(f"REGRESSION {name} {entry}: {old * 1000:.1f} ms -> {new * 1000:.1f} ms ({ratio:.2f}x)")
+
+        if regressions:
+            sys.exit(1)
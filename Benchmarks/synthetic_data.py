@@ -0,0 +1,212 @@
+# Downloaded python packages
+import numpy as np
+from pydicom.dataset import Dataset, FileDataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import generate_uid, ExplicitVRLittleEndian
+import os
+
+
+CT_IMAGE_STORAGE = '1.2.840.10008.5.1.4.1.1.2'
+
+RT_STRUCTURE_SET_STORAGE = '1.2.840.10008.5.1.4.1.1.481.3'
+
+
+def _new_dataset(sop_class_uid, sop_instance_uid):
+
+    meta = FileMetaDataset()
+
+    meta.MediaStorageSOPClassUID = sop_class_uid
+
+    meta.MediaStorageSOPInstanceUID = sop_instance_uid
+
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    ds = FileDataset(None, {}, file_meta=meta, preamble=b'\x00' * 128)
+
+    ds.is_little_endian = True
+
+    ds.is_implicit_VR = False
+
+    ds.SOPClassUID = sop_class_uid
+
+    ds.SOPInstanceUID = sop_instance_uid
+
+    return ds
+
+
+def WriteSyntheticCase(save_dir : str, slices = 64, rows = 256, rois = 8, points_per_contour = 64,
+                       pixel_spacing = 1.0, slice_thickness = 2.5, seed = 0):
+    '''
+    Writes an axial CT series and an RTSTRUCT that
+    references it to the directory save_dir and returns
+    a list of the written file paths.
+
+    Every ROI is an ellipsoid contoured on each slice
+    it intersects, with points_per_contour points per
+    contour. The images contain random noise around a
+    body shaped cylinder so that they compress and
+    decode like real data.
+
+    Optional Parameters:
+        slices: Number of CT slices
+        rows: Number of rows and columns of each slice
+        rois: Number of ROIs in the RTSTRUCT
+        points_per_contour: Number of points in each contour
+        pixel_spacing: In plane spacing in mm
+        slice_thickness: Distance between slices in mm
+        seed: Seed of the random number generator
+    '''
+
+    os.makedirs(save_dir, exist_ok=True)
+
+    rng = np.random.default_rng(seed)
+
+    patient_id = 'BENCH' + str(seed)
+
+    study_uid, series_uid, frame_uid = generate_uid(), generate_uid(), generate_uid()
+
+    origin = np.array([-(rows - 1) * pixel_spacing / 2, -(rows - 1) * pixel_spacing / 2, 0.0])
+
+    yy, xx = np.mgrid[:rows, :rows]
+
+    body = (xx - rows / 2) ** 2 + (yy - rows / 2) ** 2 < (0.45 * rows) ** 2
+
+    paths = []
+
+    image_uids = []
+
+    for ind in range(slices):
+
+        ds = _new_dataset(CT_IMAGE_STORAGE, generate_uid())
+
+        ds.Modality = 'CT'
+        ds.PatientID = patient_id
+        ds.PatientName = 'Synthetic^Benchmark'
+        ds.StudyInstanceUID = study_uid
+        ds.SeriesInstanceUID = series_uid
+        ds.FrameOfReferenceUID = frame_uid
+        ds.InstanceNumber = ind + 1
+
+        z = origin[2] + ind * slice_thickness
+
+        ds.ImagePositionPatient = [float(origin[0]), float(origin[1]), float(z)]
+        ds.ImageOrientationPatient = [1, 0, 0, 0, 1, 0]
+        ds.SliceLocation = float(z)
+        ds.PixelSpacing = [pixel_spacing, pixel_spacing]
+        ds.SliceThickness = slice_thickness
+
+        ds.Rows = rows
+        ds.Columns = rows
+        ds.SamplesPerPixel = 1
+        ds.PhotometricInterpretation = 'MONOCHROME2'
+        ds.BitsAllocated = 16
+        ds.BitsStored = 16
+        ds.HighBit = 15
+        ds.PixelRepresentation = 1
+        ds.RescaleSlope = 1
+        ds.RescaleIntercept = -1024
+
+        pixels = np.where(body, 1024, 24) + rng.normal(0, 20, (rows, rows))
+
+        ds.PixelData = pixels.astype(np.int16).tobytes()
+
+        path = os.path.join(save_dir, f'CT{ind:04d}.dcm')
+
+        ds.save_as(path, write_like_original=False)
+
+        paths.append(path)
+
+        image_uids.append((ds.SOPInstanceUID, z))
+
+    rt = _new_dataset(RT_STRUCTURE_SET_STORAGE, generate_uid())
+
+    rt.Modality = 'RTSTRUCT'
+    rt.PatientID = patient_id
+    rt.PatientName = 'Synthetic^Benchmark'
+    rt.StudyInstanceUID = study_uid
+    rt.SeriesInstanceUID = generate_uid()
+    rt.StructureSetLabel = 'Benchmark'
+
+    frame_ref = Dataset()
+
+    frame_ref.FrameOfReferenceUID = frame_uid
+
+    rt.ReferencedFrameOfReferenceSequence = Sequence([frame_ref])
+
+    structure_set_rois = []
+
+    roi_contours = []
+
+    angles = np.linspace(0, 2 * np.pi, points_per_contour, endpoint=False)
+
+    extent_z = (slices - 1) * slice_thickness
+
+    for roi_ind in range(rois):
+
+        # Ellipsoids of different sizes spread through the body
+        center = np.array([rng.uniform(-0.2, 0.2) * rows * pixel_spacing,
+                           rng.uniform(-0.2, 0.2) * rows * pixel_spacing,
+                           rng.uniform(0.3, 0.7) * extent_z])
+
+        radii = np.array([rng.uniform(0.03, 0.15) * rows * pixel_spacing,
+                          rng.uniform(0.03, 0.15) * rows * pixel_spacing,
+                          rng.uniform(0.1, 0.3) * extent_z])
+
+        roi_item = Dataset()
+
+        roi_item.ROINumber = roi_ind + 1
+        roi_item.ReferencedFrameOfReferenceUID = frame_uid
+        roi_item.ROIName = f'ROI_{roi_ind + 1}'
+        roi_item.ROIGenerationAlgorithm = 'AUTOMATIC'
+
+        structure_set_rois.append(roi_item)
+
+        contours = []
+
+        for sop_uid, z in image_uids:
+
+            scale = 1 - ((z - center[2]) / radii[2]) ** 2
+
+            if scale <= 0:
+                continue
+
+            points = np.column_stack((center[0] + radii[0] * np.sqrt(scale) * np.cos(angles),
+                                      center[1] + radii[1] * np.sqrt(scale) * np.sin(angles),
+                                      np.full(points_per_contour, z)))
+
+            image_ref = Dataset()
+
+            image_ref.ReferencedSOPClassUID = CT_IMAGE_STORAGE
+
+            image_ref.ReferencedSOPInstanceUID = sop_uid
+
+            contour = Dataset()
+
+            contour.ContourImageSequence = Sequence([image_ref])
+            contour.ContourGeometricType = 'CLOSED_PLANAR'
+            contour.NumberOfContourPoints = points_per_contour
+            contour.ContourData = [round(float(val), 4) for val in points.ravel()]
+
+            contours.append(contour)
+
+        roi_contour = Dataset()
+
+        roi_contour.ReferencedROINumber = roi_ind + 1
+
+        roi_contour.ROIDisplayColor = [255, 0, 0]
+
+        roi_contour.ContourSequence = Sequence(contours)
+
+        roi_contours.append(roi_contour)
+
+    rt.StructureSetROISequence = Sequence(structure_set_rois)
+
+    rt.ROIContourSequence = Sequence(roi_contours)
+
+    path = os.path.join(save_dir, 'RS.dcm')
+
+    rt.save_as(path, write_like_original=False)
+
+    paths.append(path)
+
+    return paths
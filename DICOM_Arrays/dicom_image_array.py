@@ -1,133 +1,453 @@
-import numpy as np
-import SimpleITK as sITK
-import os
-from collections import namedtuple
-
-
-from DicomModules.DICOM_Arrays.ABC.dicom_storage import DicomStorage
-from DicomModules.DICOM_Objects.dicom_image import DicomImage
-from DicomModules.Display_Modules.slice_viewer import SliceView
-
-class DicomImageArray(DicomStorage):
-
-    @property
-    def sITKImage(self):
-        '''
-        Returns an sITK image object
-        made from the images stored
-        in the dicocm array
-        '''
-
-        file_name_list = self.MapDicoms(lambda dcm: dcm.filename)
-
-        reader = sITK.ImageSeriesReader()
-
-        reader.SetFileNames(file_name_list)
-
-        return reader.Execute()
-
-
-    def _pass_set_checks(self, value) -> bool:
-
-        check = type(value) == DicomImage
-
-        return check
-        
-
-    def ViewSlices(self, sort_key = lambda dcm: dcm.ImagePositionPatient[2], cm = 'gray', **dicom_filters):
-        '''
-        View the MR slices of the dicom in an interactive
-        window, scrolling to move through the different
-        slices.
-
-        Optional Parameters:
-            cm: Colour map for use by the plotting function
-                    see matplotlib's color maps for more details.
-                    The default is "gray"
-            sort_key: The function describing how to sort the
-                        images for viewing, by default they are
-                        sorted by asscending z value
-            
-            **dicom_filters (filter parameters):
-                Only the dicoms that have the key as an attribute and
-                a matching value to dicom_filters[key] will have their
-                images displayed
-
-                Examples of possible dicom_filters:
-                    Modality = "MR"
-                    DiffusionBValue = 0.0
-                    SliceLocation = 10
-                    ...
-        '''
-
-        dcm_arr = self
-
-        filters = list(filter(lambda s: not s.startswith('_'), dicom_filters.keys()))
-
-        if not filters == []:
-
-            for fKey in filters:
-
-                dcm_arr = dcm_arr.FilterDicoms(lambda dcm: dcm[fKey].value == dicom_filters[fKey] if hasattr(dcm, fKey) else False)
-
-        if dcm_arr._dicoms == []:
-
-            msg = f"Empty DicomArray returned after applying the specified filters{': ' + ', '.join(filters)}"
-
-            raise Exception(msg)
-
-        dcm_arr.SortDicoms(sort_key)
-
-        image_offset_func = lambda item: [(0.5 - float(num) / float(item.PixelSpacing[0])) for num in item.ImagePositionPatient[:2]]
-
-        SliceViewerData = namedtuple("SliceViewerData", ["PixelData", "ContourCoords", "ContourOffset"])
-
-        plotting_data = dcm_arr.MapDicoms(lambda dcm: SliceViewerData(dcm.pixel_array, [np.array([]),np.array([])], image_offset_func(dcm)))
-
-        interactive = SliceView(plotting_data, cm)
-
-        interactive.mainloop()
-
-
-    def SaveImagesAsNii(self, save_path : str, include_gz = True):
-
-        '''
-        Saves the images within the image array as a .nii file or
-        .nii.gz if include_gz = true
-
-        save_path: str that contains the save path of the file,
-                    should not include any file extensions
-        '''
-        
-        dir_name = os.path.dirname(save_path)
-
-        if not os.path.isdir(dir_name):
-            
-            os.makedirs(dir_name)
-        
-        img = self.sITKImage
-
-        if include_gz:
-            extension = '.nii.gz'
-        
-        else:
-            extension = '.nii'
-            
-        sITK.WriteImage(img, save_path + extension)
-
-
-    def _make_new_class(self, dicom_iter):
-        return DicomImageArray(dicom_iter)
-        
-    
-    @staticmethod
-    def CreateEmpty():
-        '''
-        Returns an empty DicomImageArray
-        '''
-        return DicomImageArray([])
-
-
-    @staticmethod
-    def _array_data_type(path):
-        return DicomImage(path)
+import numpy as np
+import os
+
+
+from DicomModules.DICOM_Arrays.ABC.dicom_storage import DicomStorage
+from DicomModules.DICOM_Objects.dicom_image import DicomImage
+from DicomModules.Export_Modules.nifti_writer import NiftiWriter
+from DicomModules.Processing_Modules.instrumentation import Stage, Count
+
+class DicomImageArray(DicomStorage):
+
+    @property
+    def sITKImage(self):
+        '''
+        Returns an sITK image object
+        made from the images stored
+        in the dicocm array
+        '''
+
+        import SimpleITK as sITK
+
+        # ImageSeriesReader takes the slices in the order given
+        file_name_list = [self._dicoms[ind].filename for ind in self.GeometricOrder()]
+
+        with Stage('DicomImageArray.sITKImage'):
+
+            Count('files', len(file_name_list))
+
+            reader = sITK.ImageSeriesReader()
+
+            reader.SetFileNames(file_name_list)
+
+            return reader.Execute()
+
+
+    def _pass_set_checks(self, value) -> bool:
+
+        check = type(value) == DicomImage
+
+        return check
+        
+
+    def ViewSlices(self, sort_key = None, cm = 'gray', **dicom_filters):
+        '''
+        View the MR slices of the dicom in an interactive
+        window, scrolling to move through the different
+        slices.
+
+        Optional Parameters:
+            cm: Colour map for use by the plotting function
+                    see matplotlib's color maps for more details.
+                    The default is "gray"
+            sort_key: The function describing how to sort the
+                        images for viewing, by default they are
+                        sorted along the slice normal, see
+                        SortDicoms
+            
+            **dicom_filters (filter parameters):
+                Only the dicoms that have the key as an attribute and
+                a matching value to dicom_filters[key] will have their
+                images displayed
+
+                Examples of possible dicom_filters:
+                    Modality = "MR"
+                    DiffusionBValue = 0.0
+                    SliceLocation = 10
+                    ...
+        '''
+
+        from DicomModules.Display_Modules.slice_viewer import SliceView, SliceViewerData
+
+        dcm_arr = self
+
+        filters = list(filter(lambda s: not s.startswith('_'), dicom_filters.keys()))
+
+        if not filters == []:
+
+            for fKey in filters:
+
+                dcm_arr = dcm_arr.FilterDicoms(lambda dcm: dcm[fKey].value == dicom_filters[fKey] if hasattr(dcm, fKey) else False)
+
+        if dcm_arr._dicoms == []:
+
+            msg = f"Empty DicomArray returned after applying the specified filters{': ' + ', '.join(filters)}"
+
+            raise Exception(msg)
+
+        dcm_arr.SortDicoms(sort_key)
+
+        image_offset_func = lambda item: [(0.5 - float(num) / float(item.PixelSpacing[0])) for num in item.ImagePositionPatient[:2]]
+
+        plotting_data = dcm_arr.MapDicoms(lambda dcm: SliceViewerData(dcm.pixel_array, [np.array([]),np.array([])], image_offset_func(dcm)))
+
+        interactive = SliceView(plotting_data, cm)
+
+        interactive.mainloop()
+
+
+    def SortDicoms(self, sort_key = None):
+        '''
+        Returns None and mutates the object by 
+        sorting the images stored in the object.
+
+        Optional Parameters:
+            sort_key: A function that returns the result
+                        to be sorted on. By default the images
+                        are sorted by their position along the
+                        normal of the image plane, which is
+                        correct for axial, sagittal, coronal
+                        and oblique stacks
+        '''
+
+        if sort_key is not None:
+
+            super().SortDicoms(sort_key)
+
+            return
+
+        order = self.GeometricOrder()
+
+        self._dicoms = [self._dicoms[ind] for ind in order]
+
+        self._set_geometric_order(np.arange(len(self._dicoms)))
+
+
+    def GeometricOrder(self):
+        '''
+        Returns an array of the indices that sort the
+        images along the normal of the image plane of
+        the first image. The positions are read from the
+        headers once and the order is cached until the
+        images in the array change. Images without
+        position or orientation keep their order.
+        '''
+
+        cached = getattr(self, '_geometric_order', None)
+
+        if cached is not None and cached[0] == tuple(map(id, self._dicoms)):
+            return cached[1]
+
+        from DicomModules.Processing_Modules.series_validation import SlicePositions
+
+        spatial = all('ImagePositionPatient' in dcm and 'ImageOrientationPatient' in dcm for dcm in self._dicoms)
+
+        if self._dicoms and spatial:
+            order = np.argsort(SlicePositions(self._dicoms), kind='stable')
+
+        else:
+            order = np.arange(len(self._dicoms))
+
+        self._set_geometric_order(order)
+
+        return order
+
+
+    def _set_geometric_order(self, order):
+
+        self._geometric_order = (tuple(map(id, self._dicoms)), order)
+
+
+    def SplitSeries(self, tolerance = 0.01, valid_only = False):
+        '''
+        Returns a list of SeriesStack (images, report) tuples,
+        one for each geometrically consistent stack of images
+        in the array. Images are grouped by SeriesInstanceUID,
+        orientation, pixel spacing, size, b-value and echo, and
+        sorted along the slice normal. Only the headers are
+        used, so no pixel data is decoded.
+
+        images is a DicomImageArray, report is a GeometryReport
+        (key, slices, spacing, first_position, last_position,
+        missing, duplicates, uneven, valid), see
+        Processing_Modules.series_validation
+
+        Optional Parameters:
+            tolerance: Distance in mm under which two slices are
+                        at the same position, and by which the
+                        spacing between slices may vary
+            valid_only: If True only stacks without missing or
+                            duplicate slices and with even spacing
+                            are returned
+        '''
+
+        from DicomModules.Processing_Modules.series_validation import SplitStacks, SeriesStack
+
+        with Stage('DicomImageArray.SplitSeries'):
+
+            stacks = SplitStacks(self._dicoms, tolerance)
+
+            Count('stacks', len(stacks))
+
+        split = []
+
+        for images, report in stacks:
+
+            if report.valid or not valid_only:
+
+                stack = DicomImageArray(images)
+
+                if report.first_position is not None:
+                    # The stack is already sorted along its normal
+                    stack._set_geometric_order(np.arange(stack.Length()))
+
+                split.append(SeriesStack(stack, report))
+
+        return split
+
+
+    def ValidateGeometry(self, tolerance = 0.01):
+        '''
+        Returns a list of the GeometryReport of every stack
+        in the array, see SplitSeries. The array holds one
+        valid volume when the list has one report and that
+        report is valid.
+        '''
+
+        return [report for _, report in self.SplitSeries(tolerance)]
+
+
+    def SaveImagesAsNii(self, save_path : str, include_gz = True, compression_level = None):
+
+        '''
+        Saves the images within the image array as a .nii file or
+        .nii.gz if include_gz = true
+
+        save_path: str that contains the save path of the file,
+                    should not include any file extensions
+
+        Optional Parameters:
+            compression_level: int between 0 and 9 giving the
+                                gzip level, None uses the
+                                SimpleITK default
+        '''
+        
+        dir_name = os.path.dirname(save_path)
+
+        if not os.path.isdir(dir_name):
+            
+            os.makedirs(dir_name)
+        
+        img = self.sITKImage
+
+        with NiftiWriter(include_gz, compression_level, max_workers=1) as writer:
+
+            writer.Submit(img, save_path)
+
+
+    def SaveImagesAsChunked(self, store_path : str, case_id : str, metadata = None, **store_kwargs):
+        '''
+        Writes the image volume of the array as the case
+        case_id of the chunked store on store_path, see
+        Export_Modules.chunked_store.ChunkedStore
+
+        Optional Parameters:
+            metadata: Dictionary of json serializable values
+                        stored with the case
+            **store_kwargs: Passed on to ChunkedStore.WriteCase,
+                                e.g. chunks or compression_level
+        '''
+
+        from DicomModules.Export_Modules.chunked_store import ChunkedStore
+
+        ChunkedStore(store_path).WriteCase(case_id, self.sITKImage, metadata=metadata, **store_kwargs)
+
+
+    def PublishShared(self, shared_volumes):
+        '''
+        Copies the image volume of the array into shared
+        memory owned by shared_volumes and returns the
+        SharedVolume descriptor (name, shape, dtype, origin,
+        spacing, direction). Worker processes read it without
+        a copy with AttachVolume or rebuild the sITK image with
+        SharedImage, see Processing_Modules.shared_volumes.
+
+        shared_volumes: SharedVolumes, the volume stays available
+                            until it is closed
+        '''
+
+        return shared_volumes.Publish(self.sITKImage)
+
+
+    def NormalizePixelArrays(self, upper, dtype = None, global_max = True):
+        '''
+        Returns None and normalizes the pixel arrays of
+        all the images between 0 and upper.
+
+        Optional Parameters:
+            dtype: numpy integer data type the pixels are
+                    stored as afterwards, by default the
+                    current data type is kept
+            global_max: If True every image is divided by the
+                            maximum over the whole array so the
+                            relative intensities between slices
+                            are kept, otherwise each image is
+                            normalized by its own maximum
+
+        Effects:
+            - Mutates the images stored in the object
+        '''
+
+        maximum = self.PixelMaximum() if global_max else None
+
+        for dcm in self._dicoms:
+            dcm.NormalizePixelArray(upper, dtype, maximum)
+
+
+    def WindowLevelPixelArrays(self, window, level, upper = 255, dtype = np.uint8):
+        '''
+        Returns None and applies DicomImage.WindowLevelPixelArray
+        to all the images stored in the object
+
+        Effects:
+            - Mutates the images stored in the object
+        '''
+
+        for dcm in self._dicoms:
+            dcm.WindowLevelPixelArray(window, level, upper, dtype)
+
+
+    def RescalePixelArrays(self, dtype = np.int16):
+        '''
+        Returns None and applies DicomImage.RescalePixelArray
+        to all the images stored in the object
+
+        Effects:
+            - Mutates the images stored in the object
+        '''
+
+        for dcm in self._dicoms:
+            dcm.RescalePixelArray(dtype)
+
+
+    def ClipPixelArrays(self, lower = None, upper = None):
+        '''
+        Returns None and applies DicomImage.ClipPixelArray
+        to all the images stored in the object
+
+        Effects:
+            - Mutates the images stored in the object
+        '''
+
+        for dcm in self._dicoms:
+            dcm.ClipPixelArray(lower, upper)
+
+
+    def PixelMaximum(self):
+        '''
+        Returns the largest stored pixel value over
+        all the images in the object. The decoded
+        arrays are cached by pydicom so a following
+        transform does not decode them again.
+        '''
+
+        return max(dcm.pixel_array.max() for dcm in self._dicoms)
+
+
+    def DecodePixelArrays(self, max_workers = None, processes = False, handler = None):
+        '''
+        Decodes the pixel data of all the images that are
+        not decoded yet in a pool of workers, instead of one
+        image at a time on the first access of pixel_array.
+        Returns the number of images decoded.
+
+        Optional Parameters:
+            max_workers: Number of workers, by default the
+                            number of cpus
+            processes: If True decode in worker processes,
+                        for handlers that hold the GIL such
+                        as the pure python RLE handler
+            handler: Name of the pydicom handler to use, e.g.
+                        'gdcm' or 'pillow'. By default the
+                        preferred handler of each transfer
+                        syntax, see BenchmarkDecoders
+        '''
+
+        from DicomModules.Processing_Modules.pixel_decoding import DecodeAll
+
+        return DecodeAll(self._dicoms, max_workers, processes, handler)
+
+
+    def BenchmarkDecoders(self, repeats = 3, sample = 16, select = True):
+        '''
+        Times every installed pixel data handler on the
+        transfer syntaxes of the images and returns a list of
+        dictionaries (TransferSyntaxUID, Handler, Frames,
+        Seconds, MBPerSecond, Error), one for every handler
+        and transfer syntax.
+
+        Optional Parameters:
+            repeats: Number of timed runs, the fastest is kept
+            sample: The most images of each transfer syntax used
+            select: If True the fastest handler of each transfer
+                        syntax is used by DecodePixelArrays from
+                        then on
+        '''
+
+        from DicomModules.Processing_Modules.pixel_decoding import BenchmarkHandlers
+
+        return BenchmarkHandlers(self._dicoms, repeats, sample, select)
+
+
+    def Transcode(self, transfer_syntax, save_dir = None, verify = True, overwrite = False, max_workers = None,
+                  processes = False):
+        '''
+        Rewrites the files of the images with the transfer
+        syntax "transfer_syntax" in parallel, keeping every
+        other tag, and returns a list of dictionaries (Source,
+        Destination, TransferSyntaxUID, SourceBytes, Bytes,
+        Checksum), one per file. The files on disk are used,
+        so unsaved changes to the images are not included.
+
+        Use pydicom.uid.ExplicitVRLittleEndian for the fastest
+        reading, or RLELossless / DeflatedExplicitVRLittleEndian
+        for smaller files.
+
+        Optional Parameters:
+            save_dir: Directory the new files are written to, by
+                        default the files are replaced in place
+            verify: If True every new file is read back and must
+                        decode to the same pixels (sha256 checksum)
+            overwrite: If False existing files in save_dir raise
+                        FileExistsError
+            max_workers: Number of workers, by default the number
+                            of cpus
+            processes: If True work in processes rather than
+                        threads
+
+        Effects:
+            - Without save_dir the files of the images are
+                overwritten, re-read the array to use them
+        '''
+
+        from DicomModules.Processing_Modules.transcoding import TranscodeFiles
+
+        return TranscodeFiles(self.MapDicoms(lambda dcm: dcm.filename), transfer_syntax, save_dir, verify, overwrite,
+                              max_workers, processes)
+
+
+    def _make_new_class(self, dicom_iter):
+        return DicomImageArray(dicom_iter)
+        
+    
+    @staticmethod
+    def CreateEmpty():
+        '''
+        Returns an empty DicomImageArray
+        '''
+        return DicomImageArray([])
+
+
+    @staticmethod
+    def _array_data_type(path):
+        return DicomImage(path)
@@ -0,0 +1,229 @@
+# Downloaded python packages
+import pydicom as pd
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# From the Modules folder
+from DicomModules.DICOM_Arrays.dicom_array import DicomArray
+from DicomModules.DICOM_Objects.Base_Class.dicom_processing import DicomProcessing
+from DicomModules.Processing_Modules.instrumentation import Stage, Count
+
+
+class DicomStream:
+    '''
+    Lazy, single pass counterpart of the DicomStorage
+    arrays for directories too large to hold in memory.
+    Files are only read while the stream is iterated and
+    only the objects waiting in the read ahead buffer are
+    held at once.
+
+    FilterDicoms and MapDicoms add steps to a generator
+    pipeline instead of building a new array:
+
+        stream = DicomStream.ProvideDir(path, header_only=True)
+
+        ct = stream.FilterDicoms(lambda dcm: dcm.Modality == 'CT')
+
+        for uid in ct.MapDicoms(lambda dcm: dcm.SeriesInstanceUID):
+            ...
+
+    Fields:
+        _source: str directory path or iterable of file paths
+        _steps: List of ('filter' | 'map', function)
+    '''
+
+    def __init__(self, source, array_type = DicomArray, header_only = False, specific_tags = None, read_ahead = 0,
+                 max_workers = None, recursive = False):
+        '''
+        Returns a DicomStream over the .dcm files of the
+        directory "source", or over an iterable of file paths
+
+        Optional Parameters:
+            array_type: DicomStorage subclass whose objects are
+                            read (e.g. DicomImageArray) and that
+                            Collect returns, by default DicomArray
+            header_only: If True plain pydicom datasets are read
+                            without their pixel data instead of
+                            array_type objects
+            specific_tags: With header_only, the only tags read
+            read_ahead: Number of files read in background threads
+                            ahead of the consumer, 0 reads each
+                            file when it is needed
+            max_workers: Number of reading threads, by default
+                            read_ahead
+            recursive: If True sub directories of source are
+                        searched as well
+        '''
+
+        self._source = source
+
+        self._array_type = array_type
+
+        self._header_only = header_only
+
+        self._specific_tags = specific_tags
+
+        self._read_ahead = read_ahead
+
+        self._max_workers = max_workers
+
+        self._recursive = recursive
+
+        self._steps = []
+
+
+    @classmethod
+    def ProvideDir(cls, dirPath, **stream_options):
+        '''
+        Returns a DicomStream over the .dcm files in the
+        directory dirPath, see __init__ for the options
+        '''
+
+        if not os.path.isdir(dirPath):
+
+            raise ValueError("The provided file path is not a real directory on this system")
+
+        return cls(dirPath, **stream_options)
+
+
+    def __iter__(self):
+
+        for dicom in self._read_all():
+
+            keep = True
+
+            for kind, func in self._steps:
+
+                if kind == 'filter':
+
+                    if not func(dicom):
+                        keep = False
+                        break
+
+                else:
+                    dicom = func(dicom)
+
+            if keep:
+                yield dicom
+
+
+    def FilterDicoms(self, func):
+        '''
+        Returns a new DicomStream that only yields the
+        items for which the function "func" evaluates
+        to true
+        '''
+
+        return self._with_step('filter', func)
+
+
+    def MapDicoms(self, func):
+        '''
+        Returns a new DicomStream that yields the function
+        "func" applied to every item, so further steps can
+        follow the map
+        '''
+
+        return self._with_step('map', func)
+
+
+    def Collect(self):
+        '''
+        Returns an array of the type array_type holding
+        every item of the stream that passes its checks.
+        Streams of plain datasets (header_only) or of other
+        items made by MapDicoms give a list of the items
+        instead. Only use on streams filtered down to a size
+        that fits in memory.
+        '''
+
+        items = list(self)
+
+        if self._header_only or not all(isinstance(item, DicomProcessing) for item in items):
+            return items
+
+        dicom_arr = self._array_type.CreateEmpty()
+
+        for dicom in items:
+
+            dicom_arr.Append(dicom)
+
+        return dicom_arr
+
+
+    def Paths(self):
+        '''
+        Returns a generator of the file paths of the
+        stream, found lazily with os.scandir
+        '''
+
+        if isinstance(self._source, (str, os.PathLike)):
+            return _scan_dir(self._source, self._recursive)
+
+        return iter(self._source)
+
+
+    def _with_step(self, kind, func):
+
+        stream = DicomStream(self._source, self._array_type, self._header_only, self._specific_tags, self._read_ahead,
+                             self._max_workers, self._recursive)
+
+        stream._steps = self._steps + [(kind, func)]
+
+        return stream
+
+
+    def _read(self, path):
+
+        if not self._header_only:
+            return self._array_type._array_data_type(path)
+
+        with Stage('DicomStream.ReadHeader'):
+
+            Count('files')
+
+            return pd.dcmread(path, stop_before_pixels=True, specific_tags=self._specific_tags)
+
+
+    def _read_all(self):
+
+        if self._read_ahead <= 0:
+
+            for path in self.Paths():
+                yield self._read(path)
+
+            return
+
+        with ThreadPoolExecutor(max_workers=self._max_workers or self._read_ahead) as executor:
+
+            pending = deque()
+
+            try:
+                for path in self.Paths():
+
+                    pending.append(executor.submit(self._read, path))
+
+                    if len(pending) > self._read_ahead:
+                        yield pending.popleft().result()
+
+                while pending:
+                    yield pending.popleft().result()
+
+            finally:
+                # Reads that have not started are dropped when the consumer stops early
+                for future in pending:
+                    future.cancel()
+
+
+def _scan_dir(dirPath, recursive):
+
+    with os.scandir(dirPath) as entries:
+
+        for entry in entries:
+
+            if entry.is_dir() and recursive:
+                yield from _scan_dir(entry.path, recursive)
+
+            elif entry.is_file() and entry.name.lower().endswith('.dcm'):
+                yield entry.path
@@ -1,227 +1,365 @@
-# Downloaded python packages
-import pydicom as pd
-from pydicom import filereader
-from pydicom.uid import UID
-from pydicom.filewriter import write_file_meta_info
-import tkinter as tk
-from tkinter import filedialog
-from tkinter import messagebox
-import matplotlib.pyplot as plt
-import os
-
-import pydicom as pd
-
-
-class DicomProcessing(pd.FileDataset):
-
-    '''
-    Class that aids in dicom file processing.
-    It inheirts from the pydicom FileDataset
-    object. As a result the DicomProcessing
-    object has all the fields and methods
-    that a pydicom FileDataset object has.
-    '''
-
-    def __init__(self, FilePath : str):
-
-        '''
-        Returns a DicomProcessing object
-
-        FilePath -> Str that represents a full 
-                    file path to a valid .dcm file
-        
-        Optional parameters
-
-        FileMetaInfo -> Object created by pydicoms 
-                            FileMetaDataset function
-        '''
-
-        dataSet = pd.dcmread(FilePath)
-
-        metaInfo = filereader.read_file_meta_info(FilePath)
-
-        super().__init__(FilePath, dataSet, file_meta=metaInfo)
-
-
-    # def Copy(self):
-    #     '''
-    #     Reutrns a new object instance containing
-    #     all the data stored withing the
-    #     DICOM file associated with the object.
-    #     If updates have been made to the data, and
-    #     they have not been saved into a dicom
-    #     '''
-
-    #     return DicomProcessing(self.filename)
-
-    def WriteAttributesTxt(self, filename : str):
-
-        '''
-        This method will write a .txt file to the current working directory. 
-        The file contains all of the names of all the attributes that are 
-        stored in the object contains
-
-        filename -> Str that is the name of the txt file to create
-                        (e.g. "Names.txt")
-        '''
-        
-        fpath = os.getcwd() + os.path.sep + filename
-
-        if os.path.isfile(fpath):
-            
-            root = tk.Tk()
-            
-            root.withdraw()
-
-            message = 'The file which you want to write to already exists in the current directory. In proceeding, the contents' + \
-                        f' of the file {filename} will be overridden. Do you wish to proceed?'
-
-            answer = messagebox.askyesno('File Exists', message)
-
-            if answer:
-                method = 'w'
-            
-            else:
-                raise InterruptedError("User does not want to continue")
-            
-        else:
-            method = 'x'
-
-            
-        with open(fpath, method) as fopen:
-
-            header = f'DICOM attributes for file on path: {self.filename}\n'
-
-            attr = '\n'.join(self.dir())
-
-            fopen.write(header)
-
-            fopen.write(attr)
-    
-    
-    def PrintDicomAttributes(self):
-        '''
-        Returns None and prints all the dicom
-        object attributes to the console
-
-        Effects:
-            - prints to the console
-
-        '''
-        
-        s = '\n'.join(self.dir())
-
-        print(s)
-
-
-    @classmethod
-    def SelectFile(cls):
-        '''
-        Returns a DicomProcessing object containing the
-        data in the selected file
-        '''
-        root = tk.Tk()
-
-        root.withdraw()
-
-        filePath = filedialog.askopenfilename(filetypes=[('DICOM Files', '*.dcm')])
-
-        if not filePath:
-            raise InterruptedError('User does not wish to proceed')
-        
-        return cls(filePath)
-    
-
-    @staticmethod
-    def CreateNewDicom(SavePath : str, FileMetaDataDict, DicomAttributeDict = None):
-        '''
-        Creates a DicomProcessing object for the intention
-        of creating a new dicom file.
-
-        Required Parameters:
-            SavePath: A str representing the full path to where you would
-                        like the dicom to be saved
-            FileMetaData: A dictionary that contains the following key 
-                            value pairs:
-                                    
-                                    MediaStorageSOPClassUID : str
-                                    MediaStorageSOPInstanceUID : str
-                                    TransferSyntaxUID : str
-
-                            Other header info can be added, check the
-                            DICOM standard part 10 chapter 7.
-                            
-
-        Optional Parameters:
-            DicomAttributeDict: A dicitonary with keys and values of
-                                    type str. The keys must be the name 
-                                    of a valid dicom attribute. If this
-                                    is true then the dicom attribute with
-                                    that name will be populated by the 
-                                    key's associated value.
-        '''
-
-        if DicomAttributeDict is None:
-            DicomAttributeDict = {}
-
-        required_keys = [  
-                         "MediaStorageSOPClassUID",
-                         "MediaStorageSOPInstanceUID",
-                         "TransferSyntaxUID"
-                         ]
-        
-        for req in required_keys:
-
-            if not req in FileMetaDataDict:
-                raise ValueError(f"Assure FileMetaDataDict has the following keys {required_keys}")
-
-        method = 'xb'
-        
-        if not SavePath.endswith('.dcm'):
-
-            SavePath = SavePath + '.dcm'
-
-        if os.path.isfile(SavePath):
-            
-            root = tk.Tk()
-            root.withdraw()
-
-            user_answer = messagebox.askyesno("File Exists", f"File on path\n{SavePath}\nAlready exists, do you wish to overwrite it?")
-
-            if not user_answer:
-                raise InterruptedError("User decided not to overwrite the file")
-            
-            else:
-                method = 'wb'
-
-        fmd = pd.Dataset()
-
-        for key in required_keys:
-            
-            if key.endswith("UID"):
-
-                FileMetaDataDict[key] = UID(FileMetaDataDict[key])
-            
-            setattr(fmd, key, FileMetaDataDict[key])
-
-        with open(SavePath, method) as fopen:
-            
-            preamble = b'\x00' * 128
-
-            fopen.write(preamble)
-
-            fopen.write(b'DICM')
-
-            write_file_meta_info(fopen, fmd, enforce_standard=True)
-
-        dcm = pd.dcmread(SavePath)
-        # dcm = cls(SavePath)
-
-        for key in DicomAttributeDict:
-
-            setattr(dcm, key, DicomAttributeDict[key])
-
-        pd.dcmwrite(SavePath, dcm, write_like_original=False)
-
-        return None
-    
\ No newline at end of file
+# Downloaded python packages
+import pydicom as pd
+from pydicom.uid import UID, generate_uid
+from pydicom.dataset import FileDataset, FileMetaDataset
+import os
+
+import pydicom as pd
+
+# From the Modules folder
+from DicomModules.Processing_Modules.instrumentation import Stage, Count
+
+
+class DicomProcessing(pd.FileDataset):
+
+    '''
+    Class that aids in dicom file processing.
+    It inheirts from the pydicom FileDataset
+    object. As a result the DicomProcessing
+    object has all the fields and methods
+    that a pydicom FileDataset object has.
+    '''
+
+    def __init__(self, FilePath : str):
+
+        '''
+        Returns a DicomProcessing object
+
+        FilePath -> Str that represents a full 
+                    file path to a valid .dcm file
+        
+        Optional parameters
+
+        FileMetaInfo -> Object created by pydicoms 
+                            FileMetaDataset function
+        '''
+
+        with Stage('DicomProcessing.Read'):
+
+            # The file meta is read together with the dataset, so the file is only opened once
+            dataSet = pd.dcmread(FilePath)
+
+            Count('files')
+
+            Count('bytes_read', os.path.getsize(FilePath))
+
+        super().__init__(FilePath, dataSet, preamble=dataSet.preamble, file_meta=dataSet.file_meta,
+                         is_implicit_VR=dataSet.is_implicit_VR, is_little_endian=dataSet.is_little_endian)
+
+
+    # def Copy(self):
+    #     '''
+    #     Reutrns a new object instance containing
+    #     all the data stored withing the
+    #     DICOM file associated with the object.
+    #     If updates have been made to the data, and
+    #     they have not been saved into a dicom
+    #     '''
+
+    #     return DicomProcessing(self.filename)
+
+    def WriteAttributesTxt(self, filename : str):
+
+        '''
+        This method will write a .txt file to the current working directory. 
+        The file contains all of the names of all the attributes that are 
+        stored in the object contains
+
+        filename -> Str that is the name of the txt file to create
+                        (e.g. "Names.txt")
+        '''
+        
+        fpath = os.getcwd() + os.path.sep + filename
+
+        if os.path.isfile(fpath):
+
+            import tkinter as tk
+            from tkinter import messagebox
+            
+            root = tk.Tk()
+            
+            root.withdraw()
+
+            message = 'The file which you want to write to already exists in the current directory. In proceeding, the contents' + \
+                        f' of the file {filename} will be overridden. Do you wish to proceed?'
+
+            answer = messagebox.askyesno('File Exists', message)
+
+            if answer:
+                method = 'w'
+            
+            else:
+                raise InterruptedError("User does not want to continue")
+            
+        else:
+            method = 'x'
+
+            
+        with open(fpath, method) as fopen:
+
+            header = f'DICOM attributes for file on path: {self.filename}\n'
+
+            attr = '\n'.join(self.dir())
+
+            fopen.write(header)
+
+            fopen.write(attr)
+    
+    
+    def SaveDicom(self, SavePath : str, overwrite = False):
+        '''
+        Writes the object, including any changes made to
+        it, to the file SavePath in one pass
+
+        Optional Parameters:
+            overwrite: If False an existing file raises
+                        FileExistsError
+        '''
+
+        _write_dataset(SavePath, self, overwrite)
+
+
+    def PrintDicomAttributes(self):
+        '''
+        Returns None and prints all the dicom
+        object attributes to the console
+
+        Effects:
+            - prints to the console
+
+        '''
+        
+        s = '\n'.join(self.dir())
+
+        print(s)
+
+
+    @classmethod
+    def SelectFile(cls):
+        '''
+        Returns a DicomProcessing object containing the
+        data in the selected file
+        '''
+        import tkinter as tk
+        from tkinter import filedialog
+
+        root = tk.Tk()
+
+        root.withdraw()
+
+        filePath = filedialog.askopenfilename(filetypes=[('DICOM Files', '*.dcm')])
+
+        if not filePath:
+            raise InterruptedError('User does not wish to proceed')
+        
+        return cls(filePath)
+    
+
+    @staticmethod
+    def CreateNewDicom(SavePath : str, FileMetaDataDict, DicomAttributeDict = None, overwrite = None):
+        '''
+        Creates a new dicom file on SavePath. The dataset and
+        its file meta information are assembled in memory and
+        written to disk in a single pass.
+
+        Required Parameters:
+            SavePath: A str representing the full path to where you would
+                        like the dicom to be saved
+            FileMetaData: A dictionary that contains the following key 
+                            value pairs:
+                                    
+                                    MediaStorageSOPClassUID : str
+                                    MediaStorageSOPInstanceUID : str
+                                    TransferSyntaxUID : str
+
+                            Other header info can be added, check the
+                            DICOM standard part 10 chapter 7.
+                            
+
+        Optional Parameters:
+            DicomAttributeDict: A dicitonary with keys and values of
+                                    type str. The keys must be the name 
+                                    of a valid dicom attribute. If this
+                                    is true then the dicom attribute with
+                                    that name will be populated by the 
+                                    key's associated value.
+            overwrite: What to do when SavePath already exists. None
+                        asks the user in a dialog, True overwrites the
+                        file and False raises a FileExistsError
+        '''
+
+        dcm = DicomProcessing.BuildNewDicom(FileMetaDataDict, DicomAttributeDict)
+
+        if not SavePath.endswith('.dcm'):
+
+            SavePath = SavePath + '.dcm'
+
+        if overwrite is None and os.path.isfile(SavePath):
+
+            import tkinter as tk
+            from tkinter import messagebox
+            
+            root = tk.Tk()
+            root.withdraw()
+
+            user_answer = messagebox.askyesno("File Exists", f"File on path\n{SavePath}\nAlready exists, do you wish to overwrite it?")
+
+            if not user_answer:
+                raise InterruptedError("User decided not to overwrite the file")
+
+            overwrite = True
+
+        _write_dataset(SavePath, dcm, overwrite)
+
+        return None
+
+
+    @staticmethod
+    def BuildNewDicom(FileMetaDataDict, DicomAttributeDict = None):
+        '''
+        Returns a pydicom FileDataset that only exists in
+        memory, holding the file meta information in
+        FileMetaDataDict and the attributes in DicomAttributeDict.
+        See CreateNewDicom for the contents of the dictionaries.
+
+        The dataset can be used as the template of
+        CreateNewDicoms, or saved with
+        dcm.save_as(path, write_like_original=False)
+        '''
+
+        if DicomAttributeDict is None:
+            DicomAttributeDict = {}
+
+        required_keys = [  
+                         "MediaStorageSOPClassUID",
+                         "MediaStorageSOPInstanceUID",
+                         "TransferSyntaxUID"
+                         ]
+        
+        for req in required_keys:
+
+            if not req in FileMetaDataDict:
+                raise ValueError(f"Assure FileMetaDataDict has the following keys {required_keys}")
+
+        fmd = FileMetaDataset()
+
+        for key, value in FileMetaDataDict.items():
+            
+            if key.endswith("UID"):
+                value = UID(value)
+            
+            setattr(fmd, key, value)
+
+        dcm = FileDataset(None, {}, file_meta=fmd, preamble=b'\x00' * 128)
+
+        transfer_syntax = fmd.TransferSyntaxUID
+
+        dcm.is_little_endian = transfer_syntax.is_little_endian
+
+        dcm.is_implicit_VR = transfer_syntax.is_implicit_VR
+
+        for key in DicomAttributeDict:
+
+            setattr(dcm, key, DicomAttributeDict[key])
+
+        return dcm
+
+
+    @staticmethod
+    def CreateNewDicoms(SavePaths, Template, PerFileAttributes = None, overwrite = False, max_workers = None, processes = False):
+        '''
+        Writes one new dicom file for every path in SavePaths,
+        all made from the dataset Template (see BuildNewDicom),
+        concurrently. Returns a list of the written paths.
+
+        Each file gets a new SOPInstanceUID and matching
+        MediaStorageSOPInstanceUID, unless PerFileAttributes
+        gives one. The template itself is never modified.
+
+        Required Parameters:
+            SavePaths: Iterable of str paths of the files to write
+            Template: pydicom FileDataset with file meta information
+
+        Optional Parameters:
+            PerFileAttributes: Iterable of dictionaries, one per path,
+                                whose items replace the attributes of
+                                the template for that file
+            overwrite: If False existing files raise a FileExistsError,
+                        the default is False
+            max_workers: Number of files written concurrently,
+                            by default the number of cpus
+            processes: If True the files are written by a pool of
+                        processes instead of threads, which is faster
+                        for large numbers of small files
+        '''
+
+        SavePaths = [path if path.endswith('.dcm') else path + '.dcm' for path in SavePaths]
+
+        if PerFileAttributes is None:
+            PerFileAttributes = [{}] * len(SavePaths)
+
+        else:
+            PerFileAttributes = list(PerFileAttributes)
+
+        if len(PerFileAttributes) != len(SavePaths):
+            raise ValueError("PerFileAttributes must have one dictionary for every path in SavePaths")
+
+        from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+        pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+
+        chunk = max(1, len(SavePaths) // (4 * (max_workers or os.cpu_count() or 1)))
+
+        if not SavePaths:
+            return []
+
+        with pool(max_workers=max_workers) as executor:
+
+            kwargs = {'chunksize': chunk} if processes else {}
+
+            written = executor.map(_write_from_template, SavePaths, [Template] * len(SavePaths),
+                                   PerFileAttributes, [overwrite] * len(SavePaths), **kwargs)
+
+            return list(written)
+
+
+def _write_from_template(SavePath, Template, Attributes, overwrite):
+
+    dcm = FileDataset(SavePath, {}, file_meta=FileMetaDataset(), preamble=Template.preamble or b'\x00' * 128)
+
+    # The elements are shared with the template, any attribute
+    # that is changed gets a new element so the template is untouched
+    dcm._dict = dict(Template._dict)
+
+    dcm.file_meta._dict = dict(Template.file_meta._dict)
+
+    dcm.is_little_endian = Template.is_little_endian
+
+    dcm.is_implicit_VR = Template.is_implicit_VR
+
+    if 'SOPInstanceUID' not in Attributes:
+        Attributes = dict(Attributes, SOPInstanceUID=generate_uid())
+
+    for key, value in Attributes.items():
+
+        if key in dcm:
+            del dcm[key]
+
+        setattr(dcm, key, value)
+
+    # Replaced rather than set, the element is shared with the template
+    if 'MediaStorageSOPInstanceUID' in dcm.file_meta:
+        del dcm.file_meta['MediaStorageSOPInstanceUID']
+
+    dcm.file_meta.MediaStorageSOPInstanceUID = dcm.SOPInstanceUID
+
+    _write_dataset(SavePath, dcm, overwrite)
+
+    return SavePath
+
+
+def _write_dataset(SavePath, dcm, overwrite):
+
+    with open(SavePath, 'wb' if overwrite else 'xb') as fopen:
+
+        pd.dcmwrite(fopen, dcm, write_like_original=False)
@@ -0,0 +1,217 @@
+# Downloaded python packages
+import numpy as np
+from pydicom.dataelem import RawDataElement
+
+
+# One contour point, the three fields are contiguous so the points can be viewed as an (N, 3) float array
+CONTOUR_POINT = np.dtype([('x', np.float64), ('y', np.float64), ('z', np.float64)])
+
+_CONTOUR_DATA_TAG = (0x3006, 0x0050)
+
+_OFFSET_TAG = (0x3006, 0x0045)
+
+
+class ContourCoordinates:
+    '''
+    View of one contour of a RoiContours object. Unpacks
+    as (X, Y, Z, OffSetVector) like the tuples previously
+    stored in RtStruct.ContourDataDict. The coordinate
+    arrays are views into the points of the ROI.
+
+    Fields:
+        _points: numpy structured array of CONTOUR_POINT
+        _offset: list, the contour offset vector or []
+    '''
+
+    __slots__ = ('_points', '_offset')
+
+    def __init__(self, points, offset_vector):
+
+        self._points = points
+
+        self._offset = offset_vector
+
+
+    @property
+    def x_values(self):
+        return self._points['x']
+
+
+    @property
+    def y_values(self):
+        return self._points['y']
+
+
+    @property
+    def z_values(self):
+        return self._points['z']
+
+
+    @property
+    def offest_vector(self):
+        return self._offset
+
+
+    def Points(self):
+        '''
+        Returns an (N, 3) array view of the (x, y, z)
+        points of the contour
+        '''
+
+        return _as_xyz(self._points)
+
+
+    def __iter__(self):
+        return iter((self.x_values, self.y_values, self.z_values, self._offset))
+
+
+    def __len__(self):
+        return 4
+
+
+    def __getitem__(self, ind):
+        return (self.x_values, self.y_values, self.z_values, self._offset)[ind]
+
+
+    def __repr__(self):
+        return f'ContourCoordinates(points={len(self._points)}, offest_vector={self._offset})'
+
+
+class RoiContours:
+    '''
+    All the contours of one ROI, stored as one structured
+    array of points and the offsets where each contour
+    starts. Indexing and iterating give ContourCoordinates
+    views, so the object is used like the list of contours
+    it replaces.
+
+    Fields:
+        points: numpy structured array of CONTOUR_POINT
+        offsets: numpy array of len(self) + 1 indices, contour
+                    ind is points[offsets[ind]:offsets[ind + 1]]
+        _offset_vectors: Dictionary [int : list], only for the
+                            contours that have an offset vector
+    '''
+
+    __slots__ = ('points', 'offsets', '_offset_vectors')
+
+    def __init__(self, points, offsets, offset_vectors = None):
+        '''
+        Returns a RoiContours object
+
+        points: numpy structured array of CONTOUR_POINT
+        offsets: Sequence of the start of every contour in
+                    points followed by len(points)
+
+        Optional Parameters:
+            offset_vectors: Dictionary from contour indices to
+                                their offset vectors
+        '''
+
+        self.points = points
+
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+
+        self._offset_vectors = offset_vectors or {}
+
+
+    @staticmethod
+    def FromContourSequence(contour_sequence):
+        '''
+        Returns a RoiContours object holding the ContourData
+        of every item of a DICOM ContourSequence
+        '''
+
+        data = []
+
+        counts = []
+
+        offset_vectors = {}
+
+        for ind, contour in enumerate(contour_sequence):
+
+            values = _contour_values(contour)
+
+            counts.append(len(values) // 3)
+
+            data.append(values[:counts[-1] * 3])
+
+            if _OFFSET_TAG in contour:
+                offset_vectors[ind] = contour[_OFFSET_TAG].value
+
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+
+        np.cumsum(counts, out=offsets[1:])
+
+        points = np.empty(int(offsets[-1]), dtype=CONTOUR_POINT)
+
+        if data:
+            _as_xyz(points)[...] = np.concatenate(data).reshape(-1, 3)
+
+        return RoiContours(points, offsets, offset_vectors)
+
+
+    def AllPoints(self):
+        '''
+        Returns an (N, 3) array view of the (x, y, z)
+        points of all the contours
+        '''
+
+        return _as_xyz(self.points)
+
+
+    def PointCounts(self):
+        '''
+        Returns an array of the number of points
+        of every contour
+        '''
+
+        return np.diff(self.offsets)
+
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+    def __getitem__(self, ind):
+
+        if isinstance(ind, slice):
+            return [self[i] for i in range(*ind.indices(len(self)))]
+
+        if ind < 0:
+            ind += len(self)
+
+        if not 0 <= ind < len(self):
+            raise IndexError("Contour index out of range")
+
+        return ContourCoordinates(self.points[self.offsets[ind]:self.offsets[ind + 1]],
+                                  self._offset_vectors.get(ind, []))
+
+
+    def __iter__(self):
+
+        for ind in range(len(self)):
+            yield self[ind]
+
+
+    def __repr__(self):
+        return f'RoiContours(contours={len(self)}, points={len(self.points)})'
+
+
+def _as_xyz(points):
+
+    return points.view(np.float64).reshape(-1, 3)
+
+
+def _contour_values(contour):
+
+    element = contour.get_item(_CONTOUR_DATA_TAG)
+
+    if isinstance(element, RawDataElement) and isinstance(element.value, bytes):
+
+        # Parse the text of a value not read yet directly, rather than making a DSfloat for every number
+        text = element.value.strip(b' \x00')
+
+        return np.array(text.split(b'\\'), dtype=np.float64) if text else np.zeros(0)
+
+    return np.asarray(contour.ContourData, dtype=np.float64).ravel()
@@ -1,46 +1,284 @@
-import matplotlib.pyplot as plt
-
-from DicomModules.DICOM_Objects.Base_Class.dicom_processing import DicomProcessing
-
-
-class DicomImage(DicomProcessing):
-
-    def __init__(self, FilePath: str):
-        
-        super().__init__(FilePath)
-
-
-    def _dicom_file_checks(self):
-        
-        if not hasattr(self, 'PixelData') or self.get('PixelData') == None:
-            raise TypeError("Attempted to create a DicomImage object from a DICOM file that does not have any pixel data")
-
-
-    def ViewImage(self):
-        '''
-        Displays the image made from the pixel data
-        using the bone colour map from matplotlib
-        '''
-            
-        fig, axs = plt.subplots()
-
-        axs.imshow(self.pixel_array, cmap = plt.cm.bone)
-
-        plt.show()
-    
-    def NormalizePixelArray(self, upper):
-        '''
-        Returns None and mutates the pixel_array
-        so that the array is normalized between
-        0 and upper
-        stored in the object, normalizing it.
-
-        Effects:
-            - Mutates the object
-        '''
-
-        data = self.pixel_array / self.pixel_array.max() * upper
-
-        self.PixelData = data.tobytes()
-        
-        return None
+# Downloaded python packages
+import numpy as np
+from pydicom.uid import ExplicitVRLittleEndian
+from pydicom.pixel_data_handlers.util import get_image_pixel_ids
+
+from DicomModules.DICOM_Objects.Base_Class.dicom_processing import DicomProcessing
+
+
+# Data types that can be stored in PixelData
+_PIXEL_DTYPES = (np.uint8, np.int8, np.uint16, np.int16, np.uint32, np.int32)
+
+
+class DicomImage(DicomProcessing):
+
+    def __init__(self, FilePath: str):
+        
+        super().__init__(FilePath)
+
+
+    def _dicom_file_checks(self):
+        
+        if not hasattr(self, 'PixelData') or self.get('PixelData') == None:
+            raise TypeError("Attempted to create a DicomImage object from a DICOM file that does not have any pixel data")
+
+
+    def ViewImage(self):
+        '''
+        Displays the image made from the pixel data
+        using the bone colour map from matplotlib
+        '''
+
+        import matplotlib.pyplot as plt
+            
+        fig, axs = plt.subplots()
+
+        axs.imshow(self.pixel_array, cmap = plt.cm.bone)
+
+        plt.show()
+    
+    def NormalizePixelArray(self, upper, dtype = None, maximum = None):
+        '''
+        Returns None and mutates the pixel_array
+        so that the array is normalized between
+        0 and upper.
+
+        Optional Parameters:
+            dtype: numpy integer data type the pixels are
+                    stored as afterwards, by default the
+                    current data type is kept
+            maximum: Value that is mapped to upper, by default
+                        the maximum of the pixel_array. Pass the
+                        maximum of a whole series to normalize
+                        every slice the same way
+
+        Effects:
+            - Mutates the object
+        '''
+
+        data = self.pixel_array
+
+        if maximum is None:
+            maximum = data.max()
+
+        if maximum <= 0:
+            raise ValueError("Cannot normalize a pixel array whose maximum is not positive")
+
+        self.SetPixelArray(_affine_transform(data, upper / float(maximum), 0.0, None, None, dtype or data.dtype))
+
+        self._reset_rescale()
+
+        return None
+
+
+    def WindowLevelPixelArray(self, window, level, upper = 255, dtype = np.uint8):
+        '''
+        Returns None and mutates the pixel_array by
+        applying the window "window" centred on "level"
+        (DICOM linear VOI LUT) to the rescaled pixel values.
+        Values below the window become 0 and values above
+        become upper.
+
+        Optional Parameters:
+            upper: Value the top of the window is mapped to,
+                    the default is 255
+            dtype: numpy integer data type the pixels are
+                    stored as afterwards, the default is uint8
+
+        Effects:
+            - Mutates the object
+        '''
+
+        if window < 1:
+            raise ValueError("The window must be at least 1")
+
+        slope, intercept = self._rescale()
+
+        if window == 1:
+            # The standard defines a window of 1 as a step at level - 0.5
+            stepped = np.where(self.pixel_array * float(slope) + intercept > level - 0.5, upper, 0)
+
+            self.SetPixelArray(_affine_transform(stepped, 1.0, 0.0, 0, upper, dtype))
+
+        else:
+            # ((x - (level - 0.5)) / (window - 1) + 0.5) * upper, applied to x = slope * stored + intercept
+            scale = upper / (window - 1)
+
+            offset = (0.5 - (level - 0.5) / (window - 1)) * upper
+
+            self.SetPixelArray(_affine_transform(self.pixel_array, slope * scale, intercept * scale + offset, 0, upper,
+                                                 dtype))
+
+        self._reset_rescale()
+
+        for keyword in ('WindowCenter', 'WindowWidth'):
+
+            if keyword in self:
+                delattr(self, keyword)
+
+        return None
+
+
+    def RescalePixelArray(self, dtype = np.int16):
+        '''
+        Returns None and mutates the pixel_array by
+        applying the RescaleSlope and RescaleIntercept,
+        so the stored values are the modality values
+        (e.g. HU for CT). The rescale attributes are set
+        to 1 and 0 afterwards.
+
+        Optional Parameters:
+            dtype: numpy integer data type the pixels are
+                    stored as afterwards, the default is int16
+
+        Effects:
+            - Mutates the object
+        '''
+
+        slope, intercept = self._rescale()
+
+        self.SetPixelArray(_affine_transform(self.pixel_array, slope, intercept, None, None, dtype))
+
+        self._reset_rescale()
+
+        return None
+
+
+    def ClipPixelArray(self, lower = None, upper = None):
+        '''
+        Returns None and mutates the pixel_array by
+        clipping the stored values to [lower, upper].
+        The data type of the pixels is kept. Nothing is
+        done when both bounds are None.
+
+        Effects:
+            - Mutates the object
+        '''
+
+        if lower is None and upper is None:
+            return None
+
+        data = self.pixel_array
+
+        np.clip(data, lower, upper, out=data)
+
+        self.SetPixelArray(data)
+
+        return None
+
+
+    def SetPixelArray(self, array):
+        '''
+        Returns None and stores the numpy array "array"
+        as the PixelData of the object. BitsAllocated,
+        BitsStored, HighBit, PixelRepresentation, Rows and
+        Columns are updated to describe the array. Compressed
+        or big endian data is switched to explicit VR little
+        endian since the new data is written uncompressed.
+
+        array: numpy array with one of the integer data
+                types uint8, int8, uint16, int16, uint32
+                or int32
+
+        Effects:
+            - Mutates the object
+        '''
+
+        if array.dtype.type not in _PIXEL_DTYPES:
+            raise TypeError(f"Pixel arrays must have one of the data types {[np.dtype(t).name for t in _PIXEL_DTYPES]}")
+
+        if self.get('SamplesPerPixel', 1) != 1:
+            raise ValueError("Only single sample (grayscale) images are supported")
+
+        transfer_syntax = self.file_meta.get('TransferSyntaxUID')
+
+        if transfer_syntax is None or transfer_syntax.is_compressed or not transfer_syntax.is_little_endian:
+
+            self.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+            self.is_little_endian = True
+
+            self.is_implicit_VR = False
+
+        array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+
+        bits = array.dtype.itemsize * 8
+
+        self.BitsAllocated = bits
+
+        self.BitsStored = bits
+
+        self.HighBit = bits - 1
+
+        self.PixelRepresentation = 1 if array.dtype.kind == 'i' else 0
+
+        self.Rows, self.Columns = array.shape[-2:]
+
+        for keyword in ('SmallestImagePixelValue', 'LargestImagePixelValue'):
+
+            # Their VR depends on PixelRepresentation and the values are stale
+            if keyword in self:
+                delattr(self, keyword)
+
+        data = array.tobytes()
+
+        if len(data) % 2:
+            data += b'\x00'
+
+        self.PixelData = data
+
+        self['PixelData'].VR = 'OB' if bits == 8 else 'OW'
+
+        # Keep the array so that pixel_array does not decode the new bytes again
+        self._pixel_array = array
+
+        self._pixel_id = get_image_pixel_ids(self)
+
+        return None
+
+
+    def _rescale(self):
+
+        return float(self.get('RescaleSlope', 1.0)), float(self.get('RescaleIntercept', 0.0))
+
+
+    def _reset_rescale(self):
+
+        if 'RescaleSlope' in self:
+            self.RescaleSlope = 1
+
+        if 'RescaleIntercept' in self:
+            self.RescaleIntercept = 0
+
+
+def _affine_transform(array, scale, offset, lower, upper, dtype):
+    '''
+    Returns array * scale + offset clipped to [lower, upper]
+    and to the range of dtype, rounded and cast to dtype.
+    The work is done in a single floating point buffer.
+    '''
+
+    dtype = np.dtype(dtype)
+
+    if dtype.type not in _PIXEL_DTYPES:
+        raise TypeError(f"dtype must be one of {[np.dtype(t).name for t in _PIXEL_DTYPES]}")
+
+    info = np.iinfo(dtype)
+
+    lower = info.min if lower is None else max(lower, info.min)
+
+    upper = info.max if upper is None else min(upper, info.max)
+
+    # float32 holds 16 bit values exactly, wider types need float64
+    work_dtype = np.float64 if max(dtype.itemsize, array.dtype.itemsize) > 2 else np.float32
+
+    work = np.multiply(array, scale, dtype=work_dtype)
+
+    if offset:
+        work += offset
+
+    np.clip(work, lower, upper, out=work)
+
+    np.rint(work, out=work)
+
+    return work.astype(dtype)
@@ -1,120 +1,223 @@
-import numpy as np
-from collections import namedtuple
-
-from DicomModules.DICOM_Objects.Base_Class.dicom_processing import DicomProcessing
-from DicomModules.Display_Modules.view_3D import View3D
-
-
-class RtStruct(DicomProcessing):
-
-    def __init__(self, FilePath: str):
-        
-        super().__init__(FilePath)
-        
-        self._roi_dict = {}
-
-
-    def _dicom_file_checks(self):
-        
-        if (not hasattr(self, 'Modality')) or self.Modality != 'RTSTRUCT':
-            
-            raise TypeError(f"The modality attribute must be present and have a value of 'RTSTRUCT")
-        
-        elif (not hasattr(self, "ROIContourSequence")) or len(self.ROIContourSequence) <= 0:
-
-            raise TypeError("The ROIContourSequence attribute must be present and have a length greater than 0")
-
-
-    @property
-    def ContourDataDict(self):
-        '''
-        Returns a dictionary with strings for keys
-        and lists for values. The lists contain information
-        regarding the regions of interest and the
-        contour points within them.
-        
-        The items within each list are tuples that contain
-        (X, Y, Z, OffSetVector). If the off set vector is not
-        in the dicom then it is an empty list. The tuples within
-        a list when stacked ontop of each other make a 3D contour
-        of the ROI.
-        '''
-
-        def getXYZ(contour_data):
-
-            X = []
-            Y = []
-            Z = []
-
-            for coord in contour_data:
-                
-                if len(X) == len(Z):
-                    X.append(coord)
-                
-                elif len(Y) < len(X):
-                    Y.append(coord)
-                
-                else:
-                    Z.append(coord)
-            
-            return np.array(X), np.array(Y), np.array(Z)
-
-        Coords = namedtuple("Coordinates", ['x_values', 'y_values', 'z_values', 'offest_vector'])
-
-        ## Check if the dictionary has been made yet  
-        if self._roi_dict == {}:
-
-            roi_num = 0
-
-            for roi in self.ROIContourSequence:
-                
-                roi_num += 1
-
-                # key = f'ROI{roi_num}'
-
-                key = roi.ReferencedROINumber
-
-                mapping_func = lambda item: Coords(*getXYZ(item.ContourData), item.get((0x3006, 0x0045), default = []))
-
-                self._roi_dict[key] = list(map(mapping_func, roi.ContourSequence))
-
-            return self._roi_dict
-        
-        else:
-            return self._roi_dict
-        
-    
-    def View3DContours(self):
-        '''
-        Display the 3D image of the contours of 
-        all the ROIs in the associated RTSTRUCT
-        '''
-
-        contour_data = list(self.ContourDataDict.items())
-
-        contour_data.sort(key= lambda n: n[0])
-
-        contour_data = list(map(lambda item: item[1], contour_data))
-
-        roi_data = []
-
-        for roi in contour_data:
-            
-            X = []
-            Y = []
-            Z = []
-            
-            for contour_slice in roi:
-
-                X.extend(contour_slice.x_values)
-
-                Y.extend(contour_slice.y_values)
-
-                Z.extend(contour_slice.z_values)
-            
-            roi_data.append((X,Y,Z))
-        
-        viewer = View3D(roi_data)
-
-        viewer.mainloop()
-
+import numpy as np
+
+from DicomModules.DICOM_Objects.Base_Class.dicom_processing import DicomProcessing
+from DicomModules.DICOM_Objects.contour_records import RoiContours
+from DicomModules.Processing_Modules.instrumentation import Stage, Count
+
+
+class RtStruct(DicomProcessing):
+
+    def __init__(self, FilePath: str):
+        
+        super().__init__(FilePath)
+        
+        self._roi_dict = {}
+
+
+    def _dicom_file_checks(self):
+        
+        if (not hasattr(self, 'Modality')) or self.Modality != 'RTSTRUCT':
+            
+            raise TypeError(f"The modality attribute must be present and have a value of 'RTSTRUCT")
+        
+        elif (not hasattr(self, "ROIContourSequence")) or len(self.ROIContourSequence) <= 0:
+
+            raise TypeError("The ROIContourSequence attribute must be present and have a length greater than 0")
+
+
+    @property
+    def ContourDataDict(self):
+        '''
+        Returns a dictionary with the "Referenced ROI Numbers"
+        for keys and RoiContours for values. A RoiContours
+        object holds all the contour points of the ROI in one
+        array and is used like a list of its contours.
+        
+        The items of each RoiContours unpack as
+        (X, Y, Z, OffSetVector) and have the fields x_values,
+        y_values, z_values and offest_vector. If the off set
+        vector is not in the dicom then it is an empty list.
+        The contours of an ROI when stacked ontop of each
+        other make a 3D contour of the ROI.
+        '''
+
+        ## Check if the dictionary has been made yet  
+        if self._roi_dict == {}:
+
+            with Stage('RtStruct.ContourDataDict'):
+
+                for roi in self.ROIContourSequence:
+
+                    key = roi.ReferencedROINumber
+
+                    self._roi_dict[key] = RoiContours.FromContourSequence(roi.get('ContourSequence', []))
+
+                    Count('rois')
+
+                    Count('contours', len(self._roi_dict[key]))
+
+        return self._roi_dict
+        
+    
+    def SimplifyContours(self, tolerance = None, max_points = None, spacing = None, roi_keys = None):
+        '''
+        Returns a dictionary with the "Referenced ROI Numbers"
+        for keys and the largest error bound (mm) of the
+        simplified contours of the ROI for values, after
+        reducing the number of points of every contour in
+        place. Save the result with SaveDicom.
+
+        Each contour is first resampled to about one point
+        every "spacing" mm, then simplified with Douglas-Peucker.
+        The error bound of a contour is the sum of the bounds of
+        both steps.
+
+        Optional Parameters:
+            tolerance: Douglas-Peucker tolerance in mm
+            max_points: The most points kept in each contour
+            spacing: Distance in mm between resampled points,
+                        e.g. the pixel spacing of the images
+            roi_keys: The ROI numbers to simplify, by default all
+
+        Effects:
+            - ContourData and NumberOfContourPoints of the
+                contours are replaced, and ContourDataDict is
+                made again on its next use
+        '''
+
+        from DicomModules.Processing_Modules.contours import SimplifyPolyline, ResamplePolyline
+
+        errors = {}
+
+        with Stage('RtStruct.SimplifyContours'):
+
+            for roi in self.ROIContourSequence:
+
+                key = roi.ReferencedROINumber
+
+                if roi_keys is not None and key not in roi_keys:
+                    continue
+
+                errors[key] = 0.0
+
+                for contour in roi.get('ContourSequence', []):
+
+                    if contour.get('ContourGeometricType', 'CLOSED_PLANAR') == 'POINT':
+                        continue
+
+                    closed = contour.get('ContourGeometricType', 'CLOSED_PLANAR') == 'CLOSED_PLANAR'
+
+                    points = np.asarray(contour.ContourData, dtype=np.float64).reshape(-1, 3)
+
+                    Count('points_before', len(points))
+
+                    error = 0.0
+
+                    if spacing is not None:
+                        points, error = ResamplePolyline(points, spacing, closed)
+
+                    if tolerance is not None or max_points is not None:
+
+                        points, dp_error = SimplifyPolyline(points, tolerance, max_points, closed)
+
+                        error += dp_error
+
+                    Count('points_after', len(points))
+
+                    contour.ContourData = [f'{val:.4f}'.rstrip('0').rstrip('.') for val in points.ravel()]
+
+                    contour.NumberOfContourPoints = len(points)
+
+                    errors[key] = max(errors[key], error)
+
+        self._roi_dict = {}
+
+        return errors
+
+
+    def SpatialIndex(self, plane_tolerance = None):
+        '''
+        Returns a ContourIndex over the contours of all the
+        ROIs for point in ROI and distance to surface queries
+        without making masks, see
+        Analysis_Modules.spatial_index.ContourIndex
+        '''
+
+        from DicomModules.Analysis_Modules.spatial_index import ContourIndex
+
+        return ContourIndex(self.ContourDataDict, plane_tolerance)
+
+
+    @staticmethod
+    def CreateFromMasks(SavePath : str, Images, Masks : dict, RoiNames = None, max_points = None, tolerance = None,
+                        StructureSetLabel = 'Derived', overwrite = False):
+        '''
+        Writes a new RTSTRUCT file to SavePath holding one ROI
+        for every mask in Masks and returns it as an RtStruct.
+        The contours are extracted from each slice of the masks
+        with marching squares and simplified with Douglas-Peucker.
+
+        Required Parameters:
+            SavePath: Full path of the file to create
+            Images: DicomImageArray the masks were made on, the
+                        RTSTRUCT references these images
+            Masks: Dictionary of sITK images or numpy arrays (z, y, x)
+                    on the grid of Images.sITKImage (e.g. the result
+                    of RtAndImage.GetRtMaskDict). Values above 0 are
+                    inside the ROI. Integer keys become the ROI numbers,
+                    other keys become the ROI names
+
+        Optional Parameters:
+            RoiNames: Dictionary from the keys of Masks to ROI names
+            max_points: The most points kept in each contour
+            tolerance: Simplification tolerance in mm
+            StructureSetLabel: Label of the new structure set
+            overwrite: If False an existing file raises FileExistsError
+        '''
+
+        from DicomModules.Processing_Modules.rtstruct_writer import WriteRtStructFromMasks
+
+        if not SavePath.endswith('.dcm'):
+            SavePath = SavePath + '.dcm'
+
+        WriteRtStructFromMasks(SavePath, Images, Masks, RoiNames, max_points, tolerance, StructureSetLabel, overwrite)
+
+        return RtStruct(SavePath)
+
+    
+    def View3DContours(self):
+        '''
+        Display the 3D image of the contours of 
+        all the ROIs in the associated RTSTRUCT
+        '''
+
+        from DicomModules.Display_Modules.view_3D import View3D
+
+        contour_data = list(self.ContourDataDict.items())
+
+        contour_data.sort(key= lambda n: n[0])
+
+        contour_data = list(map(lambda item: item[1], contour_data))
+
+        roi_data = []
+
+        for roi in contour_data:
+            
+            X = []
+            Y = []
+            Z = []
+            
+            for contour_slice in roi:
+
+                X.extend(contour_slice.x_values)
+
+                Y.extend(contour_slice.y_values)
+
+                Z.extend(contour_slice.z_values)
+            
+            roi_data.append((X,Y,Z))
+        
+        viewer = View3D(roi_data)
+
+        viewer.mainloop()
+
@@ -0,0 +1,368 @@
+'''
+A chunked array store for cohorts of images and labels.
+
+The store is a directory that follows the zarr version 2
+directory layout, so it can also be opened with the zarr
+package, but only numpy and zlib are needed to read and
+write it:
+
+    store/.zgroup
+    store/<case>/.zgroup
+    store/<case>/.zattrs                -> geometry and metadata
+    store/<case>/image/.zarray
+    store/<case>/image/<i>.<j>.<k>      -> zlib compressed chunks
+    store/<case>/labels/.zgroup
+    store/<case>/labels/.zattrs         -> ROI names
+    store/<case>/labels/<roi>/.zarray
+    store/<case>/labels/<roi>/<i>.<j>.<k>
+
+Chunks that only hold the fill value are not written, which
+keeps sparse label arrays small.
+'''
+
+# Downloaded python packages
+import numpy as np
+import os
+import json
+import zlib
+import shutil
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+# From the Modules folder
+from DicomModules.Processing_Modules.instrumentation import Stage, Count
+
+
+DEFAULT_CHUNKS = (16, 128, 128)
+
+
+class ChunkedArray:
+    '''
+    Read only view of one array in a ChunkedStore.
+    Indexing with integers and slices (step 1) only
+    reads and decompresses the chunks that are needed.
+
+    Usage:
+        array[40]               -> slice 40
+        array[10:20, 64:192]    -> a patch
+        array[...]              -> the whole array
+    '''
+
+    def __init__(self, path : str):
+
+        with open(os.path.join(path, '.zarray')) as fopen:
+            meta = json.load(fopen)
+
+        self.path = path
+
+        self.shape = tuple(meta['shape'])
+
+        self.chunks = tuple(meta['chunks'])
+
+        self.dtype = np.dtype(meta['dtype'])
+
+        self.fill_value = meta['fill_value'] or 0
+
+        self._compressed = meta['compressor'] is not None
+
+        self._separator = meta.get('dimension_separator', '.')
+
+
+    def __len__(self):
+        return self.shape[0]
+
+
+    def __getitem__(self, index):
+
+        bounds, squeeze = _normalize_index(index, self.shape)
+
+        out = np.full([stop - start for start, stop in bounds], self.fill_value, dtype=self.dtype)
+
+        ranges = [range(start // size, (stop - 1) // size + 1) if stop > start else range(0)
+                  for (start, stop), size in zip(bounds, self.chunks)]
+
+        for chunk_index in itertools.product(*ranges):
+
+            chunk = self._read_chunk(chunk_index)
+
+            if chunk is None:
+                continue
+
+            src = []
+
+            dst = []
+
+            for (start, stop), size, ind in zip(bounds, self.chunks, chunk_index):
+
+                lo = max(start, ind * size)
+
+                hi = min(stop, (ind + 1) * size)
+
+                src.append(slice(lo - ind * size, hi - ind * size))
+
+                dst.append(slice(lo - start, hi - start))
+
+            out[tuple(dst)] = chunk[tuple(src)]
+
+        return out.reshape([length for length, drop in zip(out.shape, squeeze) if not drop])
+
+
+    def _read_chunk(self, chunk_index):
+
+        file_path = os.path.join(self.path, self._separator.join(map(str, chunk_index)))
+
+        if not os.path.isfile(file_path):
+            return None
+
+        with open(file_path, 'rb') as fopen:
+            data = fopen.read()
+
+        if self._compressed:
+            data = zlib.decompress(data)
+
+        return np.frombuffer(data, dtype=self.dtype).reshape(self.chunks)
+
+
+class ChunkedStore:
+    '''
+    A directory holding the images, labels and geometry
+    of many cases as chunked, per chunk compressed arrays.
+    See the module documentation for the layout.
+    '''
+
+    def __init__(self, path : str):
+        '''
+        Opens the store on path, creating it when it
+        does not exist yet
+        '''
+
+        os.makedirs(path, exist_ok=True)
+
+        self.path = path
+
+        _write_json(os.path.join(path, '.zgroup'), {'zarr_format': 2})
+
+
+    def Cases(self):
+        '''
+        Returns a sorted list of the case ids in the store
+        '''
+
+        return sorted(name for name in os.listdir(self.path)
+                      if os.path.isfile(os.path.join(self.path, name, '.zattrs')))
+
+
+    def Metadata(self, case_id : str):
+        '''
+        Returns the dictionary of geometry and metadata
+        stored with the case
+        '''
+
+        with open(os.path.join(self.path, case_id, '.zattrs')) as fopen:
+            return json.load(fopen)
+
+
+    def Image(self, case_id : str):
+        '''
+        Returns the ChunkedArray (z, y, x) of the image
+        of the case
+        '''
+
+        return ChunkedArray(os.path.join(self.path, case_id, 'image'))
+
+
+    def Labels(self, case_id : str):
+        '''
+        Returns a dictionary with ROI keys for keys and
+        ChunkedArray masks (z, y, x) of the case for values
+        '''
+
+        labels_dir = os.path.join(self.path, case_id, 'labels')
+
+        if not os.path.isdir(labels_dir):
+            return {}
+
+        return {name: ChunkedArray(os.path.join(labels_dir, name)) for name in sorted(os.listdir(labels_dir))
+                if os.path.isfile(os.path.join(labels_dir, name, '.zarray'))}
+
+
+    def WriteCase(self, case_id : str, image, masks = None, roi_names = None, metadata = None,
+                  chunks = DEFAULT_CHUNKS, compression_level = 1, max_workers = None):
+        '''
+        Writes a case to the store, replacing any case
+        with the same id.
+
+        case_id: Name of the case in the store
+        image: sITK image of the case
+
+        Optional Parameters:
+            masks: Dictionary or iterable of (key, sITK mask) pairs
+                    on the grid of image. An iterable is written as
+                    it is consumed so only one mask is in memory
+            roi_names: Dictionary from mask keys to ROI names
+            metadata: Dictionary of json serializable values
+                        stored with the case
+            chunks: Shape (z, y, x) of the chunks, by default
+                        (16, 128, 128)
+            compression_level: zlib level between 0 and 9, or
+                                None to store chunks uncompressed
+            max_workers: Number of threads compressing chunks,
+                            by default the number of cpus
+        '''
+
+        import SimpleITK as sITK
+
+        case_dir = os.path.join(self.path, case_id)
+
+        if os.path.isdir(case_dir):
+            shutil.rmtree(case_dir)
+
+        os.makedirs(case_dir)
+
+        _write_json(os.path.join(case_dir, '.zgroup'), {'zarr_format': 2})
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+            with Stage('ChunkedStore.WriteImage', case=case_id):
+                _write_array(os.path.join(case_dir, 'image'), sITK.GetArrayViewFromImage(image), chunks,
+                             compression_level, executor)
+
+            written = {}
+
+            if masks is not None:
+
+                labels_dir = os.path.join(case_dir, 'labels')
+
+                os.makedirs(labels_dir)
+
+                _write_json(os.path.join(labels_dir, '.zgroup'), {'zarr_format': 2})
+
+                items = masks.items() if isinstance(masks, dict) else masks
+
+                for key, mask in items:
+
+                    name = str(key)
+
+                    with Stage('ChunkedStore.WriteLabel', case=case_id, roi=name):
+                        _write_array(os.path.join(labels_dir, name), sITK.GetArrayViewFromImage(mask), chunks,
+                                     compression_level, executor)
+
+                    written[name] = (roi_names or {}).get(key, name)
+
+                _write_json(os.path.join(labels_dir, '.zattrs'), {'roi_names': written})
+
+        # Written last, a case without .zattrs is incomplete and not listed by Cases
+        _write_json(os.path.join(case_dir, '.zattrs'), {
+            'origin': list(image.GetOrigin()),
+            'spacing': list(image.GetSpacing()),
+            'direction': list(image.GetDirection()),
+            'metadata': metadata or {},
+        })
+
+
+def _write_array(path, array, chunks, compression_level, executor):
+
+    os.makedirs(path, exist_ok=True)
+
+    array = np.ascontiguousarray(array)
+
+    chunks = tuple(min(size, max(length, 1)) for size, length in zip(chunks, array.shape))
+
+    compressor = None if compression_level is None else {'id': 'zlib', 'level': compression_level}
+
+    _write_json(os.path.join(path, '.zarray'), {
+        'zarr_format': 2,
+        'shape': list(array.shape),
+        'chunks': list(chunks),
+        'dtype': array.dtype.str,
+        'compressor': compressor,
+        'fill_value': 0,
+        'order': 'C',
+        'filters': None,
+        'dimension_separator': '.',
+    })
+
+    grid = [range(-(-length // size)) for length, size in zip(array.shape, chunks)]
+
+    def write_chunk(chunk_index):
+
+        region = tuple(slice(ind * size, (ind + 1) * size) for ind, size in zip(chunk_index, chunks))
+
+        block = array[region]
+
+        if not block.any():
+            return 0
+
+        if block.shape != chunks:
+            # Edge chunks are stored full size, padded with the fill value
+            block = np.pad(block, [(0, size - length) for size, length in zip(chunks, block.shape)])
+
+        data = np.ascontiguousarray(block).tobytes()
+
+        if compression_level is not None:
+            data = zlib.compress(data, compression_level)
+
+        with open(os.path.join(path, '.'.join(map(str, chunk_index))), 'wb') as fopen:
+            fopen.write(data)
+
+        return len(data)
+
+    written = list(executor.map(write_chunk, itertools.product(*grid)))
+
+    Count('chunks', sum(1 for size in written if size))
+
+    Count('bytes_written', sum(written))
+
+
+def _normalize_index(index, shape):
+
+    if not isinstance(index, tuple):
+        index = (index,)
+
+    if any(ind is Ellipsis for ind in index):
+
+        position = index.index(Ellipsis)
+
+        fill = (slice(None),) * (len(shape) - len(index) + 1)
+
+        index = index[:position] + fill + index[position + 1:]
+
+    index = index + (slice(None),) * (len(shape) - len(index))
+
+    bounds = []
+
+    squeeze = []
+
+    for ind, length in zip(index, shape):
+
+        if isinstance(ind, slice):
+
+            start, stop, step = ind.indices(length)
+
+            if step != 1:
+                raise IndexError("Only slices with a step of 1 are supported")
+
+            bounds.append((start, max(start, stop)))
+
+            squeeze.append(False)
+
+        else:
+            ind = int(ind)
+
+            if ind < 0:
+                ind += length
+
+            if not 0 <= ind < length:
+                raise IndexError(f"Index {ind} is out of bounds for axis with size {length}")
+
+            bounds.append((ind, ind + 1))
+
+            squeeze.append(True)
+
+    return bounds, squeeze
+
+
+def _write_json(path, value):
+
+    with open(path, 'w') as fopen:
+        json.dump(value, fopen)
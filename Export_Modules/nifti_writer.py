@@ -0,0 +1,175 @@
+import os
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+# From the Modules folder
+from DicomModules.Processing_Modules.instrumentation import Stage, Count
+
+
+class NiftiWriter:
+    '''
+    Writes sITK images to .nii or .nii.gz files on a
+    pool of worker threads. Images are handed to the
+    writer as soon as they exist so that compression of
+    one file overlaps with the creation of the next one.
+
+    The number of images waiting to be written is bounded,
+    once the limit is reached Submit blocks until a worker
+    has finished a file. This keeps memory use flat no matter
+    how many images are exported.
+
+    Usage:
+        with NiftiWriter(compression_level = 1) as writer:
+            writer.Submit(img, save_path)
+    '''
+
+    def __init__(self, include_gz = True, compression_level = None, max_workers = None, max_pending = None):
+        '''
+        Returns a NiftiWriter object
+
+        Optional Parameters:
+            include_gz: If True files are written as .nii.gz,
+                            otherwise they are written uncompressed
+                            as .nii. The default is True
+            compression_level: int between 0 and 9 passed to zlib
+                                when include_gz is True. None uses
+                                the default level of SimpleITK
+            max_workers: Number of files written concurrently,
+                            by default the number of cpus
+            max_pending: Maximum number of submitted images that
+                            have not been written yet. By default
+                            twice max_workers
+        '''
+
+        if compression_level is not None and not 0 <= compression_level <= 9:
+            raise ValueError("compression_level must be an int between 0 and 9 or None")
+
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+
+        if max_pending is None:
+            max_pending = 2 * max_workers
+
+        self.include_gz = include_gz
+
+        self.compression_level = compression_level
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='NiftiWriter')
+
+        self._pending = threading.BoundedSemaphore(max_pending)
+
+        self._futures = []
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        if exc_type is None:
+            self.Wait()
+
+        else:
+            self.Close()
+
+        return False
+
+
+    @property
+    def Extension(self):
+        '''
+        Returns the file extension used for written files
+        '''
+        return '.nii.gz' if self.include_gz else '.nii'
+
+
+    def Submit(self, image, save_path : str):
+        '''
+        Queues the sITK image "image" to be written to
+        save_path and returns a Future that resolves to
+        the full path of the written file.
+
+        save_path: str that contains the save path of the
+                    file, should not include any file extensions
+
+        Effects:
+            - Blocks while the number of pending images
+                is at max_pending
+        '''
+
+        self._pending.acquire()
+
+        try:
+            # Run in a copy of the callers context so stage records keep their parent
+            context = contextvars.copy_context()
+
+            future = self._executor.submit(context.run, self._write, image, save_path + self.Extension)
+
+        except BaseException:
+            self._pending.release()
+            raise
+
+        future.add_done_callback(lambda _: self._pending.release())
+
+        self._futures.append(future)
+
+        return future
+
+
+    def Wait(self):
+        '''
+        Blocks until every submitted image has been written
+        and shuts down the workers. Returns a list of the
+        written file paths in submission order.
+
+        Raises the first exception raised by a worker.
+        '''
+
+        try:
+            return [future.result() for future in self._futures]
+
+        finally:
+            self.Close()
+
+
+    def Close(self):
+        '''
+        Cancels images that have not started writing
+        and shuts down the workers.
+        '''
+
+        for future in self._futures:
+            future.cancel()
+
+        self._executor.shutdown(wait=True)
+
+
+    def _write(self, image, file_path):
+
+        import SimpleITK as sITK
+
+        dir_name = os.path.dirname(file_path)
+
+        if dir_name:
+            os.makedirs(dir_name, exist_ok=True)
+
+        with Stage('NiftiWriter.Write', path=file_path, compressed=self.include_gz):
+
+            writer = sITK.ImageFileWriter()
+
+            writer.SetFileName(file_path)
+
+            writer.SetUseCompression(self.include_gz)
+
+            if self.include_gz and self.compression_level is not None:
+                writer.SetCompressionLevel(self.compression_level)
+
+            writer.Execute(image)
+
+            Count('files')
+
+            Count('bytes_written', os.path.getsize(file_path))
+
+        return file_path
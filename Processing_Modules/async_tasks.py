@@ -0,0 +1,142 @@
+'''
+Helpers for the Async methods of the DicomStorage arrays
+and RtAndImage, which run blocking file reads and CPU bound
+work in an executor so the asyncio event loop stays free.
+
+The number of calls handed to the executor at once is
+bounded, so cancelling the awaiting task stops any new
+work from starting. Calls that are already running in
+a thread finish, but their results are dropped.
+
+A ProcessPoolExecutor may be used for CPU bound work, the
+functions and their arguments are then pickled, so they
+must be module level functions. Stage records made inside
+worker processes are not collected.
+'''
+
+# Downloaded python packages
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+
+DEFAULT_CONCURRENCY = 8
+
+
+async def RunInExecutor(func, *args, executor = None):
+    '''
+    Returns the result of func(*args) run in executor,
+    by default the event loop's default thread pool
+    '''
+
+    loop = asyncio.get_running_loop()
+
+    if IsProcessPool(executor):
+        # A context can not be sent to another process
+        return await loop.run_in_executor(executor, func, *args)
+
+    # Run in a copy of the callers context so stage records keep their parent
+    context = contextvars.copy_context()
+
+    return await loop.run_in_executor(executor, functools.partial(context.run, func, *args))
+
+
+def IsProcessPool(executor):
+    '''
+    Returns True when calls given to executor run in
+    other processes, so they must be picklable
+    '''
+
+    return isinstance(executor, ProcessPoolExecutor)
+
+
+async def BoundedMap(func, items, max_concurrency = DEFAULT_CONCURRENCY, executor = None, progress = None):
+    '''
+    Returns a list of func(item) for every item of items,
+    in order, with at most max_concurrency calls running
+    at once in executor
+
+    Optional Parameters:
+        progress: Function called as progress(done, total)
+                    after each call finishes
+    '''
+
+    items = list(items)
+
+    results = [None] * len(items)
+
+    calls = _bounded(func, items, max_concurrency, executor, progress)
+
+    try:
+        async for ind, _, result in calls:
+            results[ind] = result
+
+    finally:
+        await calls.aclose()
+
+    return results
+
+
+async def BoundedAsCompleted(func, items, max_concurrency = DEFAULT_CONCURRENCY, executor = None, progress = None):
+    '''
+    Asynchronous generator yielding tuples (item, func(item))
+    as the calls finish, with at most max_concurrency calls
+    running at once in executor. Closing the generator
+    early cancels the calls that have not started.
+
+    Optional Parameters:
+        progress: Function called as progress(done, total)
+                    after each call finishes
+    '''
+
+    calls = _bounded(func, items, max_concurrency, executor, progress)
+
+    try:
+        async for _, item, result in calls:
+            yield item, result
+
+    finally:
+        # Cancels the calls that have not started
+        await calls.aclose()
+
+
+async def _bounded(func, items, max_concurrency, executor, progress):
+    '''
+    Yields tuples (index, item, func(item)) as the calls
+    finish. func itself is handed to the executor, so it
+    only has to be picklable for a process pool.
+    '''
+
+    items = list(items)
+
+    total = len(items)
+
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def run(ind):
+
+        async with semaphore:
+            return ind, items[ind], await RunInExecutor(func, items[ind], executor=executor)
+
+    tasks = [asyncio.ensure_future(run(ind)) for ind in range(total)]
+
+    try:
+        done = 0
+
+        for task in asyncio.as_completed(tasks):
+
+            result = await task
+
+            done += 1
+
+            if progress is not None:
+                progress(done, total)
+
+            yield result
+
+    finally:
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,434 @@
+# Downloaded python packages
+import pydicom as pd
+import os
+import csv
+import json
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+# From the Modules folder
+from DicomModules.rt_and_image import RtAndImage
+
+
+BatchCase = namedtuple("BatchCase", ["CaseID", "PatientID", "RtFile", "ImageFiles", "SaveDir"])
+
+_HEADER_TAGS = ["Modality", "PatientID", "SOPInstanceUID", "SOPClassUID",
+                "FrameOfReferenceUID", "ReferencedFrameOfReferenceSequence"]
+
+_REPORT_FIELDS = ["CaseID", "PatientID", "Status", "Seconds", "LoadSeconds",
+                  "ExportSeconds", "RtFile", "SaveDir", "Error", "Finished"]
+
+
+class BatchConverter:
+    '''
+    Converts every RTSTRUCT and its images found below a
+    root directory to .nii.gz files, one case per RTSTRUCT.
+
+    Cases are converted in a pool of worker processes, a
+    case that fails only marks that case as failed. When a
+    worker dies the cases that were running are converted
+    again one at a time, and only a case that kills its
+    worker on its own is marked as failed. Every
+    finished case is appended to a manifest in the output
+    directory, running the converter again skips the cases
+    the manifest records as done.
+
+    Output layout:
+        save_root/<PatientID>/<RTSTRUCT SOPInstanceUID>/
+        save_root/manifest.jsonl
+        save_root/report.csv
+    '''
+
+    ManifestName = 'manifest.jsonl'
+
+    ReportName = 'report.csv'
+
+    def __init__(self, root_dir : str, save_root : str, max_workers = None, max_tasks_per_child = 1,
+                 max_memory_mb = None, retry_failed = True, **save_kwargs):
+        '''
+        Returns a BatchConverter object
+
+        root_dir: Directory that is searched recursively
+                    for .dcm files
+        save_root: Directory where the converted cases,
+                    the manifest and the report are written
+
+        Optional Parameters:
+            max_workers: Number of cases converted at once,
+                            by default the number of cpus
+            max_tasks_per_child: Number of cases a worker converts
+                                    before it is replaced by a fresh
+                                    process, releasing any memory it
+                                    held. The default is 1
+            max_memory_mb: Address space limit of each worker in
+                            MB, a case exceeding it fails with a
+                            MemoryError. Only applied on systems
+                            that support resource limits
+            retry_failed: If True cases that failed on an earlier
+                            run are attempted again. The default
+                            is True
+            **save_kwargs: Passed on to RtAndImage.SaveAsNii
+        '''
+
+        if not os.path.isdir(root_dir):
+            raise ValueError("The provided root_dir is not a real directory on this system")
+
+        self.root_dir = root_dir
+
+        self.save_root = save_root
+
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+        self.max_tasks_per_child = max_tasks_per_child
+
+        self.max_memory_mb = max_memory_mb
+
+        self.retry_failed = retry_failed
+
+        self.save_kwargs = save_kwargs
+
+
+    @property
+    def ManifestPath(self):
+        return os.path.join(self.save_root, self.ManifestName)
+
+
+    @property
+    def ReportPath(self):
+        return os.path.join(self.save_root, self.ReportName)
+
+
+    def DiscoverCases(self):
+        '''
+        Returns a list of BatchCase tuples, one for every
+        RTSTRUCT below root_dir that has related images.
+        Only the headers of the files are read.
+        '''
+
+        headers = []
+
+        for dir_path, _, file_names in os.walk(self.root_dir):
+
+            for name in sorted(file_names):
+
+                if not name.lower().endswith('.dcm'):
+                    continue
+
+                path = os.path.join(dir_path, name)
+
+                try:
+                    header = pd.dcmread(path, stop_before_pixels=True, specific_tags=_HEADER_TAGS)
+
+                except Exception:
+                    continue
+
+                header.filename = path
+
+                headers.append(header)
+
+        cases = []
+
+        for struct in filter(lambda dcm: dcm.get('Modality') == 'RTSTRUCT', headers):
+
+            filterFunction = RtAndImage._related_image_filter(struct)
+
+            image_files = [dcm.filename for dcm in headers if filterFunction(dcm)]
+
+            if not image_files:
+                continue
+
+            patient_id = str(struct.get('PatientID', 'Unknown'))
+
+            case_id = str(struct.SOPInstanceUID)
+
+            save_dir = os.path.join(self.save_root, patient_id, case_id)
+
+            cases.append(BatchCase(case_id, patient_id, struct.filename, tuple(image_files), save_dir))
+
+        return cases
+
+
+    def ReadManifest(self):
+        '''
+        Returns a dictionary with case ids for keys and
+        the most recent manifest record of the case for
+        values.
+        '''
+
+        records = {}
+
+        if not os.path.isfile(self.ManifestPath):
+            return records
+
+        with open(self.ManifestPath, 'r') as fopen:
+
+            for line in fopen:
+
+                line = line.strip()
+
+                if not line:
+                    continue
+
+                try:
+                    record = json.loads(line)
+
+                except json.JSONDecodeError:
+                    # A run that was killed mid write leaves a partial last line
+                    continue
+
+                records[record['CaseID']] = record
+
+        return records
+
+
+    def PendingCases(self, cases = None):
+        '''
+        Returns the cases that still have to be converted
+        according to the manifest
+        '''
+
+        if cases is None:
+            cases = self.DiscoverCases()
+
+        records = self.ReadManifest()
+
+        def is_pending(case):
+
+            record = records.get(case.CaseID)
+
+            if record is None:
+                return True
+
+            if record['Status'] == 'done':
+                return False
+
+            return self.retry_failed
+
+        return list(filter(is_pending, cases))
+
+
+    def Run(self, progress = None):
+        '''
+        Converts all the pending cases and returns a list
+        of the manifest records written during this run.
+        Also rewrites the report with the latest record
+        of every case.
+
+        Optional Parameters:
+            progress: Function called with each manifest
+                        record as soon as its case finishes
+        '''
+
+        os.makedirs(self.save_root, exist_ok=True)
+
+        todo = self.PendingCases()
+
+        suspects = []
+
+        results = []
+
+        with open(self.ManifestPath, 'a') as manifest:
+
+            while todo or suspects:
+
+                if suspects:
+                    # A case that was running when a worker died is run on its own, so it
+                    # is only marked as failed when it is the case that kills the worker
+                    case = suspects.pop(0)
+
+                    crashed, _ = self._run_pool([case], manifest, results, progress, max_workers=1)
+
+                    if crashed:
+                        record = _case_record(case, 'failed', 0.0, error='Worker process terminated unexpectedly')
+                        self._record(manifest, record, results, progress)
+
+                else:
+                    crashed, todo = self._run_pool(todo, manifest, results, progress)
+
+                    suspects.extend(crashed)
+
+        self.WriteReport()
+
+        return results
+
+
+    def WriteReport(self):
+        '''
+        Writes a csv file to save_root with one row
+        for every case in the manifest
+        '''
+
+        records = self.ReadManifest()
+
+        with open(self.ReportPath, 'w', newline='') as fopen:
+
+            writer = csv.DictWriter(fopen, fieldnames=_REPORT_FIELDS, extrasaction='ignore')
+
+            writer.writeheader()
+
+            for record in records.values():
+                writer.writerow(record)
+
+
+    def _run_pool(self, cases, manifest, results, progress, max_workers = None):
+        '''
+        Runs cases in a fresh pool and returns a tuple of
+        lists (crashed, remaining). When a worker dies and
+        breaks the pool, crashed holds the cases that were
+        running at the time, none of which is recorded, and
+        remaining the cases that were never started.
+        '''
+
+        max_workers = max_workers or self.max_workers
+
+        queue = list(reversed(cases))
+
+        running = {}
+
+        executor = ProcessPoolExecutor(max_workers=max_workers, max_tasks_per_child=self.max_tasks_per_child,
+                                       initializer=_limit_worker_memory, initargs=(self.max_memory_mb,))
+
+        try:
+            while queue or running:
+
+                # Only a bounded number of cases is queued in the pool at once
+                while queue and len(running) < 2 * max_workers:
+
+                    case = queue.pop()
+
+                    running[executor.submit(_convert_case, case, self.save_kwargs)] = case
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                crashed = []
+
+                for future in done:
+
+                    case = running.pop(future)
+
+                    try:
+                        record = future.result()
+
+                    except BrokenProcessPool:
+                        crashed.append(case)
+                        continue
+
+                    except Exception as e:
+                        record = _case_record(case, 'failed', 0.0, error=repr(e))
+
+                    self._record(manifest, record, results, progress)
+
+                if crashed:
+                    # The cases still running are lost with the pool, which of them died is not known
+                    return crashed + list(running.values()), list(reversed(queue))
+
+            return [], []
+
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+    def _record(self, manifest, record, results, progress):
+
+        manifest.write(json.dumps(record) + '\n')
+
+        manifest.flush()
+
+        results.append(record)
+
+        if progress is not None:
+            progress(record)
+
+
+def _limit_worker_memory(max_memory_mb):
+
+    if max_memory_mb is None:
+        return
+
+    try:
+        import resource
+
+    except ImportError:
+        return
+
+    limit = int(max_memory_mb) * 1024 * 1024
+
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _case_record(case, status, seconds, load_seconds = None, export_seconds = None, error = None):
+
+    return {
+        'CaseID': case.CaseID,
+        'PatientID': case.PatientID,
+        'Status': status,
+        'Seconds': round(seconds, 4),
+        'LoadSeconds': None if load_seconds is None else round(load_seconds, 4),
+        'ExportSeconds': None if export_seconds is None else round(export_seconds, 4),
+        'RtFile': case.RtFile,
+        'SaveDir': case.SaveDir,
+        'Error': error,
+        'Finished': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def _convert_case(case, save_kwargs):
+    '''
+    Converts a single case inside a worker process
+    and returns its manifest record. Exceptions are
+    caught so that they end up in the report.
+    '''
+
+    start = time.perf_counter()
+
+    load_seconds = None
+
+    try:
+        # The images of the case were matched to the RTSTRUCT when the archive was scanned
+        rt_and_image = RtAndImage.FromFiles(case.RtFile, case.ImageFiles)
+
+        load_seconds = time.perf_counter() - start
+
+        if rt_and_image.Images.Length() == 0:
+            raise ValueError("None of the image files of the case could be read")
+
+        rt_and_image.SaveAsNii(case.SaveDir, **save_kwargs)
+
+    except Exception:
+        return _case_record(case, 'failed', time.perf_counter() - start, load_seconds,
+                            error=traceback.format_exc(limit=5))
+
+    seconds = time.perf_counter() - start
+
+    return _case_record(case, 'done', seconds, load_seconds, seconds - load_seconds)
+
+
+if __name__ == '__main__':
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert every RTSTRUCT below a directory to .nii.gz files")
+
+    parser.add_argument('root_dir')
+
+    parser.add_argument('save_root')
+
+    parser.add_argument('--workers', type=int, default=None)
+
+    parser.add_argument('--max-memory-mb', type=int, default=None)
+
+    parser.add_argument('--no-retry', action='store_true', help="Skip cases that failed on an earlier run")
+
+    args = parser.parse_args()
+
+    converter = BatchConverter(args.root_dir, args.save_root, max_workers=args.workers,
+                               max_memory_mb=args.max_memory_mb, retry_failed=not args.no_retry)
+
+    finished = converter.Run(progress=lambda record: print(f"{record['Status']:>6} {record['Seconds']:8.2f}s {record['CaseID']}"))
+
+    failed = sum(record['Status'] != 'done' for record in finished)
+
+    print(f"{len(finished) - failed} converted, {failed} failed, report written to {converter.ReportPath}")
@@ -0,0 +1,265 @@
+# Downloaded python packages
+import numpy as np
+
+
+def ExtractContours(mask_slice, level = 0.5):
+    '''
+    Returns a list of closed contours around the
+    foreground of the 2D array mask_slice, found with
+    marching squares. Each contour is an (N, 2) array
+    of (row, column) indices without the repeated
+    closing point. Holes give their own contours.
+
+    mask_slice: 2D array where values above level
+                    are foreground
+    '''
+
+    from skimage import measure
+
+    # Pad so contours touching the edge of the image are closed
+    padded = np.pad(np.asarray(mask_slice, dtype=np.float32), 1)
+
+    contours = []
+
+    for contour in measure.find_contours(padded, level):
+
+        if len(contour) < 4:
+            continue
+
+        contours.append(contour[:-1] - 1)
+
+    return contours
+
+
+def DouglasPeuckerSignificance(points, closed = True):
+    '''
+    Returns an array with the Douglas-Peucker significance
+    of every point of the polyline "points" (N, D). A point
+    with significance s is kept by Douglas-Peucker for every
+    tolerance smaller than s, so one call gives the simplified
+    polyline for any tolerance or point budget.
+
+    The significances never increase going down the
+    recursion, so thresholding them always gives a
+    valid Douglas-Peucker result. The end points (and the
+    two anchor points of a closed contour) are infinite.
+    '''
+
+    points = np.asarray(points, dtype=np.float64)
+
+    n = len(points)
+
+    significance = np.zeros(n)
+
+    if n <= 2:
+        significance[:] = np.inf
+        return significance
+
+    if closed:
+        # Anchor a closed contour on its first point and the point farthest from it
+        far = int(np.argmax(np.sum((points - points[0]) ** 2, axis=1)))
+
+        points = np.concatenate((points, points[:1]))
+
+        stack = [(0, far, np.inf), (far, n, np.inf)]
+
+        significance = np.zeros(n + 1)
+
+        significance[[0, far]] = np.inf
+
+    else:
+        stack = [(0, n - 1, np.inf)]
+
+        significance[[0, n - 1]] = np.inf
+
+    while stack:
+
+        start, end, parent = stack.pop()
+
+        if end - start < 2:
+            continue
+
+        inner = points[start + 1:end]
+
+        distances = _segment_distances(inner, points[start], points[end])
+
+        ind = int(np.argmax(distances))
+
+        value = min(distances[ind], parent)
+
+        split = start + 1 + ind
+
+        significance[split] = value
+
+        stack.append((start, split, value))
+
+        stack.append((split, end, value))
+
+    return significance[:n]
+
+
+def SimplifyPolyline(points, tolerance = None, max_points = None, closed = True):
+    '''
+    Returns a tuple (simplified points, error bound) after
+    Douglas-Peucker simplification of the polyline "points".
+    The error bound is the largest distance between a removed
+    point and the simplified polyline as measured by
+    Douglas-Peucker, in the units of points.
+
+    Optional Parameters:
+        tolerance: Points closer than tolerance to the
+                    simplified polyline are removed
+        max_points: The most points that are kept, the
+                        points with the lowest significance
+                        are removed first
+
+    When both are given the result satisfies both, so it
+    can have a larger error than tolerance.
+    '''
+
+    points = np.asarray(points)
+
+    significance = DouglasPeuckerSignificance(points, closed)
+
+    keep = np.ones(len(points), dtype=bool)
+
+    if tolerance is not None:
+        keep &= significance > tolerance
+
+    if max_points is not None and np.count_nonzero(keep) > max_points:
+
+        order = np.argsort(-significance, kind='stable')
+
+        budget = np.zeros(len(points), dtype=bool)
+
+        budget[order[:max(max_points, 3 if closed else 2)]] = True
+
+        keep &= budget
+
+    removed = significance[~keep]
+
+    error = float(removed.max()) if len(removed) else 0.0
+
+    return points[keep], error
+
+
+def ResamplePolyline(points, spacing, closed = True):
+    '''
+    Returns a tuple (resampled points, error bound) with the
+    polyline "points" (N, D) resampled at even steps along its
+    length, with one point about every "spacing" units. Only
+    reduces the number of points: polylines that are already
+    coarser than spacing are returned unchanged. The error
+    bound is the largest distance between an original point
+    and the resampled polyline.
+    '''
+
+    points = np.asarray(points, dtype=np.float64)
+
+    path = np.concatenate((points, points[:1])) if closed else points
+
+    lengths = np.sqrt(np.sum(np.diff(path, axis=0) ** 2, axis=1))
+
+    position = np.concatenate(([0.0], np.cumsum(lengths)))
+
+    total = position[-1]
+
+    count = max(3 if closed else 2, int(np.ceil(total / spacing)) + (0 if closed else 1))
+
+    if count >= len(points) or total == 0.0:
+        return points, 0.0
+
+    targets = np.linspace(0.0, total, count, endpoint=not closed)
+
+    resampled = np.column_stack([np.interp(targets, position, path[:, dim]) for dim in range(points.shape[1])])
+
+    # Every original point lies between two resampled points along the polyline
+    segment = np.clip(np.searchsorted(targets, position[:len(points)], side='right') - 1, 0, count - 1)
+
+    following = (segment + 1) % count if closed else np.minimum(segment + 1, count - 1)
+
+    distances = _segment_distances(points, resampled[segment], resampled[following])
+
+    return resampled, float(distances.max())
+
+
+def PolygonOccupancy(polygons, shape, supersample = 4):
+    '''
+    Returns a tuple (row offset, column offset, fractions)
+    where fractions is a float32 array holding the part of
+    each pixel covered by the polygons, over the bounding
+    box of the polygons clipped to shape. Overlapping
+    polygons are combined with an exclusive or, so holes
+    are subtracted as in a binary mask.
+
+    polygons: List of (N, 2) arrays of (row, column)
+                continuous pixel indices
+    shape: (rows, columns) of the full slice
+
+    Optional Parameters:
+        supersample: Number of samples along each axis of
+                        a pixel, supersample ** 2 per pixel
+    '''
+
+    from skimage import draw
+
+    stacked = np.concatenate(polygons)
+
+    low = np.maximum(np.floor(stacked.min(axis=0) + 0.5).astype(int), 0)
+
+    high = np.minimum(np.ceil(stacked.max(axis=0) + 0.5).astype(int), shape)
+
+    if np.any(high <= low):
+        return 0, 0, np.zeros((0, 0), dtype=np.float32)
+
+    box = (high - low) * supersample
+
+    covered = np.zeros(box, dtype=bool)
+
+    for polygon in polygons:
+
+        # Sample j of pixel i sits at i - 0.5 + (j + 0.5) / supersample
+        samples = (polygon - low + 0.5) * supersample - 0.5
+
+        covered ^= draw.polygon2mask(tuple(box), samples)
+
+    rows, cols = high - low
+
+    fractions = covered.reshape(rows, supersample, cols, supersample).mean(axis=(1, 3), dtype=np.float32)
+
+    return int(low[0]), int(low[1]), fractions
+
+
+def IndexToPhysicalMatrix(sitk_image):
+    '''
+    Returns a tuple (matrix, origin) such that
+    physical = index @ matrix.T + origin for (N, 3)
+    arrays of (x, y, z) continuous indices of sitk_image
+    '''
+
+    direction = np.array(sitk_image.GetDirection(), dtype=np.float64).reshape(3, 3)
+
+    matrix = direction * np.array(sitk_image.GetSpacing(), dtype=np.float64)
+
+    return matrix, np.array(sitk_image.GetOrigin(), dtype=np.float64)
+
+
+def _segment_distances(points, start, end):
+    '''
+    Returns the distances between each of points
+    and the line segment from start to end. start
+    and end are single points or arrays with one
+    segment for every point.
+    '''
+
+    segment = end - start
+
+    length = np.sum(segment * segment, axis=-1)
+
+    along = np.sum((points - start) * segment, axis=-1)
+
+    t = np.clip(np.divide(along, length, out=np.zeros_like(along), where=length > 0), 0.0, 1.0)
+
+    closest = start + t[..., None] * segment
+
+    return np.sqrt(np.sum((points - closest) ** 2, axis=1))
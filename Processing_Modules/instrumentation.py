@@ -0,0 +1,348 @@
+'''
+Opt-in timing and counting of the processing stages.
+
+Instrumentation is off by default. While it is off Stage
+returns a shared object that does nothing and Instrumented
+functions call straight through, so the hooks placed in the
+package cost one global lookup per call.
+
+Once turned on with EnableInstrumentation, each stage sends
+one dictionary to the sink when it finishes:
+
+    stage       -> Name of the stage, e.g. "RtAndImage.Rasterize"
+    parent      -> Name of the enclosing stage or None
+    depth       -> Number of enclosing stages
+    start       -> Epoch time the stage started
+    seconds     -> Wall time spent in the stage
+    counters    -> Dictionary of counts added with Count,
+                    e.g. files, bytes_read, contours
+    fields      -> Extra keyword arguments given to Stage
+    error       -> Name of the exception that left the stage or None
+    thread, pid -> Where the stage ran
+    profile     -> Top functions by cumulative time when the
+                    stage was profiled, otherwise None
+
+A sink is any function that accepts such a dictionary.
+'''
+
+import os
+import json
+import time
+import pstats
+import cProfile
+import functools
+import threading
+import contextvars
+
+
+_enabled = False
+
+_sink = None
+
+_profile = None
+
+_profile_limit = 25
+
+_current = contextvars.ContextVar('DicomModulesStage', default=None)
+
+
+def EnableInstrumentation(sink = None, profile = False, profile_limit = 25):
+    '''
+    Turns on instrumentation and returns the sink
+    that receives the stage records.
+
+    Optional Parameters:
+        sink: Function that is called with every stage
+                record. By default a new ListSink
+        profile: False to not profile, True to run cProfile
+                    around every outermost stage, or an iterable
+                    of stage names to profile
+        profile_limit: Number of functions kept in the
+                        profile of a record
+    '''
+
+    global _enabled, _sink, _profile, _profile_limit
+
+    if sink is None:
+        sink = ListSink()
+
+    if profile is True or profile is False:
+        _profile = profile
+
+    else:
+        _profile = frozenset(profile)
+
+    _profile_limit = profile_limit
+
+    _sink = sink
+
+    _enabled = True
+
+    return sink
+
+
+def DisableInstrumentation():
+    '''
+    Turns off instrumentation, stages that are
+    running will still emit their records
+    '''
+
+    global _enabled
+
+    _enabled = False
+
+
+def InstrumentationEnabled():
+    return _enabled
+
+
+def Stage(name : str, **fields):
+    '''
+    Returns a context manager that times the code
+    inside it as the stage "name". Keyword arguments
+    are stored in the "fields" of the record.
+
+    Usage:
+        with Stage("RtAndImage.Rasterize", roi=key):
+            ...
+    '''
+
+    if not _enabled:
+        return _NULL_STAGE
+
+    return _ActiveStage(name, fields)
+
+
+def Count(name : str, amount = 1):
+    '''
+    Adds amount to the counter "name" of the
+    innermost running stage. Does nothing when
+    instrumentation is off or no stage is running.
+    '''
+
+    if not _enabled:
+        return
+
+    stage = _current.get()
+
+    if stage is not None:
+        stage.counters[name] = stage.counters.get(name, 0) + amount
+
+
+def Instrumented(name : str):
+    '''
+    Decorator that runs every call of the
+    decorated function as the stage "name"
+    '''
+
+    def decorator(func):
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+
+            if not _enabled:
+                return func(*args, **kwargs)
+
+            with _ActiveStage(name, {}):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class _NullStage:
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _ActiveStage:
+
+    __slots__ = ('name', 'fields', 'counters', 'parent', 'depth', '_start', '_wall', '_token', '_profiler')
+
+    def __init__(self, name, fields):
+
+        self.name = name
+
+        self.fields = fields
+
+        self.counters = {}
+
+
+    def __enter__(self):
+
+        self.parent = _current.get()
+
+        self.depth = 0 if self.parent is None else self.parent.depth + 1
+
+        self._profiler = None
+
+        if _profile is True:
+            profile_stage = self.depth == 0
+
+        else:
+            profile_stage = bool(_profile) and self.name in _profile
+
+        if profile_stage:
+
+            self._profiler = cProfile.Profile()
+
+            try:
+                self._profiler.enable()
+
+            except ValueError:
+                # Another profiler is already running on this thread
+                self._profiler = None
+
+        self._token = _current.set(self)
+
+        self._wall = time.time()
+
+        self._start = time.perf_counter()
+
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        seconds = time.perf_counter() - self._start
+
+        _current.reset(self._token)
+
+        profile = None
+
+        if self._profiler is not None:
+
+            self._profiler.disable()
+
+            profile = _profile_summary(self._profiler, _profile_limit)
+
+        record = {
+            'stage': self.name,
+            'parent': None if self.parent is None else self.parent.name,
+            'depth': self.depth,
+            'start': self._wall,
+            'seconds': seconds,
+            'counters': self.counters,
+            'fields': self.fields,
+            'error': None if exc_type is None else exc_type.__name__,
+            'thread': threading.current_thread().name,
+            'pid': os.getpid(),
+            'profile': profile,
+        }
+
+        sink = _sink
+
+        if sink is not None:
+            sink(record)
+
+        return False
+
+
+def _profile_summary(profiler, limit):
+
+    stats = pstats.Stats(profiler)
+
+    rows = []
+
+    for (file_name, line, func_name), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+
+        rows.append({
+            'function': f'{os.path.basename(file_name)}:{line}({func_name})',
+            'ncalls': ncalls,
+            'tottime': tottime,
+            'cumtime': cumtime,
+        })
+
+    rows.sort(key=lambda row: row['cumtime'], reverse=True)
+
+    return rows[:limit]
+
+
+class ListSink:
+    '''
+    Sink that keeps every record in the list
+    field Records
+    '''
+
+    def __init__(self):
+
+        self.Records = []
+
+        self._lock = threading.Lock()
+
+
+    def __call__(self, record):
+
+        with self._lock:
+            self.Records.append(record)
+
+
+    def Totals(self):
+        '''
+        Returns a dictionary with stage names for keys
+        and tuples of (number of calls, total seconds)
+        for values
+        '''
+
+        totals = {}
+
+        for record in self.Records:
+
+            calls, seconds = totals.get(record['stage'], (0, 0.0))
+
+            totals[record['stage']] = (calls + 1, seconds + record['seconds'])
+
+        return totals
+
+
+class JsonLinesSink:
+    '''
+    Sink that appends every record as one line
+    of json to the file on file_path
+    '''
+
+    def __init__(self, file_path : str):
+
+        self.file_path = file_path
+
+        self._lock = threading.Lock()
+
+
+    def __call__(self, record):
+
+        line = json.dumps(record, default=str) + '\n'
+
+        with self._lock:
+
+            with open(self.file_path, 'a') as fopen:
+                fopen.write(line)
+
+
+class LoggingSink:
+    '''
+    Sink that writes a one line summary of every
+    record to a logging.Logger at level "level"
+    '''
+
+    def __init__(self, logger, level = 20):
+
+        self.logger = logger
+
+        self.level = level
+
+
+    def __call__(self, record):
+
+        counters = ' '.join(f'{key}={value}' for key, value in record['counters'].items())
+
+        self.logger.log(self.level, '%s%s %.4fs %s', '  ' * record['depth'], record['stage'], record['seconds'], counters)
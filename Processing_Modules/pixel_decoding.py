@@ -0,0 +1,262 @@
+'''
+Decoding of pixel data for many images at once.
+
+pydicom decodes pixel data on the first access of
+pixel_array, one image at a time in the calling thread,
+with the first handler in pydicom.config.pixel_data_handlers
+that supports the transfer syntax. The functions here decode
+a whole batch in a pool of workers, with a handler picked per
+transfer syntax, and store the results where pixel_array
+looks for them so later accesses do not decode again.
+'''
+
+# Downloaded python packages
+import numpy as np
+import time
+import threading
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.pixel_data_handlers.util import get_image_pixel_ids
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# From the Modules folder
+from DicomModules.Processing_Modules.instrumentation import Stage, Count
+
+
+# Attributes a pixel data handler needs to decode an image
+_PIXEL_ATTRIBUTES = ['Rows', 'Columns', 'SamplesPerPixel', 'BitsAllocated', 'BitsStored', 'HighBit',
+                     'PixelRepresentation', 'PhotometricInterpretation', 'PlanarConfiguration', 'NumberOfFrames',
+                     'PixelData']
+
+# Transfer syntax UID -> name of the preferred handler
+_preferred = {}
+
+_lock = threading.Lock()
+
+
+def HandlerName(handler):
+    '''
+    Returns the short name of a pydicom pixel data handler
+    module, as accepted by Dataset.convert_pixel_data
+    (e.g. 'gdcm', 'pillow', 'rle', 'numpy')
+    '''
+
+    return handler.__name__.rsplit('.', 1)[-1].replace('_handler', '')
+
+
+def AvailableHandlers(transfer_syntax):
+    '''
+    Returns a list of the names of the installed pixel data
+    handlers that can decode transfer_syntax, in the order
+    of pydicom.config.pixel_data_handlers
+    '''
+
+    from pydicom import config
+
+    return [HandlerName(handler) for handler in config.pixel_data_handlers
+            if handler.is_available() and handler.supports_transfer_syntax(transfer_syntax)]
+
+
+def PreferredHandler(transfer_syntax):
+    '''
+    Returns the name of the handler used for transfer_syntax:
+    the one set with SetPreferredHandler or picked by
+    BenchmarkHandlers, else the first available one.
+    None when no installed handler supports it.
+    '''
+
+    with _lock:
+        name = _preferred.get(str(transfer_syntax))
+
+    if name is not None:
+        return name
+
+    available = AvailableHandlers(transfer_syntax)
+
+    return available[0] if available else None
+
+
+def SetPreferredHandler(transfer_syntax, name):
+    '''
+    Makes the handler "name" the one used for transfer_syntax,
+    or restores the default order when name is None
+    '''
+
+    with _lock:
+
+        if name is None:
+            _preferred.pop(str(transfer_syntax), None)
+
+        else:
+            if name not in AvailableHandlers(transfer_syntax):
+                raise ValueError(f"The handler {name} is not available for the transfer syntax {transfer_syntax}")
+
+            _preferred[str(transfer_syntax)] = name
+
+
+def IsDecoded(dcm):
+    '''
+    Returns True when pixel_array of dcm is already cached
+    for its current pixel data
+    '''
+
+    return getattr(dcm, '_pixel_array', None) is not None and getattr(dcm, '_pixel_id', None) == get_image_pixel_ids(dcm)
+
+
+def DecodeAll(images, max_workers = None, processes = False, handler = None):
+    '''
+    Decodes the pixel data of every image of images that is
+    not decoded yet, and caches the arrays so pixel_array
+    returns them without decoding again. Returns the number
+    of images decoded.
+
+    images: Iterable of pydicom datasets
+
+    Optional Parameters:
+        max_workers: Number of workers, by default the number
+                        of cpus
+        processes: If True decode in worker processes, which
+                    helps handlers that hold the GIL (e.g. the
+                    pure python RLE handler). Only the pixel
+                    attributes are sent to the workers
+        handler: Name of the handler to use for every image,
+                    by default PreferredHandler of each
+                    transfer syntax
+    '''
+
+    todo = [dcm for dcm in images if 'PixelData' in dcm and not IsDecoded(dcm)]
+
+    if not todo:
+        return 0
+
+    names = [handler or PreferredHandler(dcm.file_meta.TransferSyntaxUID) for dcm in todo]
+
+    with Stage('PixelDecoding.DecodeAll', processes=processes):
+
+        Count('images', len(todo))
+
+        if processes:
+
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+
+                arrays = executor.map(_decode_pixel_module, [_pixel_module(dcm) for dcm in todo], names,
+                                      chunksize=max(1, len(todo) // (4 * (max_workers or 8))))
+
+                for dcm, array in zip(todo, arrays):
+
+                    dcm._pixel_array = array
+
+                    dcm._pixel_id = get_image_pixel_ids(dcm)
+
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+                list(executor.map(_decode_in_place, todo, names))
+
+    return len(todo)
+
+
+def BenchmarkHandlers(images, repeats = 3, sample = 16, select = False):
+    '''
+    Returns a list of dictionaries, one for every transfer
+    syntax in images and every handler available for it,
+    with the keys TransferSyntaxUID, Handler, Frames, Seconds,
+    MBPerSecond (of decoded pixels) and Error. Nothing is
+    cached on the images.
+
+    Optional Parameters:
+        repeats: Number of times each sample is decoded, the
+                    fastest run is reported
+        sample: The most images of each transfer syntax used
+        select: If True the fastest handler of each transfer
+                    syntax becomes its preferred handler
+    '''
+
+    from pydicom import config
+
+    by_syntax = {}
+
+    for dcm in images:
+
+        if 'PixelData' in dcm:
+            by_syntax.setdefault(str(dcm.file_meta.TransferSyntaxUID), []).append(dcm)
+
+    results = []
+
+    for transfer_syntax, group in by_syntax.items():
+
+        group = group[:sample]
+
+        best = None
+
+        for handler in config.pixel_data_handlers:
+
+            if not (handler.is_available() and handler.supports_transfer_syntax(transfer_syntax)):
+                continue
+
+            record = {'TransferSyntaxUID': transfer_syntax, 'Handler': HandlerName(handler), 'Frames': 0,
+                      'Seconds': None, 'MBPerSecond': None, 'Error': ''}
+
+            try:
+                fastest = None
+
+                for _ in range(repeats):
+
+                    start = time.perf_counter()
+
+                    decoded = sum(handler.get_pixeldata(dcm).nbytes for dcm in group)
+
+                    seconds = time.perf_counter() - start
+
+                    fastest = seconds if fastest is None else min(fastest, seconds)
+
+                record['Frames'] = sum(int(dcm.get('NumberOfFrames', 1) or 1) for dcm in group)
+
+                record['Seconds'] = fastest
+
+                record['MBPerSecond'] = decoded / 2 ** 20 / fastest if fastest > 0 else float('inf')
+
+                if best is None or fastest < best[1]:
+                    best = (record['Handler'], fastest)
+
+            except Exception as e:
+                record['Error'] = f'{type(e).__name__}: {e}'
+
+            results.append(record)
+
+        if select and best is not None:
+            SetPreferredHandler(transfer_syntax, best[0])
+
+    return results
+
+
+def _decode_in_place(dcm, name):
+
+    # Caches the array on dcm the same way pixel_array does
+    dcm.convert_pixel_data(name or '')
+
+
+def _pixel_module(dcm):
+
+    module = Dataset()
+
+    for keyword in _PIXEL_ATTRIBUTES:
+
+        if keyword in dcm:
+            module.add(dcm.data_element(keyword))
+
+    module.file_meta = FileMetaDataset()
+
+    module.file_meta.TransferSyntaxUID = dcm.file_meta.TransferSyntaxUID
+
+    module.is_little_endian = dcm.is_little_endian
+
+    module.is_implicit_VR = dcm.is_implicit_VR
+
+    return module
+
+
+def _decode_pixel_module(module, name):
+
+    module.convert_pixel_data(name or '')
+
+    return np.asarray(module.pixel_array)
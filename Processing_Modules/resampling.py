@@ -0,0 +1,133 @@
+# Downloaded python packages
+import numpy as np
+from collections import namedtuple
+
+
+Grid = namedtuple('Grid', ['size', 'origin', 'spacing', 'direction'])
+
+# Names accepted for the interpolation arguments
+INTERPOLATORS = ('nearest', 'linear', 'bspline', 'label')
+
+
+def GridOf(img):
+    '''
+    Returns the Grid (size, origin, spacing, direction)
+    of the sITK image img
+    '''
+
+    return Grid(tuple(img.GetSize()), tuple(img.GetOrigin()), tuple(img.GetSpacing()), tuple(img.GetDirection()))
+
+
+def SpacingGrid(img, spacing):
+    '''
+    Returns the Grid covering the same physical extent
+    as the sITK image img with the voxel spacing "spacing".
+    The first voxel of both grids is at the same place.
+
+    spacing: A number for isotropic spacing, or (x, y, z)
+                spacing in mm. None keeps the spacing of img
+                along that axis.
+    '''
+
+    old_spacing = np.array(img.GetSpacing(), dtype=np.float64)
+
+    if np.isscalar(spacing):
+        spacing = [spacing] * 3
+
+    new_spacing = np.array([old if new is None else new for old, new in zip(old_spacing, spacing)], dtype=np.float64)
+
+    extent = np.array(img.GetSize()) * old_spacing
+
+    size = np.maximum(1, np.round(extent / new_spacing)).astype(int)
+
+    return Grid(tuple(int(val) for val in size), tuple(img.GetOrigin()), tuple(new_spacing), tuple(img.GetDirection()))
+
+
+def EmptyImage(grid, pixel_id = None):
+    '''
+    Returns a sITK image filled with zeros on grid
+
+    Optional Parameters:
+        pixel_id: sITK pixel type, by default sitkUInt8
+    '''
+
+    import SimpleITK as sITK
+
+    img = sITK.Image(list(grid.size), sITK.sitkUInt8 if pixel_id is None else pixel_id)
+
+    img.SetOrigin(grid.origin)
+
+    img.SetSpacing(grid.spacing)
+
+    img.SetDirection(grid.direction)
+
+    return img
+
+
+def ResampleImage(img, grid, interpolation = 'linear', default_value = None):
+    '''
+    Returns the sITK image img resampled onto grid,
+    keeping its pixel type
+
+    Optional Parameters:
+        interpolation: One of 'nearest', 'linear', 'bspline'
+                        or 'label'. Use 'nearest' or 'label'
+                        for masks and label maps
+        default_value: Value of voxels outside of img, by
+                        default the smallest value of img
+    '''
+
+    import SimpleITK as sITK
+
+    if GridOf(img) == tuple(grid):
+        return img
+
+    if default_value is None:
+        default_value = float(sITK.GetArrayViewFromImage(img).min())
+
+    return sITK.Resample(img, list(grid.size), sITK.Transform(), _interpolator(interpolation), grid.origin,
+                         grid.spacing, grid.direction, default_value, img.GetPixelID())
+
+
+def SliceGrid(native, target):
+    '''
+    Returns the Grid with the in plane voxels of the Grid
+    "target" and the slices of the Grid "native", or None
+    when the two grids are not parallel. Contours drawn on
+    this grid are on the in plane target voxels, so only
+    the slice axis is left to be resampled.
+    '''
+
+    direction = np.array(native.direction, dtype=np.float64).reshape(3, 3)
+
+    if not np.allclose(direction, np.array(target.direction, dtype=np.float64).reshape(3, 3), atol=1e-6):
+        return None
+
+    normal = direction[:, 2]
+
+    native_origin = np.array(native.origin, dtype=np.float64)
+
+    target_origin = np.array(target.origin, dtype=np.float64)
+
+    # Move the target origin along the slice normal onto the first native slice
+    origin = target_origin + normal * ((native_origin - target_origin) @ normal)
+
+    return Grid((target.size[0], target.size[1], native.size[2]), tuple(origin),
+                (target.spacing[0], target.spacing[1], native.spacing[2]), tuple(native.direction))
+
+
+def _interpolator(name):
+
+    import SimpleITK as sITK
+
+    interpolators = {
+        'nearest': sITK.sitkNearestNeighbor,
+        'linear': sITK.sitkLinear,
+        'bspline': sITK.sitkBSpline,
+        'label': sITK.sitkLabelGaussian,
+    }
+
+    if name not in interpolators:
+        raise ValueError(f"Unknown interpolation {name}, use one of {INTERPOLATORS}")
+
+    return interpolators[name]
@@ -0,0 +1,96 @@
+# Downloaded python packages
+import numpy as np
+from collections import namedtuple
+
+
+RoiStatistics = namedtuple('RoiStatistics', ['voxels', 'volume_cc', 'mean', 'std', 'min', 'max', 'histogram', 'bin_edges'])
+
+
+def RoiStatisticsFromIndices(values, roi_indices, voxel_volume, bins = None, hist_range = None):
+    '''
+    Returns a dictionary with ROI keys for keys and
+    RoiStatistics for values, computed for all ROIs at
+    once with label indexed reductions over the voxels
+    of every ROI put end to end. ROIs may overlap.
+
+    values: Flat numpy array of the image values
+    roi_indices: Dictionary with ROI keys for keys and
+                    arrays of flat indices into values of
+                    the voxels inside the ROI for values
+    voxel_volume: Volume of one voxel in mm^3
+
+    Optional Parameters:
+        bins: Number of histogram bins. When given every
+                ROI gets a histogram of its values over the
+                same bin_edges, a reversed cumulative sum of
+                which gives a DVH like curve
+        hist_range: (lower, upper) of the histogram, by
+                        default the range of the values of
+                        all ROIs
+    '''
+
+    keys = list(roi_indices)
+
+    counts = np.array([len(roi_indices[key]) for key in keys], dtype=np.int64)
+
+    if len(keys) == 0:
+        return {}
+
+    roi_values = values[np.concatenate([np.asarray(roi_indices[key], dtype=np.int64) for key in keys])]
+
+    labels = np.repeat(np.arange(len(keys)), counts)
+
+    as_float = roi_values.astype(np.float64)
+
+    sums = np.bincount(labels, weights=as_float, minlength=len(keys))
+
+    squares = np.bincount(labels, weights=as_float * as_float, minlength=len(keys))
+
+    filled = counts > 0
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+
+        means = np.where(filled, sums / counts, np.nan)
+
+        stds = np.sqrt(np.maximum(np.where(filled, squares / counts, np.nan) - means * means, 0.0))
+
+    mins = np.full(len(keys), np.nan)
+
+    maxs = np.full(len(keys), np.nan)
+
+    if filled.any():
+
+        # reduceat needs the start of every non empty run of labels
+        starts = (np.cumsum(counts) - counts)[filled]
+
+        mins[filled] = np.minimum.reduceat(roi_values, starts)
+
+        maxs[filled] = np.maximum.reduceat(roi_values, starts)
+
+    histograms = [None] * len(keys)
+
+    bin_edges = None
+
+    if bins is not None:
+
+        if hist_range is None:
+            hist_range = (np.nanmin(mins), np.nanmax(maxs)) if filled.any() else (0.0, 1.0)
+
+        lower, upper = float(hist_range[0]), float(hist_range[1])
+
+        if upper <= lower:
+            upper = lower + 1.0
+
+        bin_edges = np.linspace(lower, upper, bins + 1)
+
+        inside = (as_float >= lower) & (as_float <= upper)
+
+        bin_index = np.minimum(((as_float[inside] - lower) * (bins / (upper - lower))).astype(np.int64), bins - 1)
+
+        counts_2d = np.bincount(labels[inside] * bins + bin_index, minlength=len(keys) * bins).reshape(len(keys), bins)
+
+        histograms = list(counts_2d)
+
+    return {key: RoiStatistics(int(counts[ind]), counts[ind] * voxel_volume / 1000.0, means[ind], stds[ind],
+                               mins[ind], maxs[ind], histograms[ind], bin_edges)
+            for ind, key in enumerate(keys)}
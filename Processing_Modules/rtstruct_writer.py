@@ -0,0 +1,280 @@
+# Downloaded python packages
+import numpy as np
+from pydicom.dataset import Dataset
+from pydicom.sequence import Sequence
+from pydicom.uid import generate_uid, ExplicitVRLittleEndian
+import time
+
+# From the Modules folder
+from DicomModules.DICOM_Objects.Base_Class.dicom_processing import DicomProcessing
+from DicomModules.Processing_Modules.contours import ExtractContours, SimplifyPolyline, IndexToPhysicalMatrix
+from DicomModules.Processing_Modules.instrumentation import Stage, Count
+
+
+RT_STRUCTURE_SET_STORAGE = '1.2.840.10008.5.1.4.1.1.481.3'
+
+STUDY_COMPONENT_MANAGEMENT = '1.2.840.10008.3.1.2.3.1'
+
+# Attributes copied from the referenced images into the new RTSTRUCT
+_PATIENT_STUDY_ATTRIBUTES = ['PatientName', 'PatientID', 'PatientBirthDate', 'PatientSex', 'StudyInstanceUID',
+                             'StudyDate', 'StudyTime', 'StudyID', 'AccessionNumber', 'ReferringPhysicianName']
+
+_DEFAULT_COLOURS = [[255, 0, 0], [0, 255, 0], [0, 0, 255], [255, 255, 0], [0, 255, 255], [255, 0, 255],
+                    [255, 128, 0], [128, 0, 255], [0, 128, 255], [128, 255, 0]]
+
+
+def MaskContours(mask_array, reference_img, max_points = None, tolerance = None):
+    '''
+    Returns a list of tuples (slice index, (N, 3) array of
+    physical points, error bound) for every contour around
+    the foreground of mask_array.
+
+    mask_array: numpy array (z, y, x) on the grid of
+                    reference_img, values above 0 are foreground
+    reference_img: sITK image describing the grid
+
+    Optional Parameters:
+        max_points: The most points kept in each contour
+        tolerance: Simplification tolerance in mm
+    '''
+
+    matrix, origin = IndexToPhysicalMatrix(reference_img)
+
+    spacing = np.array(reference_img.GetSpacing()[:2])
+
+    foreground = np.asarray(mask_array) > 0
+
+    filled_slices = np.flatnonzero(foreground.reshape(foreground.shape[0], -1).any(axis=1))
+
+    contours = []
+
+    for k in filled_slices:
+
+        for contour in ExtractContours(foreground[k]):
+
+            xy = contour[:, ::-1]
+
+            if max_points is not None or tolerance is not None:
+
+                # Simplify in mm so the tolerance does not depend on the pixel spacing
+                simplified, error = SimplifyPolyline(xy * spacing, tolerance, max_points)
+
+                xy = simplified / spacing
+
+            else:
+                error = 0.0
+
+            index = np.column_stack((xy, np.full(len(xy), k, dtype=np.float64)))
+
+            contours.append((int(k), index @ matrix.T + origin, error))
+
+    return contours
+
+
+def WriteRtStructFromMasks(SavePath : str, Images, Masks : dict, RoiNames = None, max_points = None, tolerance = None,
+                           StructureSetLabel = 'Derived', overwrite = False):
+    '''
+    Writes an RTSTRUCT to SavePath that has one ROI for every
+    mask in Masks, contoured on the images in Images, and
+    returns a dictionary with the ROI numbers for keys and the
+    largest simplification error (mm) of the ROI for values.
+
+    Images: DicomImageArray the masks were made on
+    Masks: Dictionary of sITK images or numpy arrays (z, y, x)
+            on the grid of Images.sITKImage, values above 0
+            are inside the ROI. Integer keys are used as the
+            ROI numbers, any other keys are used as ROI names
+
+    Optional Parameters:
+        RoiNames: Dictionary from the keys of Masks to ROI names
+        max_points: The most points kept in each contour
+        tolerance: Simplification tolerance in mm
+        StructureSetLabel: Label of the new structure set
+        overwrite: If False an existing file raises FileExistsError
+    '''
+
+    import SimpleITK as sITK
+
+    if RoiNames is None:
+        RoiNames = {}
+
+    reference_img = Images.sITKImage
+
+    images = list(Images)
+
+    first = images[0]
+
+    frame_uid = first.FrameOfReferenceUID
+
+    slice_images = _slice_images(images, reference_img)
+
+    attributes = {key: first.get(key, '') for key in _PATIENT_STUDY_ATTRIBUTES}
+
+    sop_uid = generate_uid()
+
+    now = time.localtime()
+
+    attributes.update({
+        'SOPClassUID': RT_STRUCTURE_SET_STORAGE,
+        'SOPInstanceUID': sop_uid,
+        'Modality': 'RTSTRUCT',
+        'SeriesInstanceUID': generate_uid(),
+        'SeriesNumber': 1,
+        'InstanceNumber': 1,
+        'Manufacturer': '',
+        'StructureSetLabel': StructureSetLabel,
+        'StructureSetDate': time.strftime('%Y%m%d', now),
+        'StructureSetTime': time.strftime('%H%M%S', now),
+        'ReferencedFrameOfReferenceSequence': _referenced_frame(frame_uid, first, images),
+    })
+
+    meta = {
+        'MediaStorageSOPClassUID': RT_STRUCTURE_SET_STORAGE,
+        'MediaStorageSOPInstanceUID': sop_uid,
+        'TransferSyntaxUID': ExplicitVRLittleEndian,
+    }
+
+    structure_set_rois = []
+
+    roi_contours = []
+
+    observations = []
+
+    errors = {}
+
+    used_numbers = {int(key) for key in Masks if _is_int(key)}
+
+    next_number = 1
+
+    for position, (key, mask) in enumerate(Masks.items()):
+
+        if _is_int(key):
+            roi_number = int(key)
+
+        else:
+            while next_number in used_numbers:
+                next_number += 1
+
+            roi_number = next_number
+
+            used_numbers.add(roi_number)
+
+        mask_array = sITK.GetArrayViewFromImage(mask) if isinstance(mask, sITK.Image) else np.asarray(mask)
+
+        if mask_array.shape != reference_img.GetSize()[::-1]:
+            raise ValueError(f"The mask {key} does not have the shape of the images {reference_img.GetSize()[::-1]}")
+
+        with Stage('RtStructWriter.Contours', roi=roi_number):
+
+            contours = MaskContours(mask_array, reference_img, max_points, tolerance)
+
+            Count('contours', len(contours))
+
+        roi_item = Dataset()
+        roi_item.ROINumber = roi_number
+        roi_item.ReferencedFrameOfReferenceUID = frame_uid
+        roi_item.ROIName = RoiNames.get(key, f'ROI_{roi_number}' if _is_int(key) else str(key))
+        roi_item.ROIGenerationAlgorithm = 'AUTOMATIC'
+
+        structure_set_rois.append(roi_item)
+
+        contour_items = []
+
+        for k, points, _ in contours:
+
+            image_ref = Dataset()
+            image_ref.ReferencedSOPClassUID = images[slice_images[k]].SOPClassUID
+            image_ref.ReferencedSOPInstanceUID = images[slice_images[k]].SOPInstanceUID
+
+            contour = Dataset()
+            contour.ContourImageSequence = Sequence([image_ref])
+            contour.ContourGeometricType = 'CLOSED_PLANAR'
+            contour.NumberOfContourPoints = len(points)
+            contour.ContourData = [f'{val:.4f}'.rstrip('0').rstrip('.') for val in points.ravel()]
+
+            contour_items.append(contour)
+
+        roi_contour = Dataset()
+        roi_contour.ReferencedROINumber = roi_number
+        roi_contour.ROIDisplayColor = _DEFAULT_COLOURS[position % len(_DEFAULT_COLOURS)]
+        roi_contour.ContourSequence = Sequence(contour_items)
+
+        roi_contours.append(roi_contour)
+
+        observation = Dataset()
+        observation.ObservationNumber = roi_number
+        observation.ReferencedROINumber = roi_number
+        observation.RTROIInterpretedType = ''
+        observation.ROIInterpreter = ''
+
+        observations.append(observation)
+
+        errors[roi_number] = max((error for _, _, error in contours), default=0.0)
+
+    attributes['StructureSetROISequence'] = Sequence(structure_set_rois)
+
+    attributes['ROIContourSequence'] = Sequence(roi_contours)
+
+    attributes['RTROIObservationsSequence'] = Sequence(observations)
+
+    DicomProcessing.CreateNewDicom(SavePath, meta, attributes, overwrite=overwrite)
+
+    return errors
+
+
+def _is_int(key):
+
+    try:
+        return int(key) == key or str(int(key)) == str(key)
+
+    except (TypeError, ValueError):
+        return False
+
+
+def _slice_images(images, reference_img):
+    '''
+    Returns an array whose k-th item is the index in images
+    of the image at slice k of reference_img. Found by
+    projecting every image position onto the slice normal,
+    so the order of images does not matter.
+    '''
+
+    matrix, origin = IndexToPhysicalMatrix(reference_img)
+
+    normal = matrix[:, 2] / np.linalg.norm(matrix[:, 2])
+
+    positions = np.array([[float(val) for val in dcm.ImagePositionPatient] for dcm in images]) @ normal
+
+    depth = reference_img.GetSize()[2]
+
+    slice_positions = (origin + np.outer(np.arange(depth), matrix[:, 2])) @ normal
+
+    return np.argmin(np.abs(slice_positions[:, None] - positions[None, :]), axis=1)
+
+
+def _referenced_frame(frame_uid, first, images):
+
+    contour_images = []
+
+    for dcm in images:
+
+        image_ref = Dataset()
+        image_ref.ReferencedSOPClassUID = dcm.SOPClassUID
+        image_ref.ReferencedSOPInstanceUID = dcm.SOPInstanceUID
+
+        contour_images.append(image_ref)
+
+    series = Dataset()
+    series.SeriesInstanceUID = first.SeriesInstanceUID
+    series.ContourImageSequence = Sequence(contour_images)
+
+    study = Dataset()
+    study.ReferencedSOPClassUID = STUDY_COMPONENT_MANAGEMENT
+    study.ReferencedSOPInstanceUID = first.StudyInstanceUID
+    study.RTReferencedSeriesSequence = Sequence([series])
+
+    frame = Dataset()
+    frame.FrameOfReferenceUID = frame_uid
+    frame.RTReferencedStudySequence = Sequence([study])
+
+    return Sequence([frame])
@@ -0,0 +1,219 @@
+# Downloaded python packages
+import numpy as np
+from collections import namedtuple
+
+
+# Attributes that must match for two images to be slices of one stack
+StackKey = namedtuple('StackKey', ['SeriesInstanceUID', 'Orientation', 'PixelSpacing', 'Rows', 'Columns',
+                                   'DiffusionBValue', 'EchoNumbers', 'EchoTime'])
+
+GeometryReport = namedtuple('GeometryReport', ['key', 'slices', 'spacing', 'first_position', 'last_position',
+                                               'missing', 'duplicates', 'uneven', 'valid'])
+
+SeriesStack = namedtuple('SeriesStack', ['images', 'report'])
+
+
+def StackKeyOf(dcm, decimals = 4):
+    '''
+    Returns the StackKey of the header of dcm, with the
+    orientation and pixel spacing rounded to decimals
+    so small differences in the files are ignored
+    '''
+
+    orientation = dcm.get('ImageOrientationPatient')
+
+    spacing = dcm.get('PixelSpacing')
+
+    return StackKey(
+        str(dcm.get('SeriesInstanceUID', '')),
+        None if orientation is None else tuple(np.round(np.asarray(orientation, dtype=np.float64), decimals)),
+        None if spacing is None else tuple(np.round(np.asarray(spacing, dtype=np.float64), decimals)),
+        dcm.get('Rows'),
+        dcm.get('Columns'),
+        _number(dcm.get('DiffusionBValue')),
+        _number(dcm.get('EchoNumbers')),
+        _number(dcm.get('EchoTime')),
+    )
+
+
+def SlicePositions(dicoms):
+    '''
+    Returns an array with the position of each image of
+    dicoms along the normal of the image plane of the
+    first image, from the headers only
+    '''
+
+    orientation = np.asarray(dicoms[0].ImageOrientationPatient, dtype=np.float64)
+
+    normal = np.cross(orientation[:3], orientation[3:])
+
+    positions = np.array([[float(val) for val in dcm.ImagePositionPatient] for dcm in dicoms], dtype=np.float64)
+
+    return positions @ normal
+
+
+def SplitStacks(dicoms, tolerance = 0.01, decimals = 4):
+    '''
+    Returns a list of SeriesStack (images, report), one for
+    every geometrically consistent stack in dicoms. The images
+    of each stack are sorted along the slice normal. Only the
+    headers are used, no pixel data is decoded.
+
+    dicoms: Iterable of pydicom datasets
+
+    Optional Parameters:
+        tolerance: Distance in mm under which two slices are
+                    at the same position, and by which the
+                    spacing between slices may vary
+        decimals: Decimals the orientation and pixel spacing
+                    are rounded to before grouping
+    '''
+
+    groups = {}
+
+    for dcm in dicoms:
+        groups.setdefault(StackKeyOf(dcm, decimals), []).append(dcm)
+
+    stacks = []
+
+    for key, group in groups.items():
+
+        if key.Orientation is None or any(dcm.get('ImagePositionPatient') is None for dcm in group):
+            stacks.append(SeriesStack(group, GeometryReport(key, len(group), None, None, None, [], [], False, False)))
+            continue
+
+        positions = SlicePositions(group)
+
+        order = np.argsort(positions, kind='stable')
+
+        images = [group[ind] for ind in order]
+
+        stacks.append(SeriesStack(images, CheckPositions(key, positions[order], tolerance, _header_spacing(group, tolerance))))
+
+    return stacks
+
+
+def CheckPositions(key, positions, tolerance = 0.01, nominal_spacing = None):
+    '''
+    Returns the GeometryReport of a stack with the sorted
+    slice positions "positions" (mm along the normal)
+
+    missing: Positions where slices are expected but absent
+    duplicates: Positions that hold more than one slice
+    uneven: True when the spacing between slices changes
+            by more than tolerance without a slice missing
+
+    Optional Parameters:
+        nominal_spacing: Expected mm between slices, e.g. the
+                            SpacingBetweenSlices of the headers.
+                            By default the most common step
+                            between the positions
+    '''
+
+    positions = np.asarray(positions, dtype=np.float64)
+
+    if len(positions) < 2:
+        return GeometryReport(key, len(positions), None, _first(positions), _last(positions), [], [], False, len(positions) == 1)
+
+    steps = np.diff(positions)
+
+    repeated = steps <= tolerance
+
+    duplicates = sorted(set(np.round(positions[1:][repeated], 4).tolist()))
+
+    distinct = positions[np.concatenate(([True], ~repeated))]
+
+    if len(distinct) < 2:
+        return GeometryReport(key, len(positions), None, _first(positions), _last(positions), [], duplicates, False, False)
+
+    gaps = np.diff(distinct)
+
+    if nominal_spacing is not None and nominal_spacing > tolerance:
+        spacing = float(nominal_spacing)
+
+    else:
+        # The most common step is the nominal spacing, missing slices give multiples of it
+        spacing = _most_common_step(gaps, tolerance)
+
+    multiples = np.rint(gaps / spacing)
+
+    missing = []
+
+    for ind in np.flatnonzero(multiples > 1):
+
+        missing.extend((distinct[ind] + spacing * np.arange(1, int(multiples[ind]))).round(4).tolist())
+
+    uneven = bool(np.any(np.abs(gaps - multiples * spacing) > tolerance))
+
+    valid = not missing and not duplicates and not uneven
+
+    return GeometryReport(key, len(positions), spacing, _first(positions), _last(positions), missing, duplicates, uneven, valid)
+
+
+def _header_spacing(dicoms, tolerance):
+    '''
+    Returns the SpacingBetweenSlices shared by every
+    header of dicoms, or None when it is absent or
+    differs between them
+    '''
+
+    values = [dcm.get('SpacingBetweenSlices') for dcm in dicoms]
+
+    if any(value is None or value == '' for value in values):
+        return None
+
+    values = np.abs(np.asarray(values, dtype=np.float64))
+
+    if values.max() - values.min() > tolerance:
+        return None
+
+    return float(values[0])
+
+
+def _most_common_step(gaps, tolerance):
+    '''
+    Returns the nominal step of the gaps between slices:
+    the median of the gaps in the most common tolerance
+    wide bin, or a smaller step seen at least twice when
+    every gap is a multiple of it, as when more than half
+    of the gaps skip a missing slice
+    '''
+
+    bins = np.rint(gaps / max(tolerance, 1e-6)).astype(np.int64)
+
+    values, counts = np.unique(bins, return_counts=True)
+
+    steps = [float(np.median(gaps[bins == value])) for value in values]
+
+    # np.unique sorts the bins, so argmax picks the smallest of the most common
+    common = int(np.argmax(counts))
+
+    for ind in range(common):
+
+        if counts[ind] >= 2 and np.all(np.abs(gaps - np.rint(gaps / steps[ind]) * steps[ind]) <= tolerance):
+            return steps[ind]
+
+    return steps[common]
+
+
+def _number(value):
+
+    if value is None or value == '':
+        return None
+
+    try:
+        return round(float(value), 4)
+
+    except (TypeError, ValueError):
+        # Multi valued, e.g. several echo numbers
+        return tuple(round(float(val), 4) for val in value)
+
+
+def _first(positions):
+
+    return float(positions[0]) if len(positions) else None
+
+
+def _last(positions):
+
+    return float(positions[-1]) if len(positions) else None
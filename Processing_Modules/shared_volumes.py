@@ -0,0 +1,232 @@
+'''
+Sharing of image volumes and masks with worker processes.
+
+Arguments of tasks sent to a process pool are pickled and
+copied into every worker. SharedVolumes copies a volume once
+into a multiprocessing.shared_memory block and returns a small
+SharedVolume descriptor, which is all that has to be sent.
+Workers map the block with AttachVolume and read the voxels
+in place.
+
+The SharedVolumes object owns its blocks: they stay available
+until Release or Close is called, or the with block ends, and
+workers must be done with them by then. Workers should be
+started by the publishing process (e.g. a ProcessPoolExecutor
+created there), which shares its resource tracker with them.
+'''
+
+# Downloaded python packages
+import numpy as np
+import sys
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing.shared_memory import SharedMemory
+
+# From the Modules folder
+from DicomModules.Processing_Modules.instrumentation import Stage, Count
+
+
+SharedVolume = namedtuple('SharedVolume', ['name', 'shape', 'dtype', 'origin', 'spacing', 'direction'])
+
+
+class SharedVolumes:
+    '''
+    Owner of the shared memory blocks of published volumes.
+
+    Fields:
+        _blocks: Dictionary [str : SharedMemory], by block name
+        _lock: threading.Lock
+    '''
+
+    def __init__(self):
+        '''
+        Returns an empty SharedVolumes object
+        '''
+
+        self._blocks = {}
+
+        self._lock = threading.Lock()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self.Close()
+
+        return False
+
+
+    def __len__(self):
+        return len(self._blocks)
+
+
+    def Publish(self, image):
+        '''
+        Copies the voxels of the sITK image into a new shared
+        memory block and returns its SharedVolume descriptor
+        (name, shape, dtype, origin, spacing, direction)
+        '''
+
+        import SimpleITK as sITK
+
+        return self.PublishArray(sITK.GetArrayViewFromImage(image), image.GetOrigin(), image.GetSpacing(),
+                                 image.GetDirection())
+
+
+    def PublishArray(self, array, origin = (0.0, 0.0, 0.0), spacing = (1.0, 1.0, 1.0),
+                     direction = (1.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0, 0.0, 1.0)):
+        '''
+        Copies the numpy array into a new shared memory block
+        and returns its SharedVolume descriptor. The array is
+        in (z, y, x) order as returned by
+        SimpleITK.GetArrayFromImage.
+
+        Optional Parameters:
+            origin, spacing, direction: Geometry of the volume,
+                                            as in SimpleITK
+        '''
+
+        array = np.asarray(array)
+
+        with Stage('SharedVolumes.Publish'):
+
+            # A block can not be empty
+            block = SharedMemory(create=True, size=max(array.nbytes, 1))
+
+            try:
+                shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+
+                shared[...] = array
+
+                del shared
+
+            except BaseException:
+                block.close()
+                block.unlink()
+                raise
+
+            Count('bytes', array.nbytes)
+
+        with self._lock:
+            self._blocks[block.name] = block
+
+        return SharedVolume(block.name, tuple(int(n) for n in array.shape), array.dtype.str,
+                            tuple(float(v) for v in origin), tuple(float(v) for v in spacing),
+                            tuple(float(v) for v in direction))
+
+
+    def Release(self, descriptor):
+        '''
+        Returns None and frees the block of the SharedVolume
+        descriptor. Processes still attached keep their
+        mapping until they detach.
+        '''
+
+        with self._lock:
+            block = self._blocks.pop(descriptor.name, None)
+
+        if block is None:
+            raise KeyError(f"The shared volume {descriptor.name} is not owned by this object")
+
+        _free(block)
+
+
+    def Close(self):
+        '''
+        Returns None and frees every block of the object
+
+        Effects:
+            - Descriptors published by the object can no
+                longer be attached
+        '''
+
+        with self._lock:
+            blocks, self._blocks = self._blocks, {}
+
+        for block in blocks.values():
+            _free(block)
+
+
+@contextmanager
+def AttachVolume(descriptor, writeable = False):
+    '''
+    Context manager giving a numpy array backed by the shared
+    memory block of the SharedVolume descriptor, without
+    copying. The array must not be used after the with block.
+
+        with AttachVolume(descriptor) as volume:
+            mean = volume.mean()
+
+    Optional Parameters:
+        writeable: If True the array can be written to, and
+                    changes are seen by every attached process
+    '''
+
+    block = _attach(descriptor.name)
+
+    try:
+        array = np.ndarray(descriptor.shape, dtype=np.dtype(descriptor.dtype), buffer=block.buf)
+
+        array.flags.writeable = writeable
+
+        yield array
+
+    finally:
+        array = None
+
+        try:
+            block.close()
+
+        except BufferError:
+            # A view of the block is still referenced, the mapping is closed when it is collected
+            pass
+
+
+def SharedImage(descriptor):
+    '''
+    Returns a sITK image with the voxels and geometry of the
+    SharedVolume descriptor. SimpleITK images own their
+    memory, so the voxels are copied once in the calling
+    process.
+    '''
+
+    import SimpleITK as sITK
+
+    with AttachVolume(descriptor) as array:
+        img = sITK.GetImageFromArray(array)
+
+    img.SetOrigin(descriptor.origin)
+
+    img.SetSpacing(descriptor.spacing)
+
+    img.SetDirection(descriptor.direction)
+
+    return img
+
+
+def _attach(name):
+
+    if sys.version_info >= (3, 13):
+        # Only the owner tracks the block, so a worker exiting does not free it
+        return SharedMemory(name, track=False)
+
+    return SharedMemory(name)
+
+
+def _free(block):
+
+    try:
+        block.close()
+
+    except BufferError:
+        pass
+
+    try:
+        block.unlink()
+
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,179 @@
+# Downloaded python packages
+import pydicom as pd
+import numpy as np
+import os
+import hashlib
+import tempfile
+from pydicom.uid import UID, ExplicitVRLittleEndian, ImplicitVRLittleEndian, DeflatedExplicitVRLittleEndian
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# From the Modules folder
+from DicomModules.Processing_Modules.instrumentation import Stage, Count
+
+
+# Transfer syntaxes written without pixel data compression
+_NATIVE_SYNTAXES = {
+    ExplicitVRLittleEndian: (False, True),
+    ImplicitVRLittleEndian: (True, True),
+    DeflatedExplicitVRLittleEndian: (False, True),
+}
+
+
+def PixelChecksum(dcm):
+    '''
+    Returns the sha256 hex digest of the decoded pixel
+    data of dcm, independent of its transfer syntax
+    '''
+
+    array = np.asarray(dcm.pixel_array)
+
+    array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<'))
+
+    sha = hashlib.sha256(f'{array.dtype.str}{array.shape}'.encode())
+
+    sha.update(array.tobytes())
+
+    return sha.hexdigest()
+
+
+def TranscodeFile(src_path, dst_path, transfer_syntax, verify = True, overwrite = False):
+    '''
+    Rewrites the DICOM file src_path to dst_path with the
+    transfer syntax "transfer_syntax", keeping every other
+    tag, and returns a dictionary with the keys Source,
+    Destination, TransferSyntaxUID, SourceBytes, Bytes and
+    Checksum. dst_path may be src_path to transcode in place.
+
+    Explicit and implicit VR little endian and deflated
+    explicit VR little endian are written uncompressed.
+    Other transfer syntaxes are encoded with Dataset.compress,
+    which supports RLE lossless with plain pydicom.
+
+    Optional Parameters:
+        verify: If True the new file is read back and its
+                    decoded pixels must have the same checksum
+                    as the source, else ValueError is raised and
+                    the new file is not kept
+        overwrite: If False an existing dst_path that is not
+                    src_path raises FileExistsError
+    '''
+
+    transfer_syntax = UID(transfer_syntax)
+
+    if os.path.exists(dst_path) and not overwrite and not os.path.samefile(src_path, dst_path):
+        raise FileExistsError(f"The file {dst_path} already exists")
+
+    with Stage('Transcoding.File', syntax=str(transfer_syntax)):
+
+        ds = pd.dcmread(src_path)
+
+        checksum = PixelChecksum(ds) if 'PixelData' in ds else None
+
+        if ds.file_meta.TransferSyntaxUID != transfer_syntax:
+            _convert(ds, transfer_syntax)
+
+        # Written next to the destination first so a failed write or check leaves it untouched
+        fd, tmp_path = tempfile.mkstemp(suffix='.dcm', dir=os.path.dirname(os.path.abspath(dst_path)))
+
+        try:
+            with os.fdopen(fd, 'wb') as fopen:
+                pd.dcmwrite(fopen, ds, write_like_original=False)
+
+            if verify and checksum is not None:
+
+                written = pd.dcmread(tmp_path)
+
+                if written.file_meta.TransferSyntaxUID != transfer_syntax or PixelChecksum(written) != checksum:
+                    raise ValueError(f"The pixel data of {src_path} changed when transcoding to {transfer_syntax}")
+
+            source_bytes = os.path.getsize(src_path)
+
+            os.replace(tmp_path, dst_path)
+
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        size = os.path.getsize(dst_path)
+
+        Count('files')
+
+        Count('bytes_written', size)
+
+    return {'Source': src_path, 'Destination': dst_path, 'TransferSyntaxUID': str(transfer_syntax),
+            'SourceBytes': source_bytes, 'Bytes': size, 'Checksum': checksum}
+
+
+def TranscodeFiles(paths, transfer_syntax, save_dir = None, verify = True, overwrite = False, max_workers = None,
+                   processes = False):
+    '''
+    Transcodes every file of paths with TranscodeFile in
+    parallel and returns the list of their records, in the
+    order of paths
+
+    Optional Parameters:
+        save_dir: Directory the new files are written to with
+                    their original names, by default the files
+                    are transcoded in place
+        max_workers: Number of workers, by default the number
+                        of cpus
+        processes: If True work in processes rather than
+                    threads, for encoders that hold the GIL
+    '''
+
+    paths = list(paths)
+
+    if save_dir is None:
+        destinations = paths
+
+    else:
+        os.makedirs(save_dir, exist_ok=True)
+
+        destinations = [os.path.join(save_dir, os.path.basename(path)) for path in paths]
+
+        if len(set(destinations)) != len(destinations):
+            raise ValueError("Several files have the same name and would be written to the same path in save_dir")
+
+    if not paths:
+        return []
+
+    pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+
+    with Stage('Transcoding.Files', files=len(paths)):
+
+        with pool(max_workers=max_workers) as executor:
+
+            futures = [executor.submit(TranscodeFile, src, dst, transfer_syntax, verify, overwrite)
+                       for src, dst in zip(paths, destinations)]
+
+            return [future.result() for future in futures]
+
+
+def _convert(ds, transfer_syntax):
+
+    if 'PixelData' in ds and ds.file_meta.TransferSyntaxUID.is_compressed:
+        # Decodes to explicit VR little endian
+        ds.decompress()
+
+    elif 'PixelData' in ds and not ds.is_little_endian:
+        # Big endian pixel data is stored byte swapped, write it little endian
+        array = ds.pixel_array
+
+        ds.PixelData = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder('<')).tobytes()
+
+        ds.is_little_endian, ds.is_implicit_VR = True, False
+
+        ds.file_meta.TransferSyntaxUID = ExplicitVRLittleEndian
+
+    if transfer_syntax in _NATIVE_SYNTAXES:
+
+        ds.is_implicit_VR, ds.is_little_endian = _NATIVE_SYNTAXES[transfer_syntax]
+
+        ds.file_meta.TransferSyntaxUID = transfer_syntax
+
+    else:
+        if 'PixelData' not in ds:
+            raise ValueError(f"Only files with pixel data can be written with the compressed syntax {transfer_syntax}")
+
+        ds.compress(transfer_syntax)
@@ -0,0 +1,423 @@
+# Downloaded python packages
+import numpy as np
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+
+# From the Modules folder
+from DicomModules.Processing_Modules.instrumentation import Stage, Count
+
+
+_FORMAT_VERSION = 1
+
+
+class VolumeCache:
+    '''
+    Persistent on disk cache of assembled image volumes
+    and ROI masks.
+
+    Entries are content addressed: the key of an image
+    volume is made from the SOPInstanceUIDs, modification
+    times and sizes of its files, so changing, adding or
+    removing a file gives a new key and the old entry is
+    never returned. Mask entries additionally depend on the
+    RTSTRUCT file and on the fill values of the masks.
+
+    Arrays are stored as .npy files that are memory mapped
+    when read, or as compressed .npz files. Once the size of
+    the cache grows over max_bytes the least recently used
+    entries are removed.
+
+    Layout:
+        cache_dir/<key>/geometry.json
+        cache_dir/<key>/volume.npy        (image entries)
+        cache_dir/<key>/<roi>.npy         (mask entries)
+    '''
+
+    def __init__(self, cache_dir : str, max_bytes = 20 * 2 ** 30, compress = False):
+        '''
+        Returns a VolumeCache object storing its entries
+        in cache_dir
+
+        Optional Parameters:
+            max_bytes: Size the cache is trimmed to after an
+                        entry is added, by default 20 GiB
+            compress: If True arrays are stored zlib compressed
+                        in .npz files, which are smaller but can
+                        not be memory mapped
+        '''
+
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.cache_dir = cache_dir
+
+        self.max_bytes = max_bytes
+
+        self.compress = compress
+
+        self._lock = threading.Lock()
+
+
+    def ImageKey(self, images):
+        '''
+        Returns the cache key of the volume made
+        from the DicomImageArray "images"
+        '''
+
+        return _digest(['image'] + [_file_identity(dcm) for dcm in images])
+
+
+    def MaskKey(self, images, rt, background_value, mask_value, **options):
+        '''
+        Returns the cache key of the masks made from
+        the RtStruct "rt" on the DicomImageArray "images".
+        Extra keyword arguments describing how the masks
+        were made are part of the key.
+        '''
+
+        extra = sorted((str(key), str(value)) for key, value in options.items())
+
+        return _digest(['mask', self.ImageKey(images), _file_identity(rt), str(background_value), str(mask_value)] + extra)
+
+
+    def GetImage(self, images):
+        '''
+        Returns the sITK image of the DicomImageArray
+        "images", read from the cache when present and
+        otherwise assembled with images.sITKImage and
+        added to the cache
+        '''
+
+        key = self.ImageKey(images)
+
+        arrays, geometry = self._read(key)
+
+        if arrays is not None:
+            return _to_image(_loaded(arrays['volume']), geometry)
+
+        img = images.sITKImage
+
+        entry = self.OpenEntry(key)
+
+        entry.Add('volume', img)
+
+        entry.Commit()
+
+        return img
+
+
+    def GetVolumeArray(self, images):
+        '''
+        Returns a tuple (array, geometry) of the cached volume
+        of the DicomImageArray "images", or (None, None). The
+        array is a read only memory map for uncompressed caches.
+        '''
+
+        arrays, geometry = self._read(self.ImageKey(images))
+
+        if arrays is None:
+            return None, None
+
+        return _loaded(arrays['volume']), geometry
+
+
+    def GetMasks(self, key):
+        '''
+        Returns a dictionary of sITK masks stored under
+        key (see MaskKey), or None when there is no entry
+        '''
+
+        masks = self.IterMasks(key)
+
+        return None if masks is None else dict(masks)
+
+
+    def IterMasks(self, key):
+        '''
+        Returns a generator of (ROI number, sITK mask) tuples
+        for the masks stored under key (see MaskKey), or None
+        when there is no entry. The files of the entry are
+        opened at once but each mask is only read and made
+        into an image when it is reached, so one mask at a
+        time is held in memory.
+        '''
+
+        arrays, geometry = self._read(key)
+
+        if arrays is None:
+            return None
+
+        return _iter_images(arrays, geometry)
+
+
+    def OpenEntry(self, key):
+        '''
+        Returns a CacheEntryWriter that adds arrays to a
+        new entry one at a time. The entry only becomes
+        visible once Commit is called.
+        '''
+
+        return CacheEntryWriter(self, key)
+
+
+    def Clear(self):
+        '''
+        Removes every entry from the cache
+        '''
+
+        for name in os.listdir(self.cache_dir):
+
+            shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+
+    def Size(self):
+        '''
+        Returns the number of bytes used by the cache
+        '''
+
+        return sum(size for _, _, size in self._entries())
+
+
+    def _read(self, key):
+
+        path = os.path.join(self.cache_dir, key)
+
+        geometry_path = os.path.join(path, 'geometry.json')
+
+        if not os.path.isfile(geometry_path):
+            return None, None
+
+        with Stage('VolumeCache.Read', key=key):
+
+            try:
+                with open(geometry_path) as fopen:
+                    geometry = json.load(fopen)
+
+                if geometry.get('version') != _FORMAT_VERSION:
+                    return None, None
+
+                arrays = {}
+
+                for name in geometry['names']:
+
+                    file_path = os.path.join(path, _file_name(name, geometry['compressed']))
+
+                    if geometry['compressed']:
+                        # Decompressed when the array is first used, see _loaded
+                        arrays[name] = np.load(file_path)
+
+                    else:
+                        arrays[name] = np.load(file_path, mmap_mode='r')
+
+            except (OSError, ValueError, KeyError):
+                # Entry removed by another process or only partly on disk
+                return None, None
+
+            # Mark the entry as recently used
+            os.utime(geometry_path)
+
+            Count('hits')
+
+        return arrays, geometry
+
+
+    def _entries(self):
+
+        entries = []
+
+        for name in os.listdir(self.cache_dir):
+
+            path = os.path.join(self.cache_dir, name)
+
+            geometry_path = os.path.join(path, 'geometry.json')
+
+            if not os.path.isfile(geometry_path):
+                continue
+
+            try:
+                last_used = os.stat(geometry_path).st_mtime
+
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+
+            except OSError:
+                continue
+
+            entries.append((last_used, path, size))
+
+        return entries
+
+
+    def _evict(self):
+
+        with self._lock:
+
+            entries = sorted(self._entries())
+
+            total = sum(size for _, _, size in entries)
+
+            for _, path, size in entries:
+
+                if total <= self.max_bytes:
+                    break
+
+                shutil.rmtree(path, ignore_errors=True)
+
+                total -= size
+
+
+class CacheEntryWriter:
+    '''
+    Writes the arrays of one cache entry to a
+    temporary directory that is moved into place
+    by Commit, so readers never see a partial entry
+    '''
+
+    def __init__(self, cache, key):
+
+        self._cache = cache
+
+        self._key = key
+
+        self._path = tempfile.mkdtemp(prefix='.tmp_', dir=cache.cache_dir)
+
+        self._names = []
+
+        self._geometry = None
+
+
+    def Add(self, name, img):
+        '''
+        Adds the sITK image "img" to the entry under name
+        '''
+
+        import SimpleITK as sITK
+
+        array = sITK.GetArrayViewFromImage(img)
+
+        geometry = {
+            'origin': list(img.GetOrigin()),
+            'spacing': list(img.GetSpacing()),
+            'direction': list(img.GetDirection()),
+        }
+
+        if self._geometry is None:
+            self._geometry = geometry
+
+        file_path = os.path.join(self._path, _file_name(str(name), self._cache.compress))
+
+        if self._cache.compress:
+            np.savez_compressed(file_path, array=array)
+
+        else:
+            np.save(file_path, array)
+
+        self._names.append(str(name))
+
+
+    def Commit(self):
+        '''
+        Makes the entry visible in the cache and removes
+        old entries when the cache is over its size limit
+        '''
+
+        geometry = dict(self._geometry or {}, names=self._names, compressed=self._cache.compress, version=_FORMAT_VERSION)
+
+        with open(os.path.join(self._path, 'geometry.json'), 'w') as fopen:
+            json.dump(geometry, fopen)
+
+        target = os.path.join(self._cache.cache_dir, self._key)
+
+        try:
+            os.replace(self._path, target)
+
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(self._path, ignore_errors=True)
+
+        self._cache._evict()
+
+
+    def Discard(self):
+        '''
+        Removes the partly written entry
+        '''
+
+        shutil.rmtree(self._path, ignore_errors=True)
+
+
+def _file_identity(dcm):
+
+    stat = os.stat(dcm.filename)
+
+    return f'{dcm.SOPInstanceUID}|{stat.st_mtime_ns}|{stat.st_size}'
+
+
+def _digest(parts):
+
+    sha = hashlib.sha256()
+
+    for part in parts:
+
+        sha.update(part.encode())
+
+        sha.update(b'\x00')
+
+    return sha.hexdigest()[:40]
+
+
+def _file_name(name, compressed):
+
+    safe = ''.join(char if char.isalnum() or char in '-_.' else '_' for char in name)
+
+    return safe + ('.npz' if compressed else '.npy')
+
+
+def _loaded(value):
+    '''
+    Returns the array of a value read by VolumeCache._read,
+    a memory map or an open .npz file
+    '''
+
+    if isinstance(value, np.lib.npyio.NpzFile):
+
+        with value:
+            return value['array']
+
+    return value
+
+
+def _iter_images(arrays, geometry):
+
+    from pydicom.valuerep import IS
+
+    try:
+        for name in geometry['names']:
+
+            key = IS(name) if name.lstrip('-').isdigit() else name
+
+            # Dropped as it is used so the memory of earlier masks can be released
+            yield key, _to_image(_loaded(arrays.pop(name)), geometry)
+
+    finally:
+        for value in arrays.values():
+
+            if isinstance(value, np.lib.npyio.NpzFile):
+                value.close()
+
+
+def _to_image(array, geometry):
+
+    import SimpleITK as sITK
+
+    img = sITK.GetImageFromArray(np.asarray(array))
+
+    img.SetOrigin(geometry['origin'])
+
+    img.SetSpacing(geometry['spacing'])
+
+    img.SetDirection(geometry['direction'])
+
+    return img
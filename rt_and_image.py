@@ -1,354 +1,1205 @@
-# Downloaded python packages
-import numpy as np
-from collections import namedtuple
-import SimpleITK as sITK
-from skimage import draw
-import os
-
-# From the Modules folder
-from DicomModules.DICOM_Arrays.dicom_image_array import DicomImageArray
-from DicomModules.DICOM_Objects.rtstruct import RtStruct
-from DicomModules.Display_Modules.slice_viewer import SliceView
-from DicomModules.DICOM_Arrays.dicom_array import DicomArray
-from DicomModules.DICOM_Objects.dicom_image import DicomImage
-
-class RtAndImage:
-    
-    '''
-    Fields:
-        _images: DicomArray
-        _rt: DicomProcessing
-        _roi_dict: Dictionary [str : list]
-
-    Properties:
-        Images -> DicomArray
-        RtStruct -> DicomProcessing
-    '''
-
-    def __init__(self, images, rts):
-        '''
-        Returns an RtAndImage object after initalizing
-        its fields
-
-        images -> DicomArray
-        rts -> DicomProcessing
-        '''
-        
-        self.Images = images
-
-        self.RtStruct = rts
-
-        self._roi_dict = {}
-
-    @property
-    def Images(self):
-        '''
-        Returns the dicom images that are stored
-        within the object
-        '''
-        return self._images
-
-    @Images.setter
-    def Images(self, value):
-        
-        if type(value) == DicomImageArray:
-            self._images = value
-        
-        else:
-            raise ValueError(f"The value set for images must be a DicomImageArray")
-        
-    @property
-    def RtStruct(self):
-        '''
-        Returns the RtStruct stored within the
-        object.
-        '''
-        return self._rt
-
-    @RtStruct.setter
-    def RtStruct(self, value):
-
-        if type(value) != RtStruct:
-            
-            raise ValueError(f"The value being set must a RtStruct object instance")
-        
-        else:
-            self._rt = value
-
-
-    def ViewSlices(self, with_contours = True, sort_key = lambda dcm: dcm.ImagePositionPatient[2], cm = 'gray', **dicom_filters):
-        
-        '''
-        Shows the slices stored in the image field
-        of the object, in an interactive UI.
-
-        Optional Arguments:
-            
-            with_contours: Boolean indicating whether or 
-                            not to plot the contours ontop 
-                            of the image. The default is True
-            cm: Colour map for use by the plotting function
-                    see matplotlib's color maps for more details.
-                    The default is "gray"
-            sort_key: The function describing how to sort the
-                        images for viewing, by default they are
-                        sorted by asscending z value
-            
-            
-            **dicom_filters (filter parameters):
-                Only the dicoms that have the key as an attribute and
-                a matching value to dicom_filters[key] will have their
-                images displayed
-
-                Examples of possible dicom_filters:
-                    Modality = "MR"
-                    DiffusionBValue = 0.0
-                    SliceLocation = 10
-
-        '''
-
-        dcm_arr = self._images
-
-        filters = list(filter(lambda s: not s.startswith('_'), dicom_filters.keys()))
-
-        if not filters == []:
-
-            for fKey in filters:
-
-                dcm_arr = dcm_arr.FilterDicoms(lambda dcm: dcm[fKey].value == dicom_filters[fKey] if hasattr(dcm, fKey) else False)
-
-        if dcm_arr._dicoms == []:
-
-            msg = f"Empty DicomArray returned after applying the specified filters{': ' + ', '.join(filters)}"
-
-            raise Exception(msg)
-
-        dcm_arr.SortDicoms(sort_key)
-
-        image_offset_func = lambda item: [(0.5 - float(num) / float(item.PixelSpacing[0])) for num in item.ImagePositionPatient[:2]]
-
-        SliceViewerData = namedtuple("SliceViewerData", ["PixelData", "ContourCoords", "ContourOffset"])
-
-        plotting_data = dcm_arr.MapDicoms(lambda dcm: SliceViewerData(dcm.pixel_array, [np.array([]),np.array([])], image_offset_func(dcm)))
-            
-
-        if with_contours:
-            
-            roi_dict = self._rt.ContourDataDict
-
-            contour_data = [] 
-            
-            for roi in roi_dict.values():
-                
-                contour_data.extend(roi)
-
-            contour_coords_dict = {}
-
-            for X, Y, Z, _ in contour_data:
-
-                if Z[0] in contour_coords_dict:
-
-                    coords = contour_coords_dict[Z[0]]
-
-                    coords[0] = np.concatenate((coords[0], X))
-
-                    coords[1] = np.concatenate((coords[1], Y))
-
-                else:
-
-                    contour_coords_dict[Z[0]] = [np.array(X), np.array(Y)]
-                       
-            for ind in range(len(plotting_data)):
-
-                z_value = dcm_arr[ind].SliceLocation
-
-                if z_value in contour_coords_dict:
-                    
-                    x_scale = float(dcm_arr[ind].PixelSpacing[0])
-
-                    y_scale = float(dcm_arr[ind].PixelSpacing[1])
-
-                    x_data = contour_coords_dict[z_value][0]
-
-                    y_data = contour_coords_dict[z_value][1]
-
-                    coords = plotting_data[ind].ContourCoords
-
-                    # Add the x and y data
-                    coords[0] = np.concatenate((coords[0], x_data / x_scale))
-
-                    coords[1] = np.concatenate((coords[1], y_data / y_scale))
-
-            interactive = SliceView(plotting_data, cm)
-            interactive.mainloop()
-        
-        else:
-
-            self._images.ViewSlices(sort_key=sort_key, cm = cm, **dicom_filters)
-
-
-    def GetRtMaskDict(self, background_value = 0, mask_value = 255):
-        ''''
-        Return a dicitonary where each
-        key value pair consists of a sITK
-        image representing a mask of an ROI.
-        Dictionary keys are the "Referenced ROI 
-        Numbers" from the RTSTRUCT file.
-        '''
-
-        mask_dict = {}
-
-        dicom_img = self._images.sITKImage
-
-        contour_dict = self._rt.ContourDataDict
-
-        for roi_key in contour_dict:
-
-            mask_dict[roi_key] = self._mask_for_roi(contour_dict[roi_key], dicom_img, background_value, mask_value)
-        
-        return mask_dict
-    
-
-    def SaveAsNii(self, saveDir : str):
-        '''
-        Saves the contour data and the associated
-        images within the object as .nii.gz files
-        to the folder saveDir
-
-        Note: Ensure before saving that the dicoms
-        stored within the object are properly filtered!
-
-        saveDir: str representing the directory where
-                    the resulting files are to be 
-                    stored.
-        
-        '''
-
-        if not os.path.isdir(saveDir):
-            os.makedirs(saveDir)
-        
-        
-        images2save = self.Images
-
-        images2save.SaveImagesAsNii(saveDir + os.sep + 'images')
-
-        masks = self.GetRtMaskDict()
-
-        for key in masks.keys():
-
-            sITK.WriteImage(masks[key], saveDir + os.sep + str(key) + '.nii.gz')
-
-
-    @staticmethod
-    def SelectDir():
-        '''
-        Returns a tuple of RtAndImage objects. Each item
-        in the tuple is an RtAndImage object corresponding
-        to a set of images and an RTSTRUCT
-        '''
-
-        dcm_array = DicomArray.SelectDir()
-
-        return RtAndImage.GroupArray(dcm_array)
-        
-
-    @staticmethod
-    def ProvideDir(filepath):
-        '''
-        Returns a tuple of RtAndImage objects. Each item
-        in the tuple is an RtAndImage object corresponding
-        to a set of images and an RTSTRUCT
-
-        filepath -> A valid file path that points
-                        to a directory with Dicom
-                        files.
-        '''
-        
-        all_dcms = DicomArray.ProvideDir(filepath)
-
-        return RtAndImage.GroupArray(all_dcms)
-    
-
-    @staticmethod
-    def GroupArray(dcm_array):
-
-        '''
-        Returns a tuple of RtAndImage objects after seaching
-        through the DicomArray for RTSTRUCTS and their
-        associated images.
-        '''
-        
-        rtStructs = dcm_array.FilterDicoms(lambda dcm: dcm.Modality == 'RTSTRUCT')
-
-        objs = []
-
-        for struct in rtStructs:
-            
-            filterFunction = lambda dcm: (dcm.PatientID == struct.PatientID) \
-                                    and (dcm.SOPClassUID in struct.SOPClassUID) \
-                                    and (dcm.Modality != "RTSTRUCT")
-
-            related_dcms = dcm_array.FilterDicoms(filterFunction)
-
-            DicomImage_iterable = []
-
-            for dcm in related_dcms:
-
-                try:
-                    DicomImage_iterable.append(DicomImage(dcm.filename))
-                
-                except:
-                    continue
-                    
-
-            image_data = DicomImageArray(DicomImage_iterable)
-
-            rt_data = RtStruct(struct.filename)
-
-            objs.append(RtAndImage(image_data, rt_data))
-        
-        return tuple(objs)
-    
-    
-    def _mask_for_roi(self, ROI : list, dicom_img, background_fill, mask_fill):
-
-        img_shape = dicom_img.GetSize()
-
-        mask = sITK.Image(img_shape, sITK.sitkUInt8)
-
-        mask.CopyInformation(dicom_img)
-
-        mask_array = sITK.GetArrayFromImage(mask)
-
-        mask_array.fill(background_fill)
-
-        for contour_coord in ROI:
-
-            X, Y, Z = contour_coord.x_values, contour_coord.y_values, contour_coord.z_values
-            
-            points = np.zeros([len(contour_coord.x_values), 3])
-
-            for ind in range(len(contour_coord.x_values)):
-                
-                world_coords = dicom_img.TransformPhysicalPointToContinuousIndex((X[ind], Y[ind], Z[ind]))
-                
-                points[ind, 0], points[ind, 1], points[ind, 2] = world_coords[0], world_coords[1], world_coords[2]
-            
-            z_coord = int(round(points[0,2]))
-
-            shape_input = (img_shape[1], img_shape[0]) ## Not sure
-
-            coord_input = np.column_stack((points[:, 1], points[:, 0]))
-
-            polygon = draw.polygon2mask(shape_input, coord_input)
-
-            new_mask = np.logical_xor(mask_array[z_coord, :, :], polygon)
-            
-            mask_array[z_coord, :, :] = np.where(new_mask, mask_fill, background_fill)
-
-        resulting_mask = sITK.GetImageFromArray(mask_array)
-
-        resulting_mask.CopyInformation(dicom_img)
-
-        return resulting_mask
-
+# Downloaded python packages
+import numpy as np
+import os
+
+# From the Modules folder
+from DicomModules.DICOM_Arrays.dicom_image_array import DicomImageArray
+from DicomModules.DICOM_Objects.rtstruct import RtStruct
+from DicomModules.DICOM_Arrays.dicom_array import DicomArray
+from DicomModules.DICOM_Objects.dicom_image import DicomImage
+from DicomModules.Export_Modules.nifti_writer import NiftiWriter
+from DicomModules.Processing_Modules.instrumentation import Instrumented, Stage, Count
+
+class RtAndImage:
+    
+    '''
+    Fields:
+        _images: DicomArray
+        _rt: DicomProcessing
+        _roi_dict: Dictionary [str : list]
+        _cache: VolumeCache used by the object, or None
+
+    Properties:
+        Images -> DicomArray
+        RtStruct -> DicomProcessing
+    '''
+
+    def __init__(self, images, rts, cache = None):
+        '''
+        Returns an RtAndImage object after initalizing
+        its fields
+
+        images -> DicomArray
+        rts -> DicomProcessing
+
+        Optional Parameters:
+            cache: VolumeCache or str path of a cache directory
+                    consulted for the image volume and masks of
+                    this object, see UseCache
+        '''
+        
+        self.Images = images
+
+        self.RtStruct = rts
+
+        self._roi_dict = {}
+
+        self.UseCache(cache)
+
+    @property
+    def Images(self):
+        '''
+        Returns the dicom images that are stored
+        within the object
+        '''
+        return self._images
+
+    @Images.setter
+    def Images(self, value):
+        
+        if type(value) == DicomImageArray:
+            self._images = value
+        
+        else:
+            raise ValueError(f"The value set for images must be a DicomImageArray")
+        
+    @property
+    def RtStruct(self):
+        '''
+        Returns the RtStruct stored within the
+        object.
+        '''
+        return self._rt
+
+    @RtStruct.setter
+    def RtStruct(self, value):
+
+        if type(value) != RtStruct:
+            
+            raise ValueError(f"The value being set must a RtStruct object instance")
+        
+        else:
+            self._rt = value
+
+
+    def ViewSlices(self, with_contours = True, sort_key = None, cm = 'gray', **dicom_filters):
+        
+        '''
+        Shows the slices stored in the image field
+        of the object, in an interactive UI.
+
+        Optional Arguments:
+            
+            with_contours: Boolean indicating whether or 
+                            not to plot the contours ontop 
+                            of the image. The default is True
+            cm: Colour map for use by the plotting function
+                    see matplotlib's color maps for more details.
+                    The default is "gray"
+            sort_key: The function describing how to sort the
+                        images for viewing, by default they are
+                        sorted along the slice normal
+            
+            
+            **dicom_filters (filter parameters):
+                Only the dicoms that have the key as an attribute and
+                a matching value to dicom_filters[key] will have their
+                images displayed
+
+                Examples of possible dicom_filters:
+                    Modality = "MR"
+                    DiffusionBValue = 0.0
+                    SliceLocation = 10
+
+        '''
+
+        from DicomModules.Display_Modules.slice_viewer import SliceView, SliceViewerData
+
+        dcm_arr = self._images
+
+        filters = list(filter(lambda s: not s.startswith('_'), dicom_filters.keys()))
+
+        if not filters == []:
+
+            for fKey in filters:
+
+                dcm_arr = dcm_arr.FilterDicoms(lambda dcm: dcm[fKey].value == dicom_filters[fKey] if hasattr(dcm, fKey) else False)
+
+        if dcm_arr._dicoms == []:
+
+            msg = f"Empty DicomArray returned after applying the specified filters{': ' + ', '.join(filters)}"
+
+            raise Exception(msg)
+
+        dcm_arr.SortDicoms(sort_key)
+
+        image_offset_func = lambda item: [(0.5 - float(num) / float(item.PixelSpacing[0])) for num in item.ImagePositionPatient[:2]]
+
+        plotting_data = dcm_arr.MapDicoms(lambda dcm: SliceViewerData(dcm.pixel_array, [np.array([]),np.array([])], image_offset_func(dcm)))
+            
+
+        if with_contours:
+            
+            roi_dict = self._rt.ContourDataDict
+
+            contour_coords_dict = {}
+
+            for roi in roi_dict.values():
+
+                # Group the points of the ROI by the z of the first point of their contour
+                for start, end in zip(roi.offsets[:-1], roi.offsets[1:]):
+
+                    if start == end:
+                        continue
+
+                    coords = contour_coords_dict.setdefault(float(roi.points['z'][start]), [[], []])
+
+                    coords[0].append(roi.points['x'][start:end])
+
+                    coords[1].append(roi.points['y'][start:end])
+
+            contour_coords_dict = {z_value: [np.concatenate(coords[0]), np.concatenate(coords[1])]
+                                   for z_value, coords in contour_coords_dict.items()}
+                       
+            for ind in range(len(plotting_data)):
+
+                z_value = dcm_arr[ind].SliceLocation
+
+                if z_value in contour_coords_dict:
+                    
+                    x_scale = float(dcm_arr[ind].PixelSpacing[0])
+
+                    y_scale = float(dcm_arr[ind].PixelSpacing[1])
+
+                    x_data = contour_coords_dict[z_value][0]
+
+                    y_data = contour_coords_dict[z_value][1]
+
+                    coords = plotting_data[ind].ContourCoords
+
+                    # Add the x and y data
+                    coords[0] = np.concatenate((coords[0], x_data / x_scale))
+
+                    coords[1] = np.concatenate((coords[1], y_data / y_scale))
+
+            interactive = SliceView(plotting_data, cm)
+            interactive.mainloop()
+        
+        else:
+
+            self._images.ViewSlices(sort_key=sort_key, cm = cm, **dicom_filters)
+
+
+    @Instrumented('RtAndImage.GetRtMaskDict')
+    def GetRtMaskDict(self, background_value = 0, mask_value = 255, roi_keys = None):
+        ''''
+        Return a dicitonary where each
+        key value pair consists of a sITK
+        image representing a mask of an ROI.
+        Dictionary keys are the "Referenced ROI 
+        Numbers" from the RTSTRUCT file.
+
+        Optional Parameters:
+            roi_keys: The ROI numbers to make masks
+                        for, by default all. ROI numbers not
+                        in the RTSTRUCT raise a KeyError
+        '''
+
+        if roi_keys is not None:
+            return self._selected_masks(roi_keys, background_value, mask_value)
+
+        return dict(self.IterRtMasks(background_value, mask_value))
+
+
+    def IterRtMasks(self, background_value = 0, mask_value = 255):
+        '''
+        Returns a generator that yields tuples of
+        (Referenced ROI Number, sITK mask image), one
+        ROI at a time. Unlike GetRtMaskDict only the
+        mask currently being used is held in memory.
+        '''
+
+        return self._iter_masks(self._image(), background_value, mask_value)
+
+
+    @Instrumented('RtAndImage.GetRtOccupancyDict')
+    def GetRtOccupancyDict(self, supersample = 4, dtype = np.float32):
+        '''
+        Returns a dictionary like GetRtMaskDict where each
+        mask holds the fraction of every voxel inside the
+        ROI instead of a binary value, so small structures
+        keep their volume.
+
+        Optional Parameters:
+            supersample: Number of samples along each in plane
+                            axis of a voxel, supersample ** 2
+                            samples per voxel
+            dtype: float32 or float64 for fractions between 0
+                    and 1, or an unsigned integer type for
+                    fractions scaled to its largest value
+                    (255 for uint8)
+        '''
+
+        return dict(self.IterRtOccupancy(supersample, dtype))
+
+
+    def IterRtOccupancy(self, supersample = 4, dtype = np.float32):
+        '''
+        Returns a generator that yields tuples of
+        (Referenced ROI Number, sITK occupancy image),
+        one ROI at a time, see GetRtOccupancyDict
+        '''
+
+        dtype = np.dtype(dtype)
+
+        full_value = 1.0 if dtype.kind == 'f' else np.iinfo(dtype).max
+
+        return self._iter_masks(self._image(), 0, full_value, supersample=supersample, dtype=dtype.name)
+
+
+    async def AsyncGetRtMaskDict(self, background_value = 0, mask_value = 255, max_concurrency = 4, executor = None,
+                                 progress = None):
+        '''
+        Asynchronous version of GetRtMaskDict, use as
+        "await rt.AsyncGetRtMaskDict()". See AsyncIterRtMasks
+        for the optional parameters.
+        '''
+
+        masks = {}
+
+        async for roi_key, mask in self.AsyncIterRtMasks(background_value, mask_value, max_concurrency, executor, progress):
+            masks[roi_key] = mask
+
+        # Same key order as GetRtMaskDict
+        order = {roi_key: ind for ind, roi_key in enumerate(self._rt.ContourDataDict)}
+
+        return dict(sorted(masks.items(), key=lambda item: order.get(item[0], len(order))))
+
+
+    async def AsyncIterRtMasks(self, background_value = 0, mask_value = 255, max_concurrency = 4, executor = None,
+                               progress = None):
+        '''
+        Asynchronous generator yielding tuples of
+        (Referenced ROI Number, sITK mask image) as the
+        masks are made, use as
+        "async for roi_key, mask in rt.AsyncIterRtMasks()".
+        The masks are rasterized in executor, several ROIs
+        at a time unless a VolumeCache is in use.
+
+        Optional Parameters:
+            max_concurrency: The most ROIs rasterized at once
+            executor: concurrent.futures executor used for
+                        the rasterization, by default the event
+                        loop's default thread pool. With a
+                        ProcessPoolExecutor the images and the
+                        contours are still read in threads
+            progress: Function called as progress(done, total)
+                        after each mask is made
+        '''
+
+        from DicomModules.Processing_Modules.async_tasks import RunInExecutor, BoundedAsCompleted, IsProcessPool
+        from DicomModules.Processing_Modules.resampling import GridOf
+
+        # Work on the objects themselves stays in threads, only the rasterization goes to a process pool
+        local = None if IsProcessPool(executor) else executor
+
+        dicom_img = await RunInExecutor(self._image, executor=local)
+
+        contour_dict = await RunInExecutor(lambda: self._rt.ContourDataDict, executor=local)
+
+        if self._cache is not None:
+
+            # Cache entries are read and written in ROI order by one generator
+            masks = self._iter_masks(dicom_img, background_value, mask_value)
+
+            done = 0
+
+            while True:
+
+                item = await RunInExecutor(next, masks, None, executor=local)
+
+                if item is None:
+                    return
+
+                done += 1
+
+                if progress is not None:
+                    progress(done, len(contour_dict))
+
+                yield item
+
+        grid = GridOf(dicom_img)
+
+        # Only the contours and the grid are sent, which a process pool can pickle
+        items = [(roi_key, contour_dict[roi_key], grid, background_value, mask_value) for roi_key in contour_dict]
+
+        rois = BoundedAsCompleted(_rasterize_roi, items, max_concurrency, executor, progress)
+
+        try:
+            async for (roi_key, *_), mask in rois:
+                yield roi_key, mask
+
+        finally:
+            await rois.aclose()
+
+
+    def UseCache(self, cache):
+        '''
+        Sets the VolumeCache consulted by this object for its
+        image volume and masks. Pass None to stop using a
+        cache. Other objects are not affected, a VolumeCache
+        can be shared by several objects and threads.
+
+        cache: VolumeCache, str path of a cache directory
+                or None
+        '''
+
+        self._cache = _volume_cache(cache)
+
+
+    def _image(self):
+        '''
+        Returns the sITK image of the stored images,
+        from the cache when one is in use
+        '''
+
+        if self._cache is None:
+            return self._images.sITKImage
+
+        return self._cache.GetImage(self._images)
+
+
+    def _iter_masks(self, dicom_img, background_value, mask_value, **options):
+
+        cache = self._cache
+
+        if cache is None:
+
+            yield from self._rasterize_masks(dicom_img, background_value, mask_value, **options)
+
+            return
+
+        key = cache.MaskKey(self._images, self._rt, background_value, mask_value, **options)
+
+        cached = cache.IterMasks(key)
+
+        if cached is not None:
+
+            yield from cached
+
+            return
+
+        entry = cache.OpenEntry(key)
+
+        try:
+            for roi_key, mask in self._rasterize_masks(dicom_img, background_value, mask_value, **options):
+
+                entry.Add(roi_key, mask)
+
+                yield roi_key, mask
+
+        except BaseException:
+            entry.Discard()
+            raise
+
+        entry.Commit()
+
+
+    def _rasterize_masks(self, dicom_img, background_value, mask_value, supersample = None, dtype = None):
+
+        contour_dict = self._rt.ContourDataDict
+
+        for roi_key in contour_dict:
+
+            with Stage('RtAndImage.Rasterize', roi=roi_key):
+
+                Count('contours', len(contour_dict[roi_key]))
+
+                if supersample is None:
+                    mask = self._mask_for_roi(contour_dict[roi_key], dicom_img, background_value, mask_value)
+
+                else:
+                    mask = self._occupancy_for_roi(contour_dict[roi_key], dicom_img, supersample, dtype, mask_value)
+
+            yield roi_key, mask
+
+
+    @Instrumented('RtAndImage.GetRoiStatistics')
+    def GetRoiStatistics(self, roi_keys = None, bins = None, hist_range = None, crop = True):
+        '''
+        Returns a dictionary with the "Referenced ROI Numbers"
+        for keys and RoiStatistics (voxels, volume_cc, mean, std,
+        min, max, histogram, bin_edges) of the image values
+        inside each ROI for values. All ROIs are reduced
+        together in one pass over their voxels.
+
+        Optional Parameters:
+            roi_keys: The ROI numbers to include, by default
+                        all. ROI numbers not
+                        in the RTSTRUCT raise a KeyError
+            bins: Number of histogram bins, see
+                    Processing_Modules.roi_statistics
+            hist_range: (lower, upper) of the histograms
+            crop: If True only the bounding box of the contours
+                    of an ROI is searched for its voxels in a
+                    cached mask. Without a cache every ROI is
+                    only drawn inside that box
+        '''
+
+        import SimpleITK as sITK
+        from DicomModules.Processing_Modules.roi_statistics import RoiStatisticsFromIndices
+
+        dicom_img = self._image()
+
+        image_array = sITK.GetArrayViewFromImage(dicom_img)
+
+        contour_dict = self._rt.ContourDataDict
+
+        if roi_keys is None:
+            roi_keys = list(contour_dict)
+
+        _check_roi_keys(roi_keys, contour_dict)
+
+        selected = set(roi_keys)
+
+        to_index = _PhysicalToIndex(dicom_img)
+
+        roi_indices = {}
+
+        with Stage('RtAndImage.RoiIndices'):
+
+            if self._cache is not None:
+                # Share the cached set of masks
+                for roi_key, mask in self._iter_masks(dicom_img, 0, 1):
+
+                    if roi_key not in selected:
+                        continue
+
+                    mask_array = sITK.GetArrayViewFromImage(mask)
+
+                    region = (slice(None),) * 3
+
+                    if crop and len(contour_dict[roi_key]):
+                        region = _contour_box(contour_dict[roi_key], to_index, mask_array.shape)
+
+                    found = np.nonzero(mask_array[region])
+
+                    offsets = [found_axis + (axis.start or 0) for found_axis, axis in zip(found, region)]
+
+                    roi_indices[roi_key] = np.ravel_multi_index(offsets, mask_array.shape)
+
+            else:
+                # Each ROI is only drawn inside the bounding box of its contours
+                for roi_key in contour_dict:
+
+                    if roi_key in selected:
+                        roi_indices[roi_key] = _roi_indices(contour_dict[roi_key], to_index, image_array.shape)
+
+            Count('voxels', sum(len(indices) for indices in roi_indices.values()))
+
+        with Stage('RtAndImage.RoiReduce'):
+            return RoiStatisticsFromIndices(image_array.ravel(), roi_indices, float(np.prod(dicom_img.GetSpacing())),
+                                            bins, hist_range)
+
+
+    @Instrumented('RtAndImage.GetMarginMaskDict')
+    def GetMarginMaskDict(self, margin, roi_keys = None, background_value = 0, mask_value = 255, max_workers = None):
+        '''
+        Returns a dictionary like GetRtMaskDict with the mask
+        of every ROI grown by margin mm, or shrunk when the
+        margin is negative, e.g. GetMarginMaskDict(5, [ctv])
+        for a PTV. The ROIs are processed in parallel and only
+        the padded bounding box of each ROI is used.
+
+        margin: mm, (x, y, z) mm for a different margin along
+                each image axis, or a dictionary from ROI numbers
+                to either
+
+        Optional Parameters:
+            roi_keys: The ROI numbers to expand, by default
+                        all. ROI numbers not
+                        in the RTSTRUCT raise a KeyError
+        '''
+
+        from DicomModules.Analysis_Modules.margins import ExpandMask, ParallelMap
+
+        masks = self._selected_masks(roi_keys, background_value, mask_value)
+
+        margins = {key: margin[key] if isinstance(margin, dict) else margin for key in masks}
+
+        items = [(mask, margins[key], background_value, mask_value) for key, mask in masks.items()]
+
+        return dict(zip(masks, ParallelMap(ExpandMask, items, max_workers)))
+
+
+    @Instrumented('RtAndImage.GetSurfaceDistances')
+    def GetSurfaceDistances(self, roi_pairs, max_workers = None):
+        '''
+        Returns a dictionary with the (ROI number, ROI number)
+        pairs of roi_pairs for keys and SurfaceDistanceSummary
+        (mean, hd95, max, mean_a_to_b, mean_b_to_a) in mm for
+        values, measured between the surfaces of the masks with
+        spacing aware distance transforms. Pairs are processed
+        in parallel.
+
+        roi_pairs: List of (ROI number, ROI number) tuples,
+                    ROI numbers not in the RTSTRUCT raise a
+                    KeyError
+        '''
+
+        from DicomModules.Analysis_Modules.margins import SurfaceDistances, SummarizeSurfaceDistances, ParallelMap
+
+        roi_pairs = [tuple(pair) for pair in roi_pairs]
+
+        masks = self._selected_masks({key for pair in roi_pairs for key in pair}, 0, 1)
+
+        summarize = lambda key_a, key_b: SummarizeSurfaceDistances(*SurfaceDistances(masks[key_a], masks[key_b]))
+
+        return dict(zip(roi_pairs, ParallelMap(summarize, roi_pairs, max_workers)))
+
+
+    def _selected_masks(self, roi_keys, background_value, mask_value):
+        '''
+        Returns a dictionary of the masks of the ROIs in
+        roi_keys, or of all ROIs when roi_keys is None.
+        Raises a KeyError for ROI numbers not in the RTSTRUCT
+        '''
+
+        dicom_img = self._image()
+
+        contour_dict = self._rt.ContourDataDict
+
+        if roi_keys is None:
+            return dict(self._iter_masks(dicom_img, background_value, mask_value))
+
+        _check_roi_keys(roi_keys, contour_dict)
+
+        if self._cache is not None:
+            # Share the cached set of masks
+            return {key: mask for key, mask in self._iter_masks(dicom_img, background_value, mask_value) if key in roi_keys}
+
+        return {key: self._mask_for_roi(contour_dict[key], dicom_img, background_value, mask_value)
+                for key in contour_dict if key in roi_keys}
+
+
+    def PublishShared(self, shared_volumes, roi_keys = None, background_value = 0, mask_value = 255):
+        '''
+        Copies the image volume and the ROI masks into shared
+        memory owned by shared_volumes and returns a tuple
+        (image descriptor, dictionary of mask descriptors) with
+        the "Referenced ROI Numbers" for keys. Each mask is
+        published as soon as it is rasterized. The descriptors
+        are small and can be sent to worker processes instead
+        of the volumes, see Processing_Modules.shared_volumes.
+
+        shared_volumes: SharedVolumes, the volumes stay available
+                            until it is closed
+
+        Optional Parameters:
+            roi_keys: The ROI numbers to publish, by default
+                        all. ROI numbers not
+                        in the RTSTRUCT raise a KeyError
+        '''
+
+        dicom_img = self._image()
+
+        image = shared_volumes.Publish(dicom_img)
+
+        if roi_keys is None:
+            masks = self._iter_masks(dicom_img, background_value, mask_value)
+
+        else:
+            masks = self._selected_masks(roi_keys, background_value, mask_value).items()
+
+        return image, {roi_key: shared_volumes.Publish(mask) for roi_key, mask in masks}
+
+
+    @Instrumented('RtAndImage.Resample')
+    def Resample(self, spacing = None, reference = None, image_interpolation = 'linear', mask_interpolation = 'nearest',
+                 direct = True, background_value = 0, mask_value = 255, max_workers = None):
+        '''
+        Returns a tuple (sITK image, dictionary of sITK masks)
+        with the images and every ROI mask resampled onto the
+        same grid in one pass. The dictionary keys are the
+        "Referenced ROI Numbers" as in GetRtMaskDict.
+
+        One of spacing or reference gives the new grid.
+
+        Optional Parameters:
+            spacing: A number for isotropic spacing, or (x, y, z)
+                        spacing in mm, covering the same extent
+                        as the images
+            reference: sITK image whose grid is used
+            image_interpolation: 'nearest', 'linear', 'bspline'
+            mask_interpolation: 'nearest' or 'label'
+            direct: If True the contours are drawn straight onto
+                        the in plane voxels of the new grid so
+                        only the slice axis is interpolated. Used
+                        when the new grid is parallel to the images
+            max_workers: Number of threads resampling ROIs, by
+                            default the number of cpus
+        '''
+
+        from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+        import contextvars
+        from DicomModules.Processing_Modules.resampling import GridOf, SpacingGrid, SliceGrid, EmptyImage, ResampleImage
+
+        if (spacing is None) == (reference is None):
+            raise ValueError("Give exactly one of spacing or reference")
+
+        dicom_img = self._image()
+
+        target = GridOf(reference) if reference is not None else SpacingGrid(dicom_img, spacing)
+
+        with Stage('RtAndImage.ResampleImage'):
+            image = ResampleImage(dicom_img, target, image_interpolation)
+
+        slice_grid = SliceGrid(GridOf(dicom_img), target) if direct else None
+
+        if slice_grid is None:
+            # Resample the masks made on the grid of the images one at a time
+            roi_masks = self._iter_masks(dicom_img, background_value, mask_value)
+
+            resample = lambda roi_key, mask: ResampleImage(mask, target, mask_interpolation, background_value)
+
+        else:
+            contour_dict = self._rt.ContourDataDict
+
+            roi_masks = ((roi_key, contour_dict[roi_key]) for roi_key in contour_dict)
+
+            slice_img = EmptyImage(slice_grid)
+
+            def resample(roi_key, roi):
+
+                mask = self._mask_for_roi(roi, slice_img, background_value, mask_value)
+
+                return ResampleImage(mask, target, mask_interpolation, background_value)
+
+        def run(roi_key, value):
+
+            with Stage('RtAndImage.ResampleMask', roi=roi_key):
+                return roi_key, resample(roi_key, value)
+
+        max_workers = max_workers or os.cpu_count() or 1
+
+        order = []
+
+        masks = {}
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+            pending = set()
+
+            # roi_masks is only drawn from while few ROIs are waiting, so native masks are
+            # rasterized as workers become free instead of all at once up front
+            for roi_key, value in roi_masks:
+
+                if len(pending) >= 2 * max_workers:
+
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+
+                    masks.update(future.result() for future in done)
+
+                order.append(roi_key)
+
+                # Run in a copy of the callers context so stage records keep their parent
+                pending.add(executor.submit(contextvars.copy_context().run, run, roi_key, value))
+
+            masks.update(future.result() for future in wait(pending)[0])
+
+        return image, {roi_key: masks[roi_key] for roi_key in order}
+
+
+    @Instrumented('RtAndImage.SaveAsNii')
+    def SaveAsNii(self, saveDir : str, include_gz = True, compression_level = None, max_workers = None):
+        '''
+        Saves the contour data and the associated
+        images within the object as .nii.gz files
+        to the folder saveDir
+
+        Each mask is handed to a pool of writers as
+        soon as it is rasterized, so compression of
+        the files happens concurrently with creating
+        the remaining masks.
+
+        Note: Ensure before saving that the dicoms
+        stored within the object are properly filtered!
+
+        saveDir: str representing the directory where
+                    the resulting files are to be 
+                    stored.
+
+        Optional Parameters:
+            include_gz: If False the files are written
+                            uncompressed as .nii files.
+                            The default is True
+            compression_level: int between 0 and 9 giving the
+                                gzip level, None uses the
+                                SimpleITK default
+            max_workers: Number of files written concurrently,
+                            by default the number of cpus
+        '''
+
+        if not os.path.isdir(saveDir):
+            os.makedirs(saveDir)
+        
+        dicom_img = self._image()
+
+        with NiftiWriter(include_gz, compression_level, max_workers) as writer:
+
+            writer.Submit(dicom_img, saveDir + os.sep + 'images')
+
+            for key, mask in self._iter_masks(dicom_img, 0, 255):
+
+                writer.Submit(mask, saveDir + os.sep + str(key))
+
+
+    def SaveAsChunked(self, store_path : str, case_id = None, metadata = None, **store_kwargs):
+        '''
+        Writes the images, the ROI masks and the geometry as
+        one case of the chunked store on store_path. Each
+        mask is written as soon as it is rasterized. Many
+        cases can be written to the same store, see
+        Export_Modules.chunked_store.ChunkedStore for reading
+        slices or patches back.
+
+        Optional Parameters:
+            case_id: Name of the case in the store, by default
+                        the SOPInstanceUID of the RTSTRUCT
+            metadata: Dictionary of json serializable values
+                        stored with the case
+            **store_kwargs: Passed on to ChunkedStore.WriteCase,
+                                e.g. chunks or compression_level
+        '''
+
+        from DicomModules.Export_Modules.chunked_store import ChunkedStore
+
+        if case_id is None:
+            case_id = str(self._rt.SOPInstanceUID)
+
+        roi_names = {roi.ROINumber: str(roi.get('ROIName', '')) for roi in self._rt.get('StructureSetROISequence', [])}
+
+        case_metadata = {'PatientID': str(self._rt.get('PatientID', ''))}
+
+        case_metadata.update(metadata or {})
+
+        dicom_img = self._image()
+
+        ChunkedStore(store_path).WriteCase(case_id, dicom_img, self._iter_masks(dicom_img, 0, 255), roi_names,
+                                           case_metadata, **store_kwargs)
+
+
+    @staticmethod
+    def SelectDir():
+        '''
+        Returns a tuple of RtAndImage objects. Each item
+        in the tuple is an RtAndImage object corresponding
+        to a set of images and an RTSTRUCT
+        '''
+
+        dcm_array = DicomArray.SelectDir()
+
+        return RtAndImage.GroupArray(dcm_array)
+        
+
+    @staticmethod
+    def ProvideDir(filepath, cache = None):
+        '''
+        Returns a tuple of RtAndImage objects. Each item
+        in the tuple is an RtAndImage object corresponding
+        to a set of images and an RTSTRUCT
+
+        filepath -> A valid file path that points
+                        to a directory with Dicom
+                        files.
+
+        Optional Parameters:
+            cache: VolumeCache or str path of a cache directory
+                    used by the objects, see UseCache
+        '''
+        
+        all_dcms = DicomArray.ProvideDir(filepath)
+
+        return RtAndImage.GroupArray(all_dcms, cache)
+    
+
+    @staticmethod
+    @Instrumented('RtAndImage.GroupArray')
+    def GroupArray(dcm_array, cache = None):
+
+        '''
+        Returns a tuple of RtAndImage objects after seaching
+        through the DicomArray for RTSTRUCTS and their
+        associated images.
+
+        Optional Parameters:
+            cache: VolumeCache or str path of a cache directory
+                    used by the objects, see UseCache
+        '''
+
+        cache = _volume_cache(cache)
+        
+        return tuple(RtAndImage.FromFiles(struct.filename, image_paths, cache)
+                     for struct, image_paths in RtAndImage._group_paths(dcm_array))
+
+
+    @staticmethod
+    def FromFiles(rt_file, image_files, cache = None):
+        '''
+        Returns an RtAndImage object of the RTSTRUCT file
+        and the files of its images, reading each file
+        once. Files that can not be read as images are
+        skipped.
+
+        rt_file -> File path of the RTSTRUCT
+        image_files -> Iterable of the file paths of the
+                        images the RTSTRUCT was contoured on
+
+        Optional Parameters:
+            cache: VolumeCache or str path of a cache directory
+                    used by the object, see UseCache
+        '''
+
+        DicomImage_iterable = []
+
+        for path in image_files:
+
+            dcm = _read_image(path)
+
+            if dcm is not None:
+                DicomImage_iterable.append(dcm)
+
+        return RtAndImage(DicomImageArray(DicomImage_iterable), RtStruct(rt_file), cache)
+
+
+    @staticmethod
+    async def AsyncProvideDir(filepath, max_concurrency = 8, executor = None, progress = None, cache = None):
+        '''
+        Asynchronous version of ProvideDir, use as
+        "await RtAndImage.AsyncProvideDir(path)". Files are
+        read in executor so the event loop is not blocked.
+
+        Optional Parameters:
+            max_concurrency: The most files read at once
+            executor: concurrent.futures executor used for the
+                        reads, by default the event loop's
+                        default thread pool. With a
+                        ProcessPoolExecutor the datasets are
+                        pickled back from the workers
+            progress: Function called as progress(done, total)
+                        after each file is read, first for the
+                        directory and then for the images of
+                        each RTSTRUCT
+            cache: VolumeCache or str path of a cache directory
+                    used by the objects, see UseCache
+        '''
+
+        all_dcms = await DicomArray.AsyncProvideDir(filepath, max_concurrency, executor, progress)
+
+        return await RtAndImage.AsyncGroupArray(all_dcms, max_concurrency, executor, progress, cache)
+
+
+    @staticmethod
+    async def AsyncGroupArray(dcm_array, max_concurrency = 8, executor = None, progress = None, cache = None):
+        '''
+        Asynchronous version of GroupArray, see
+        AsyncProvideDir for the optional parameters
+        '''
+
+        from DicomModules.Processing_Modules.async_tasks import RunInExecutor, BoundedMap
+
+        cache = _volume_cache(cache)
+
+        objs = []
+
+        for struct, image_paths in RtAndImage._group_paths(dcm_array):
+
+            images = await BoundedMap(_read_image, image_paths, max_concurrency, executor, progress)
+
+            image_data = DicomImageArray([dcm for dcm in images if dcm is not None])
+
+            rt_data = await RunInExecutor(RtStruct, struct.filename, executor=executor)
+
+            objs.append(RtAndImage(image_data, rt_data, cache))
+
+        return tuple(objs)
+
+
+    @staticmethod
+    def _group_paths(dcm_array):
+        '''
+        Returns a list of tuples (RTSTRUCT, list of the
+        file paths of its related images) for every
+        RTSTRUCT in the DicomArray
+        '''
+
+        rtStructs = dcm_array.FilterDicoms(lambda dcm: dcm.Modality == 'RTSTRUCT')
+
+        groups = []
+
+        for struct in rtStructs:
+            
+            filterFunction = RtAndImage._related_image_filter(struct)
+
+            related_dcms = dcm_array.FilterDicoms(filterFunction)
+
+            groups.append((struct, related_dcms.MapDicoms(lambda dcm: dcm.filename)))
+
+        return groups
+    
+    
+    @staticmethod
+    def _related_image_filter(struct):
+        '''
+        Returns a function that evaluates to True for
+        the dicoms that hold the images the RTSTRUCT
+        "struct" was contoured on. Images are matched
+        on the frames of reference referenced by the
+        RTSTRUCT, when it does not reference any the
+        SOPClassUID is used instead.
+        '''
+
+        frame_uids = [ref.FrameOfReferenceUID for ref in struct.get('ReferencedFrameOfReferenceSequence', [])
+                        if 'FrameOfReferenceUID' in ref]
+
+        def filterFunction(dcm):
+
+            if dcm.get('PatientID') != struct.PatientID or dcm.get('Modality') == "RTSTRUCT":
+                return False
+
+            if frame_uids:
+                return dcm.get('FrameOfReferenceUID') in frame_uids
+
+            return dcm.SOPClassUID in struct.SOPClassUID
+
+        return filterFunction
+
+
+    @staticmethod
+    def _mask_for_roi(ROI : list, dicom_img, background_fill, mask_fill):
+
+        import SimpleITK as sITK
+        from skimage import draw
+
+        img_shape = dicom_img.GetSize()
+
+        mask = sITK.Image(img_shape, sITK.sitkUInt8)
+
+        mask.CopyInformation(dicom_img)
+
+        mask_array = sITK.GetArrayFromImage(mask)
+
+        mask_array.fill(background_fill)
+
+        to_index = _PhysicalToIndex(dicom_img)
+
+        for contour_coord in ROI:
+
+            points = to_index(contour_coord)
+            
+            z_coord = int(round(points[0,2]))
+
+            shape_input = (img_shape[1], img_shape[0]) ## Not sure
+
+            coord_input = np.column_stack((points[:, 1], points[:, 0]))
+
+            polygon = draw.polygon2mask(shape_input, coord_input)
+
+            new_mask = np.logical_xor(mask_array[z_coord, :, :], polygon)
+            
+            mask_array[z_coord, :, :] = np.where(new_mask, mask_fill, background_fill)
+
+        resulting_mask = sITK.GetImageFromArray(mask_array)
+
+        resulting_mask.CopyInformation(dicom_img)
+
+        return resulting_mask
+
+
+    def _occupancy_for_roi(self, ROI : list, dicom_img, supersample, dtype, full_value):
+        '''
+        Returns a sITK image of the fraction of each voxel
+        of dicom_img inside the contours of ROI, scaled to
+        full_value. Contours between two slices are shared
+        between them by distance.
+        '''
+
+        import SimpleITK as sITK
+        from DicomModules.Processing_Modules.contours import PolygonOccupancy
+
+        img_shape = dicom_img.GetSize()
+
+        fractions = np.zeros(img_shape[::-1], dtype=np.float32)
+
+        to_index = _PhysicalToIndex(dicom_img)
+
+        # Contours on the same plane are combined before the plane is split between slices
+        planes = {}
+
+        for contour_coord in ROI:
+
+            points = to_index(contour_coord)
+
+            planes.setdefault(round(float(points[:, 2].mean()), 3), []).append(points[:, [1, 0]])
+
+        for z_coord, polygons in planes.items():
+
+            row, col, plane = PolygonOccupancy(polygons, (img_shape[1], img_shape[0]), supersample)
+
+            lower = int(np.floor(z_coord))
+
+            weight = z_coord - lower
+
+            for z_ind, part in ((lower, 1.0 - weight), (lower + 1, weight)):
+
+                if part > 0 and 0 <= z_ind < img_shape[2]:
+
+                    fractions[z_ind, row:row + plane.shape[0], col:col + plane.shape[1]] += part * plane
+
+        np.clip(fractions, 0.0, 1.0, out=fractions)
+
+        dtype = np.dtype(dtype)
+
+        if dtype.kind == 'f':
+            array = (fractions * full_value).astype(dtype)
+
+        else:
+            array = np.rint(fractions * full_value).astype(dtype)
+
+        resulting_mask = sITK.GetImageFromArray(array)
+
+        resulting_mask.CopyInformation(dicom_img)
+
+        return resulting_mask
+
+
+class _PhysicalToIndex:
+    '''
+    Maps the physical points of a contour to
+    (N, 3) continuous (x, y, z) indices of an image
+    '''
+
+    def __init__(self, dicom_img):
+
+        from DicomModules.Processing_Modules.contours import IndexToPhysicalMatrix
+
+        matrix, self._origin = IndexToPhysicalMatrix(dicom_img)
+
+        self._inverse = np.linalg.inv(matrix)
+
+    def __call__(self, contour_coord):
+
+        return (contour_coord.Points() - self._origin) @ self._inverse.T
+
+
+
+def _rasterize_roi(item):
+    '''
+    Returns the mask of one ROI for AsyncIterRtMasks
+
+    item: Tuple (roi_key, ROI, grid, background_value,
+            mask_value), grid is the resampling.Grid of the
+            images
+    '''
+
+    from DicomModules.Processing_Modules.resampling import EmptyImage
+
+    roi_key, ROI, grid, background_value, mask_value = item
+
+    with Stage('RtAndImage.Rasterize', roi=roi_key):
+
+        Count('contours', len(ROI))
+
+        return RtAndImage._mask_for_roi(ROI, EmptyImage(grid), background_value, mask_value)
+
+
+def _check_roi_keys(roi_keys, contour_dict):
+    '''
+    Raises a KeyError when any of roi_keys is not
+    a ROI number of contour_dict
+    '''
+
+    missing = [key for key in roi_keys if key not in contour_dict]
+
+    if missing:
+        raise KeyError(f"The ROI numbers {missing} are not in the RTSTRUCT")
+
+
+def _volume_cache(cache):
+    '''
+    Returns the VolumeCache of the cache directory when
+    cache is a str path, otherwise cache itself
+    '''
+
+    if isinstance(cache, str):
+
+        from DicomModules.Processing_Modules.volume_cache import VolumeCache
+
+        return VolumeCache(cache)
+
+    return cache
+
+
+def _read_image(path):
+    '''
+    Returns the DicomImage of the file path, or None
+    when the file can not be read as an image
+    '''
+
+    try:
+        return DicomImage(path)
+
+    except:
+        return None
+
+
+def _contour_box(ROI, to_index, shape):
+    '''
+    Returns a tuple of slices (z, y, x) covering the
+    voxels of the contours of ROI in an array of shape
+    '''
+
+    points = np.concatenate([to_index(contour_coord) for contour_coord in ROI])
+
+    low = np.floor(points.min(axis=0)).astype(int) - 1
+
+    high = np.ceil(points.max(axis=0)).astype(int) + 2
+
+    return tuple(slice(max(int(lo), 0), min(int(hi), length)) for lo, hi, length in zip(low[::-1], high[::-1], shape))
+
+
+def _roi_indices(ROI, to_index, shape):
+    '''
+    Returns the flat indices into an array of shape (z, y, x)
+    of the voxels inside the contours of ROI, the same voxels
+    as the mask of _mask_for_roi. The contours are drawn
+    inside their bounding box only.
+    '''
+
+    from skimage import draw
+
+    if not len(ROI):
+        return np.zeros(0, dtype=np.int64)
+
+    region = _contour_box(ROI, to_index, shape)
+
+    low = np.array([axis.start for axis in region])
+
+    box = np.zeros([axis.stop - axis.start for axis in region], dtype=bool)
+
+    for contour_coord in ROI:
+
+        points = to_index(contour_coord)
+
+        z_coord = int(round(points[0, 2])) - low[0]
+
+        if not 0 <= z_coord < box.shape[0]:
+            continue
+
+        coord_input = np.column_stack((points[:, 1] - low[1], points[:, 0] - low[2]))
+
+        box[z_coord] ^= draw.polygon2mask(box.shape[1:], coord_input)
+
+    found = np.nonzero(box)
+
+    return np.ravel_multi_index([found_axis + start for found_axis, start in zip(found, low)], shape)
@@ -0,0 +1,46 @@
+# Downloaded python packages
+import numpy as np
+from types import SimpleNamespace
+
+# From the Modules folder
+from DicomModules.Analysis_Modules.spatial_index import ContourIndex
+from DicomModules.Processing_Modules.contours import _segment_distances
+
+
+def _contour(points):
+
+    points = np.asarray(points, dtype=np.float64)
+
+    return SimpleNamespace(x_values=points[:, 0], y_values=points[:, 1], z_values=points[:, 2])
+
+
+def _long_edge_contour():
+
+    # Three long edges, then a dense zig-zag along y = 30 back to the start
+    zig_zag = [(x, 30.0 + 0.5 * (ind % 2), 0.0) for ind, x in enumerate(np.linspace(100, -100, 401))]
+
+    return [(-100.0, 0.0, 0.0), (100.0, 0.0, 0.0), (100.0, 30.0, 0.0)] + zig_zag
+
+
+def test_surface_distance_long_edge():
+
+    index = ContourIndex({'roi': [_contour(_long_edge_contour())]})
+
+    distance = index.SurfaceDistance([[0.0, 10.0, 0.0]])['roi']
+
+    assert np.allclose(distance, 10.0)
+
+
+def test_surface_distance_matches_brute_force():
+
+    points = np.asarray(_long_edge_contour())
+
+    index = ContourIndex({'roi': [_contour(points)]})
+
+    queries = np.random.default_rng(0).uniform(-150, 150, (2000, 3))
+
+    following = np.roll(points, -1, axis=0)
+
+    expected = np.min([_segment_distances(queries, start, end) for start, end in zip(points, following)], axis=0)
+
+    assert np.allclose(index.SurfaceDistance(queries)['roi'], expected)